@@ -0,0 +1,16 @@
+"""
+ASGI config for civitrack project.
+
+Serves the async views (project list and details, histories, PDF export)
+without tying up a thread per waiting request, e.g.:
+
+    uvicorn civitrack.asgi:application --workers 2
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'civitrack.settings')
+
+application = get_asgi_application()
@@ -0,0 +1,629 @@
+"""
+Build step for the site stylesheet (``python manage.py build_css``).
+
+The pages used to load Tailwind's Play CDN, which downloads the compiler and
+generates the utility classes in the browser on every page load. This module
+does that work once, ahead of time, and writes a single minified
+``static/css/app.css`` made of
+
+* the hand-written CSS in ``assets/css`` (Tailwind's preflight reset, the
+  component classes that lived in ``base.html`` and the analytics charts),
+  with rules whose classes no template uses dropped, and
+* one rule per Tailwind utility class found in the templates and form
+  widgets, generated from the part of Tailwind's default theme listed below
+  (plus arbitrary values such as ``text-[13px]`` and ``[box-shadow:...]``).
+
+Unknown classes are reported rather than guessed at. ``collectstatic`` then
+stores the file under a content-hashed name with gzip/brotli copies (see
+``civitrack/staticfiles.py``).
+
+Utilities are emitted ``!important``, as with Tailwind's ``important: true``:
+they replaced the templates' inline ``style`` attributes, which outranked
+component rules such as ``.table td``.
+"""
+import re
+from pathlib import Path
+
+
+SOURCE_FILES = ['preflight.css', 'base.css', 'components.css', 'analytics.css']
+
+# Where class names are looked for, relative to BASE_DIR
+CONTENT = ['templates/**/*.html', 'projects/**/*.py']
+
+# Classes only ever built at runtime, e.g. alert-{{ message.tags }}
+SAFELIST = {'alert-success', 'alert-error'}
+
+IMPORTANT = True
+
+BUILD_NOTE = '/* Built by `python manage.py build_css` from assets/css and the templates. Do not edit. */'
+
+
+# ═══════════════════════════════════════════════════════════
+# THEME (Tailwind v3 defaults, plus the site colours)
+# ═══════════════════════════════════════════════════════════
+
+def _rem(value):
+    return f'{value:g}rem' if value else '0px'
+
+
+SPACING = {'0': '0px', 'px': '1px'}
+SPACING.update({
+    f'{step:g}': _rem(step / 4)
+    for step in (0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 5, 6, 7, 8, 9, 10, 11, 12, 14, 16, 20, 24, 28, 32, 36, 40,
+                 44, 48, 52, 56, 60, 64, 72, 80, 96)
+})
+
+COLORS = {
+    'transparent': 'transparent',
+    'current': 'currentColor',
+    'white': '#fff',
+    'black': '#000',
+    'gray-50': '#f9fafb',
+    'gray-100': '#f3f4f6',
+    'gray-200': '#e5e7eb',
+    'gray-300': '#d1d5db',
+    'gray-400': '#9ca3af',
+    'gray-500': '#6b7280',
+    'gray-600': '#4b5563',
+    'gray-700': '#374151',
+    'gray-800': '#1f2937',
+    'gray-900': '#111827',
+    'gray-950': '#030712',
+    # Site palette (see the custom properties in assets/css/base.css)
+    'brand': '#e8834a',
+    'brand-dark': '#d4612a',
+    'ink': '#1a1a2e',
+    'surface': '#22223a',
+    'line': '#2e2e50',
+    'muted': '#666',
+    'subtle': '#888',
+    'faint': '#999',
+    'soft': '#aaa',
+    'pale': '#ddd',
+    'success': '#4caf50',
+    'danger': '#f44336',
+    'alert': '#ff5555',
+}
+
+FONT_SIZES = {
+    'xs': ('0.75rem', '1rem'),
+    'sm': ('0.875rem', '1.25rem'),
+    'base': ('1rem', '1.5rem'),
+    'lg': ('1.125rem', '1.75rem'),
+    'xl': ('1.25rem', '1.75rem'),
+    '2xl': ('1.5rem', '2rem'),
+    '3xl': ('1.875rem', '2.25rem'),
+    '4xl': ('2.25rem', '2.5rem'),
+    '5xl': ('3rem', '1'),
+    '6xl': ('3.75rem', '1'),
+}
+
+FONT_WEIGHTS = {
+    'thin': '100', 'extralight': '200', 'light': '300', 'normal': '400', 'medium': '500',
+    'semibold': '600', 'bold': '700', 'extrabold': '800', 'black': '900',
+}
+
+LEADING = {'none': '1', 'tight': '1.25', 'snug': '1.375', 'normal': '1.5', 'relaxed': '1.625', 'loose': '2'}
+
+TRACKING = {
+    'tighter': '-0.05em', 'tight': '-0.025em', 'normal': '0em',
+    'wide': '0.025em', 'wider': '0.05em', 'widest': '0.1em',
+}
+
+MAX_WIDTHS = {
+    'none': 'none', 'xs': '20rem', 'sm': '24rem', 'md': '28rem', 'lg': '32rem', 'xl': '36rem',
+    '2xl': '42rem', '3xl': '48rem', '4xl': '56rem', '5xl': '64rem', '6xl': '72rem', '7xl': '80rem',
+    'full': '100%', 'screen': '100vw',
+}
+
+RADII = {
+    'none': '0px', 'sm': '0.125rem', '': '0.25rem', 'md': '0.375rem', 'lg': '0.5rem',
+    'xl': '0.75rem', '2xl': '1rem', '3xl': '1.5rem', 'full': '9999px',
+}
+
+SHADOWS = {
+    'sm': '0 1px 2px 0 rgb(0 0 0 / 0.05)',
+    '': '0 1px 3px 0 rgb(0 0 0 / 0.1), 0 1px 2px -1px rgb(0 0 0 / 0.1)',
+    'md': '0 4px 6px -1px rgb(0 0 0 / 0.1), 0 2px 4px -2px rgb(0 0 0 / 0.1)',
+    'lg': '0 10px 15px -3px rgb(0 0 0 / 0.1), 0 4px 6px -4px rgb(0 0 0 / 0.1)',
+    'xl': '0 20px 25px -5px rgb(0 0 0 / 0.1), 0 8px 10px -6px rgb(0 0 0 / 0.1)',
+    '2xl': '0 25px 50px -12px rgb(0 0 0 / 0.25)',
+    'inner': 'inset 0 2px 4px 0 rgb(0 0 0 / 0.05)',
+    'none': 'none',
+}
+
+BREAKPOINTS = {'sm': '640px', 'md': '768px', 'lg': '1024px', 'xl': '1280px', '2xl': '1536px'}
+
+PSEUDO_VARIANTS = {
+    'hover': ':hover',
+    'focus': ':focus',
+    'active': ':active',
+    'disabled': ':disabled',
+    'first': ':first-child',
+    'last': ':last-child',
+}
+
+TRANSITIONS = {
+    '': 'color, background-color, border-color, text-decoration-color, fill, stroke, opacity, box-shadow, '
+        'transform, filter, backdrop-filter',
+    'all': 'all',
+    'colors': 'color, background-color, border-color, text-decoration-color, fill, stroke',
+    'opacity': 'opacity',
+    'shadow': 'box-shadow',
+    'transform': 'transform',
+}
+
+TRANSFORM = 'transform: translate(var(--tw-translate-x), var(--tw-translate-y))'
+
+STATIC_UTILITIES = {
+    'block': 'display: block',
+    'inline-block': 'display: inline-block',
+    'inline': 'display: inline',
+    'flex': 'display: flex',
+    'inline-flex': 'display: inline-flex',
+    'grid': 'display: grid',
+    'table': 'display: table',
+    'hidden': 'display: none',
+    'static': 'position: static',
+    'fixed': 'position: fixed',
+    'absolute': 'position: absolute',
+    'relative': 'position: relative',
+    'sticky': 'position: sticky',
+    'flex-1': 'flex: 1 1 0%',
+    'flex-auto': 'flex: 1 1 auto',
+    'flex-none': 'flex: none',
+    'flex-row': 'flex-direction: row',
+    'flex-col': 'flex-direction: column',
+    'flex-wrap': 'flex-wrap: wrap',
+    'flex-nowrap': 'flex-wrap: nowrap',
+    'grow': 'flex-grow: 1',
+    'shrink-0': 'flex-shrink: 0',
+    'items-start': 'align-items: flex-start',
+    'items-end': 'align-items: flex-end',
+    'items-center': 'align-items: center',
+    'items-baseline': 'align-items: baseline',
+    'items-stretch': 'align-items: stretch',
+    'justify-start': 'justify-content: flex-start',
+    'justify-end': 'justify-content: flex-end',
+    'justify-center': 'justify-content: center',
+    'justify-between': 'justify-content: space-between',
+    'justify-around': 'justify-content: space-around',
+    'text-left': 'text-align: left',
+    'text-center': 'text-align: center',
+    'text-right': 'text-align: right',
+    'uppercase': 'text-transform: uppercase',
+    'underline': 'text-decoration-line: underline',
+    'no-underline': 'text-decoration-line: none',
+    'truncate': 'overflow: hidden; text-overflow: ellipsis; white-space: nowrap',
+    'text-ellipsis': 'text-overflow: ellipsis',
+    'whitespace-nowrap': 'white-space: nowrap',
+    'overflow-hidden': 'overflow: hidden',
+    'overflow-auto': 'overflow: auto',
+    'overflow-x-auto': 'overflow-x: auto',
+    'overflow-y-auto': 'overflow-y: auto',
+    'cursor-pointer': 'cursor: pointer',
+    'cursor-default': 'cursor: default',
+    'pointer-events-none': 'pointer-events: none',
+    'pointer-events-auto': 'pointer-events: auto',
+    'align-middle': 'vertical-align: middle',
+    'bg-none': 'background-image: none',
+    'border': 'border-width: 1px',
+    'transform': TRANSFORM,
+    'transform-none': 'transform: none',
+}
+
+
+# ═══════════════════════════════════════════════════════════
+# UTILITY RESOLUTION
+# ═══════════════════════════════════════════════════════════
+
+def _arbitrary(value):
+    # text-[13px], [box-shadow:0_2px_8px_#000]: underscores stand for spaces
+    if value.startswith('[') and value.endswith(']') and len(value) > 2:
+        return value[1:-1].replace('_', ' ')
+    return None
+
+
+def _is_color(value):
+    return value.startswith(('#', 'rgb', 'hsl')) or value in ('white', 'black', 'transparent', 'none')
+
+
+def _color(value):
+    arbitrary = _arbitrary(value)
+    if arbitrary is not None:
+        return arbitrary if _is_color(arbitrary) else None
+    return COLORS.get(value)
+
+
+def _length(value, scale, negative=False, fractions=True, extra=None):
+    if extra and value in extra:
+        result = extra[value]
+    elif value in scale:
+        result = scale[value]
+    elif fractions and re.fullmatch(r'\d+/\d+', value):
+        numerator, denominator = (int(part) for part in value.split('/'))
+        result = f'{round(numerator / denominator * 100, 6):g}%'
+    else:
+        result = _arbitrary(value)
+        if result is None or _is_color(result):
+            return None
+    if negative:
+        return None if result in ('auto', '0px') else f'calc({result} * -1)'
+    return result
+
+
+def _sides(prefix, properties):
+    # p -> padding, px -> padding-left/right, ...
+    return {
+        prefix: [properties['']],
+        prefix + 'x': [properties['l'], properties['r']],
+        prefix + 'y': [properties['t'], properties['b']],
+        prefix + 't': [properties['t']],
+        prefix + 'r': [properties['r']],
+        prefix + 'b': [properties['b']],
+        prefix + 'l': [properties['l']],
+    }
+
+
+_BOX = {
+    side: {'': base, 't': f'{base}-top', 'r': f'{base}-right', 'b': f'{base}-bottom', 'l': f'{base}-left'}
+    for side, base in (('p', 'padding'), ('m', 'margin'))
+}
+PADDING = _sides('p', _BOX['p'])
+MARGIN = _sides('m', _BOX['m'])
+INSET = {
+    'inset': ['top', 'right', 'bottom', 'left'],
+    'inset-x': ['left', 'right'],
+    'inset-y': ['top', 'bottom'],
+    'top': ['top'], 'right': ['right'], 'bottom': ['bottom'], 'left': ['left'],
+}
+BORDER_SIDES = {'': 'border-width', 't': 'border-top-width', 'r': 'border-right-width',
+                'b': 'border-bottom-width', 'l': 'border-left-width'}
+RADIUS_SIDES = {
+    '': ['border-radius'],
+    't': ['border-top-left-radius', 'border-top-right-radius'],
+    'r': ['border-top-right-radius', 'border-bottom-right-radius'],
+    'b': ['border-bottom-right-radius', 'border-bottom-left-radius'],
+    'l': ['border-top-left-radius', 'border-bottom-left-radius'],
+}
+GRADIENT_DIRECTIONS = {'t': 'top', 'tr': 'top right', 'r': 'right', 'br': 'bottom right',
+                       'b': 'bottom', 'bl': 'bottom left', 'l': 'left', 'tl': 'top left'}
+SIZES = {'auto': 'auto', 'full': '100%', 'min': 'min-content', 'max': 'max-content', 'fit': 'fit-content'}
+
+
+def _declarations(properties, value):
+    return '; '.join(f'{prop}: {value}' for prop in properties)
+
+
+def _resolve(name):
+    """Return ``(group, declarations, selector_suffix)`` for a utility without variants, or None."""
+    if name in STATIC_UTILITIES:
+        return 'static', STATIC_UTILITIES[name], ''
+
+    arbitrary = _arbitrary(name)
+    if arbitrary is not None:
+        prop, _, value = arbitrary.partition(':')
+        if re.fullmatch(r'-?[a-z-]+', prop) and value:
+            return 'arbitrary', f'{prop}: {value}', ''
+        return None
+
+    negative = name.startswith('-')
+    base = name[1:] if negative else name
+    key, _, value = base.partition('-')
+
+    # Spacing: p-4, px-6, -mt-2, mx-auto, space-y-3, gap-x-2
+    for table, group in ((PADDING, 'padding'), (MARGIN, 'margin')):
+        if key in table and value:
+            extra = {'auto': 'auto'} if group == 'margin' else None
+            length = _length(value, SPACING, negative, fractions=False, extra=extra)
+            if length is None or (negative and group == 'padding'):
+                return None
+            return f'{group}-{len(key)}', _declarations(table[key], length), ''
+    if key == 'space' and value[:2] in ('x-', 'y-'):
+        length = _length(value[2:], SPACING, negative, fractions=False)
+        if length is None:
+            return None
+        prop = 'margin-left' if value[0] == 'x' else 'margin-top'
+        return 'space', f'{prop}: {length}', ' > :not([hidden]) ~ :not([hidden])'
+    if key == 'gap' and not negative:
+        if value[:2] in ('x-', 'y-'):
+            prop, value = ('column-gap' if value[0] == 'x' else 'row-gap'), value[2:]
+        else:
+            prop = 'gap'
+        length = _length(value, SPACING, fractions=False)
+        return ('gap', f'{prop}: {length}', '') if length else None
+
+    # Position offsets: top-0, -left-16, left-1/2, inset-x-0
+    for prefix in sorted(INSET, key=len, reverse=True):
+        if base.startswith(prefix + '-'):
+            length = _length(base[len(prefix) + 1:], SPACING, negative, extra={'auto': 'auto', 'full': '100%'})
+            if length is None:
+                return None
+            return f'inset-{len(INSET[prefix])}', _declarations(INSET[prefix], length), ''
+    if key == 'z' and not negative:
+        if value == 'auto' or value.isdigit():
+            return 'z', f'z-index: {value}', ''
+        arbitrary = _arbitrary(value)
+        return ('z', f'z-index: {arbitrary}', '') if arbitrary else None
+
+    # Sizing: w-full, h-64, min-h-screen, max-w-2xl, w-[90px]
+    if key in ('w', 'h') and not negative:
+        screen = '100vw' if key == 'w' else '100vh'
+        length = _length(value, SPACING, extra=dict(SIZES, screen=screen))
+        return ('size', f'{"width" if key == "w" else "height"}: {length}', '') if length else None
+    if key in ('min', 'max') and value[:2] in ('w-', 'h-') and not negative:
+        prop = f'{key}-{"width" if value[0] == "w" else "height"}'
+        if key == 'max' and value[0] == 'w':
+            length = _length(value[2:], {}, fractions=False, extra=MAX_WIDTHS)
+        else:
+            screen = '100vw' if value[0] == 'w' else '100vh'
+            length = _length(value[2:], SPACING, extra=dict(SIZES, screen=screen))
+        return ('size', f'{prop}: {length}', '') if length else None
+
+    # Translate: -translate-x-1/2
+    if key == 'translate' and value[:2] in ('x-', 'y-'):
+        length = _length(value[2:], SPACING, negative, extra={'full': '100%'})
+        if length is None:
+            return None
+        return 'translate', f'--tw-translate-{value[0]}: {length}; {TRANSFORM}', ''
+
+    if negative:
+        return None
+
+    # Typography: text-sm, text-[13px], text-gray-400, font-bold, leading-tight
+    if key == 'text':
+        if value in FONT_SIZES:
+            size, line_height = FONT_SIZES[value]
+            return 'font-size', f'font-size: {size}; line-height: {line_height}', ''
+        color = _color(value)
+        if color is not None:
+            return 'text-color', f'color: {color}', ''
+        arbitrary = _arbitrary(value)
+        return ('font-size', f'font-size: {arbitrary}', '') if arbitrary else None
+    if key == 'font':
+        if value in FONT_WEIGHTS:
+            return 'font-weight', f'font-weight: {FONT_WEIGHTS[value]}', ''
+        return None
+    if key == 'leading':
+        if value in LEADING:
+            return 'leading', f'line-height: {LEADING[value]}', ''
+        length = _length(value, SPACING, fractions=False)
+        return ('leading', f'line-height: {length}', '') if length else None
+    if key == 'tracking':
+        return ('tracking', f'letter-spacing: {TRACKING[value]}', '') if value in TRACKING else None
+
+    # Backgrounds: bg-white, bg-[#f5f5f5], bg-gradient-to-br from-gray-900 to-black
+    if key == 'bg':
+        if value.startswith('gradient-to-') and value[12:] in GRADIENT_DIRECTIONS:
+            direction = GRADIENT_DIRECTIONS[value[12:]]
+            return 'bg-image', f'background-image: linear-gradient(to {direction}, var(--tw-gradient-stops))', ''
+        color = _color(value)
+        return ('bg-color', f'background-color: {color}', '') if color else None
+    if key in ('from', 'via', 'to'):
+        color = _color(value)
+        if color is None:
+            return None
+        if key == 'from':
+            return 'gradient-1', (f'--tw-gradient-from: {color}; --tw-gradient-to: transparent; '
+                                  '--tw-gradient-stops: var(--tw-gradient-from), var(--tw-gradient-to)'), ''
+        if key == 'via':
+            return 'gradient-2', (f'--tw-gradient-to: transparent; --tw-gradient-stops: '
+                                  f'var(--tw-gradient-from), {color}, var(--tw-gradient-to)'), ''
+        return 'gradient-3', f'--tw-gradient-to: {color}', ''
+
+    # Borders: border-2, border-t, border-[#e5e5e5], rounded-xl, rounded-t-[3px]
+    if key == 'border':
+        side, _, width = value.partition('-') if value[:1] in 'trbl' and value[1:2] in ('', '-') else ('', '', value)
+        if width == '' and side:
+            return f'border-{len(side)}', f'{BORDER_SIDES[side]}: 1px', ''
+        if width.isdigit():
+            return f'border-{len(side)}', f'{BORDER_SIDES[side]}: {width}px', ''
+        color = _color(width)
+        if color is not None:
+            prop = f'border-{GRADIENT_DIRECTIONS[side]}-color' if side else 'border-color'
+            return 'border-color', f'{prop}: {color}', ''
+        arbitrary = _arbitrary(width)
+        return (f'border-{len(side)}', f'{BORDER_SIDES[side]}: {arbitrary}', '') if arbitrary else None
+    if key == 'rounded' or base == 'rounded':
+        side, _, size = value.partition('-') if value[:1] in 'trbl' and value[1:2] in ('', '-') else ('', '', value)
+        radius = RADII.get(size) or _arbitrary(size)
+        if radius is None:
+            return None
+        return f'rounded-{len(side)}', _declarations(RADIUS_SIDES[side], radius), ''
+
+    # Effects: shadow-xl, opacity-90, transition-colors
+    if key == 'shadow' or base == 'shadow':
+        shadow = SHADOWS.get(value) or _arbitrary(value)
+        return ('shadow', f'box-shadow: {shadow}', '') if shadow else None
+    if key == 'opacity' and value.isdigit():
+        return 'opacity', f'opacity: {int(value) / 100:g}', ''
+    if key == 'transition' or base == 'transition':
+        if value not in TRANSITIONS:
+            return None
+        return 'transition', (f'transition-property: {TRANSITIONS[value]}; '
+                              'transition-timing-function: cubic-bezier(0.4, 0, 0.2, 1); '
+                              'transition-duration: 150ms'), ''
+    if key == 'duration' and value.isdigit():
+        return 'duration', f'transition-duration: {value}ms', ''
+    return None
+
+
+# Order utilities are written in, so shorthands come before the longhands
+# that refine them (p-4 px-6 means 1rem vertically, 1.5rem horizontally)
+GROUP_ORDER = [
+    'static', 'inset-4', 'inset-2', 'inset-1', 'z', 'margin-1', 'margin-2', 'padding-1', 'padding-2',
+    'space', 'gap', 'size', 'translate', 'font-size', 'font-weight', 'leading', 'tracking', 'text-color',
+    'bg-color', 'bg-image', 'gradient-1', 'gradient-2', 'gradient-3', 'border-0', 'border-1', 'border-color',
+    'rounded-0', 'rounded-1', 'shadow', 'opacity', 'transition', 'duration', 'arbitrary',
+]
+
+
+def escape_class(name):
+    """CSS-escape a class name for use in a selector (``w-1/2`` -> ``w-1\\/2``)."""
+    return re.sub(r'([^\w-])', r'\\\1', name)
+
+
+def utility_rule(name):
+    """Return ``(sort_key, css)`` for a utility class name, or None if it is not one."""
+    important = IMPORTANT or name.startswith('!')
+    parts = re.split(r':(?![^\[]*\])', name.lstrip('!'))
+    *variants, base = parts
+    resolved = _resolve(base)
+    if resolved is None:
+        return None
+    group, declarations, suffix = resolved
+
+    media = pseudo = ''
+    for variant in variants:
+        if variant in BREAKPOINTS and not media:
+            media = BREAKPOINTS[variant]
+        elif variant in PSEUDO_VARIANTS and not pseudo:
+            pseudo = PSEUDO_VARIANTS[variant]
+        else:
+            return None
+
+    if important:
+        declarations = '; '.join(f'{declaration.strip()} !important' for declaration in declarations.split('; '))
+    rule = f'.{escape_class(name)}{pseudo}{suffix} {{ {declarations} }}'
+    if media:
+        rule = f'@media (min-width: {media}) {{ {rule} }}'
+    breakpoint = list(BREAKPOINTS).index(variants[0]) + 1 if media else 0
+    return (breakpoint, bool(pseudo), GROUP_ORDER.index(group), name), rule
+
+
+# ═══════════════════════════════════════════════════════════
+# CONTENT SCANNING
+# ═══════════════════════════════════════════════════════════
+
+_TEMPLATE_TAG = re.compile(r'{%.*?%}|{{.*?}}|{#.*?#}', re.S)
+_CLASS_ATTRIBUTE = re.compile(r'''\bclass\s*=\s*(?:"([^"]*)"|'([^']*)')''')
+_WIDGET_CLASS = re.compile(r'''['"]class['"]\s*:\s*(?:"([^"]*)"|'([^']*)')''')
+
+
+def used_classes(base_dir):
+    """Class names in ``class`` attributes of the templates and form widget attrs."""
+    found = set(SAFELIST)
+    for pattern in CONTENT:
+        for path in sorted(Path(base_dir).glob(pattern)):
+            text = path.read_text(encoding='utf-8')
+            regex = _CLASS_ATTRIBUTE if path.suffix == '.html' else _WIDGET_CLASS
+            for match in regex.finditer(text):
+                value = _TEMPLATE_TAG.sub(' ', match.group(1) if match.group(1) is not None else match.group(2))
+                found.update(token for token in value.split() if not token.endswith('-'))
+    return found
+
+
+# ═══════════════════════════════════════════════════════════
+# CSS SOURCES: PARSING, PURGING, MINIFYING
+# ═══════════════════════════════════════════════════════════
+
+_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_SELECTOR_CLASS = re.compile(r'\.((?:\\.|[\w-])+)')
+
+
+def parse_css(text):
+    """Split CSS into ``(prelude, body)`` pairs; a block at-rule's body is a nested list.
+
+    Only what the source files need: no strings containing braces.
+    """
+    text = _COMMENT.sub('', text)
+    rules, position = [], 0
+    while True:
+        start = text.find('{', position)
+        if start == -1:
+            break
+        prelude = text[position:start].strip()
+        depth, end = 1, start + 1
+        while depth:
+            depth += {'{': 1, '}': -1}.get(text[end], 0)
+            end += 1
+        body = text[start + 1:end - 1]
+        if prelude.startswith(('@media', '@supports')):
+            body = parse_css(body)
+        rules.append((prelude, body))
+        position = end
+    return rules
+
+
+def purge(rules, classes):
+    """Drop style rules none of whose selectors can match, judging by class names alone."""
+    kept = []
+    for prelude, body in rules:
+        if isinstance(body, list):
+            body = purge(body, classes)
+            if body:
+                kept.append((prelude, body))
+            continue
+        if not prelude.startswith('@'):
+            selectors = [
+                selector for selector in prelude.split(',')
+                if all(name.replace('\\', '') in classes for name in _SELECTOR_CLASS.findall(selector))
+            ]
+            if not selectors:
+                continue
+            prelude = ','.join(selectors)
+        kept.append((prelude, body))
+    return kept
+
+
+def _minify_prelude(prelude):
+    prelude = re.sub(r'\s+', ' ', prelude.strip())
+    return re.sub(r'\s*([>,~+])\s*', r'\1', prelude) if not prelude.startswith('@') else prelude
+
+
+def _minify_declarations(body):
+    body = re.sub(r'\s+', ' ', body.strip())
+    body = re.sub(r'\s*([;{}])\s*', r'\1', body)
+    body = re.sub(r'\s*:\s*', ':', body)
+    body = re.sub(r'\s*!important', '!important', body)
+    body = re.sub(r',\s+', ',', body)
+    return body.rstrip(';')
+
+
+def minify(rules):
+    out = []
+    for prelude, body in rules:
+        if isinstance(body, list):
+            out.append(f'{_minify_prelude(prelude)}{{{minify(body)}}}')
+        elif prelude.startswith('@keyframes'):
+            # Keyframe selectors (from, to, 50%) are declarations blocks in turn
+            frames = ''.join(f'{_minify_prelude(frame)}{{{_minify_declarations(frame_body)}}}'
+                             for frame, frame_body in parse_css(body))
+            out.append(f'{_minify_prelude(prelude)}{{{frames}}}')
+        else:
+            out.append(f'{_minify_prelude(prelude)}{{{_minify_declarations(body)}}}')
+    return ''.join(out)
+
+
+# ═══════════════════════════════════════════════════════════
+# BUILD
+# ═══════════════════════════════════════════════════════════
+
+def build(base_dir):
+    """Return ``(css, unknown_classes)`` for the current templates."""
+    base_dir = Path(base_dir)
+    classes = used_classes(base_dir)
+    source = '\n'.join((base_dir / 'assets' / 'css' / name).read_text(encoding='utf-8') for name in SOURCE_FILES)
+    components = parse_css(source)
+    defined = {name.replace('\\', '') for prelude, _ in _flatten(components)
+               for name in _SELECTOR_CLASS.findall(prelude)}
+
+    utilities, unknown = [], []
+    for name in sorted(classes):
+        rule = utility_rule(name)
+        if rule is not None:
+            utilities.append(rule)
+        elif name not in defined:
+            unknown.append(name)
+    utilities.sort()
+
+    css = minify(purge(components, classes)) + minify(parse_css(''.join(rule for _, rule in utilities)))
+    return f'{BUILD_NOTE}\n{css}\n', unknown
+
+
+def _flatten(rules):
+    for prelude, body in rules:
+        if isinstance(body, list):
+            yield from _flatten(body)
+        elif not prelude.startswith('@'):
+            yield prelude, body
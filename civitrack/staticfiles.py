@@ -0,0 +1,111 @@
+"""
+Static file storage and serving for production.
+
+``collectstatic`` goes through ``CompressedManifestStaticFilesStorage``:
+Django's ``ManifestStaticFilesStorage`` copies every file under a name with
+a hash of its content (``css/app.3f2a1c9e8b7d.css``) and ``{% static %}``
+links to that name, so a changed file always gets a new URL and browsers
+may cache the old ones forever. Text files are also written gzip-compressed
+next to the originals (``.gz``, and ``.br`` when the ``brotli`` package is
+installed) so nothing compresses them per request.
+
+The web server in front of the app should serve ``STATIC_ROOT`` itself (see
+README, "Static files"). For single-box installs without one,
+``CIVITRACK_SERVE_STATIC`` routes ``STATIC_URL`` to ``serve``, which picks
+the precompressed copy the browser accepts and sends hashed files with a
+one-year ``immutable`` ``Cache-Control``.
+"""
+import gzip
+import mimetypes
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:  # optional: gzip copies only
+    brotli = None
+
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico', '.ttf', '.eot'}
+# Keep a compressed copy only if it saves at least this fraction
+MIN_SAVING = 0.05
+
+HASHED_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Unhashed names (admin images referenced by absolute URL, files outside the
+# manifest) can change in place on the next deploy
+UNHASHED_CACHE_CONTROL = 'public, max-age=300'
+
+
+def _encoders():
+    encoders = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        encoders.insert(0, ('.br', lambda data: brotli.compress(data, quality=11)))
+    return encoders
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        names = set(self.hashed_files) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if Path(name).suffix.lower() in COMPRESSIBLE_EXTENSIONS and self.exists(name):
+                self.compress(name)
+
+    def compress(self, name):
+        with self.open(name) as source:
+            data = source.read()
+        for suffix, encode in _encoders():
+            compressed = encode(data)
+            target = Path(self.path(name + suffix))
+            if len(compressed) <= len(data) * (1 - MIN_SAVING):
+                target.write_bytes(compressed)
+            elif target.exists():
+                target.unlink()
+
+
+def _hashed_names():
+    return set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+def serve(request, path):
+    """Serve a file from ``STATIC_ROOT``, preferring a precompressed copy."""
+    try:
+        fullpath = Path(safe_join(settings.STATIC_ROOT, path))
+    except SuspiciousFileOperation:
+        raise Http404
+    if not fullpath.is_file():
+        raise Http404
+
+    content_type, encoding = mimetypes.guess_type(path)
+    content_type = content_type or 'application/octet-stream'
+    served, content_encoding = fullpath, encoding
+    if not encoding:
+        accepted = request.headers.get('Accept-Encoding', '')
+        for suffix, name in (('.br', 'br'), ('.gz', 'gzip')):
+            candidate = fullpath.with_name(fullpath.name + suffix)
+            if re.search(rf'\b{name}\b', accepted) and candidate.is_file():
+                served, content_encoding = candidate, name
+                break
+
+    hashed = path in _hashed_names()
+    stat = fullpath.stat()
+    if not hashed and not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        return HttpResponseNotModified()
+
+    response = FileResponse(served.open('rb'), content_type=content_type)
+    if content_encoding:
+        response['Content-Encoding'] = content_encoding
+    response['Vary'] = 'Accept-Encoding'
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = HASHED_CACHE_CONTROL if hashed else UNHASHED_CACHE_CONTROL
+    return response
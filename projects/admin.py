@@ -1,21 +1,34 @@
 from django.contrib import admin
-from .models import Project, Branch, SubBranch, ReleasedHistory
+from .models import Project, Branch, SubBranch, ReleasedHistory, ExportJob
+
+
+class SoftDeleteAdmin(admin.ModelAdmin):
+    # Soft-deleted rows stay listed until purge_deleted removes them
+    def get_queryset(self, request):
+        queryset = self.model.all_objects.get_queryset()
+        ordering = self.get_ordering(request)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return queryset
 
 
 @admin.register(Project)
-class ProjectAdmin(admin.ModelAdmin):
-    list_display = ('name', 'user', 'amount', 'start_date', 'total_released')
-    list_filter = ('created_at', 'start_date')
+class ProjectAdmin(SoftDeleteAdmin):
+    list_display = ('name', 'user', 'amount', 'start_date', 'total_released', 'archived_at', 'deleted_at')
+    list_filter = (
+        'created_at', 'start_date',
+        ('archived_at', admin.EmptyFieldListFilter), ('deleted_at', admin.EmptyFieldListFilter),
+    )
     search_fields = ('name', 'user__username')
-    readonly_fields = ('created_at',)
+    readonly_fields = ('total_released', 'content_version', 'created_at', 'archived_at', 'deleted_at')
 
 
 @admin.register(Branch)
-class BranchAdmin(admin.ModelAdmin):
-    list_display = ('name', 'project', 'total_spent')
-    list_filter = ('created_at',)
+class BranchAdmin(SoftDeleteAdmin):
+    list_display = ('name', 'project', 'total_spent', 'deleted_at')
+    list_filter = ('created_at', ('deleted_at', admin.EmptyFieldListFilter))
     search_fields = ('name', 'project__name')
-    readonly_fields = ('created_at',)
+    readonly_fields = ('total_spent', 'created_at', 'deleted_at')
 
 
 @admin.register(SubBranch)
@@ -32,3 +45,11 @@ class ReleasedHistoryAdmin(admin.ModelAdmin):
     list_filter = ('date', 'created_at')
     search_fields = ('project__name',)
     readonly_fields = ('created_at',)
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('project', 'user', 'status', 'content_version', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('project__name', 'user__username')
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
@@ -0,0 +1,181 @@
+"""
+Spending over time for the analytics page.
+
+Everything here reads the pre-aggregated ``SpendRollup`` rows maintained by
+``projects.rollups``: a chart over several years touches one row per month
+and metric, however many entries the project holds.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Sum
+
+from .models import SpendRollup
+from .rollups import ZERO
+
+
+# Months averaged for the burn rate
+BURN_RATE_MONTHS = 3
+DAILY_CHART_DAYS = 30
+# Longest range drawn month by month
+MAX_MONTHS = 120
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def parse_month(value):
+    """``YYYY-MM`` as the first day of that month, or None."""
+    try:
+        return datetime.datetime.strptime(value or '', '%Y-%m').date()
+    except ValueError:
+        return None
+
+
+def month_range(project, first=None, last=None, today=None):
+    """
+    The months to chart: by default from the project's start to this month,
+    limited to the last ``MAX_MONTHS``.
+    """
+    today = today or datetime.date.today()
+    last = month_start(last or today)
+    first = month_start(first or project.start_date)
+    if first > last:
+        first, last = last, first
+    return max(first, add_months(last, 1 - MAX_MONTHS)), last
+
+
+def _percent(value, scale):
+    if not scale:
+        return 0
+    return max(0, min(100, round(float(value) / float(scale) * 100, 1)))
+
+
+def _project_rows(project, period):
+    return SpendRollup.objects.filter(project=project, branch__isnull=True, period=period)
+
+
+def monthly_series(project, first, last):
+    """
+    One dict per month from ``first`` to ``last`` with what was spent and
+    released in it and the running totals since the project began.
+
+    Two queries: the months in range, and one sum of the months before it to
+    seed the running totals.
+    """
+    totals = defaultdict(lambda: ZERO)
+    rows = (_project_rows(project, SpendRollup.PERIOD_MONTH)
+            .filter(start__range=(first, last))
+            .values_list('metric', 'start', 'amount'))
+    for metric, start, amount in rows:
+        totals[metric, start] = amount
+
+    carried = dict(
+        _project_rows(project, SpendRollup.PERIOD_MONTH)
+        .filter(start__lt=first)
+        .order_by()
+        .values('metric')
+        .annotate(total=Sum('amount'))
+        .values_list('metric', 'total')
+    )
+    cumulative_spent = carried.get(SpendRollup.METRIC_SPENT) or ZERO
+    cumulative_released = carried.get(SpendRollup.METRIC_RELEASED) or ZERO
+
+    series = []
+    month = first
+    while month <= last:
+        spent = totals[SpendRollup.METRIC_SPENT, month]
+        released = totals[SpendRollup.METRIC_RELEASED, month]
+        cumulative_spent += spent
+        cumulative_released += released
+        series.append({
+            'month': month,
+            'spent': spent,
+            'released': released,
+            'cumulative_spent': cumulative_spent,
+            'cumulative_released': cumulative_released,
+        })
+        month = add_months(month, 1)
+    return series
+
+
+def daily_spending(project, last_day, days=DAILY_CHART_DAYS):
+    """Spending per day for the ``days`` days ending on ``last_day``."""
+    first_day = last_day - datetime.timedelta(days=days - 1)
+    amounts = dict(
+        _project_rows(project, SpendRollup.PERIOD_DAY)
+        .filter(metric=SpendRollup.METRIC_SPENT, start__range=(first_day, last_day))
+        .values_list('start', 'amount')
+    )
+    return [
+        {'day': day, 'spent': amounts.get(day, ZERO)}
+        for day in (first_day + datetime.timedelta(days=i) for i in range(days))
+    ]
+
+
+def branch_spending(project, first, last):
+    """Spending per branch over the months in range, largest first."""
+    return list(
+        SpendRollup.objects.filter(
+            project=project,
+            branch__isnull=False,
+            branch__deleted_at__isnull=True,
+            metric=SpendRollup.METRIC_SPENT,
+            period=SpendRollup.PERIOD_MONTH,
+            start__range=(first, last),
+        )
+        .order_by()
+        .values('branch_id', 'branch__name')
+        .annotate(total=Sum('amount'))
+        .order_by('-total')
+    )
+
+
+def project_analytics(project, first, last, today=None):
+    """Everything the analytics page shows, with bar heights in percent."""
+    today = today or datetime.date.today()
+    series = monthly_series(project, first, last)
+    daily = daily_spending(project, min(today, add_months(last, 1) - datetime.timedelta(days=1)))
+    branches = branch_spending(project, first, last)
+
+    recent = series[-BURN_RATE_MONTHS:]
+    burn_rate = sum((month['spent'] for month in recent), ZERO) / len(recent)
+    spent_to_date = series[-1]['cumulative_spent']
+    unspent_budget = project.amount - spent_to_date
+    runway = (unspent_budget / burn_rate).quantize(Decimal('0.1')) if burn_rate > 0 and unspent_budget > 0 else None
+
+    bar_scale = max([max(m['spent'], m['released']) for m in series] + [ZERO])
+    cumulative_scale = max([project.amount] + [max(m['cumulative_spent'], m['cumulative_released']) for m in series])
+    for month in series:
+        month['spent_pct'] = _percent(month['spent'], bar_scale)
+        month['released_pct'] = _percent(month['released'], bar_scale)
+        month['cumulative_spent_pct'] = _percent(month['cumulative_spent'], cumulative_scale)
+        month['cumulative_released_pct'] = _percent(month['cumulative_released'], cumulative_scale)
+
+    daily_scale = max([day['spent'] for day in daily] + [ZERO])
+    for day in daily:
+        day['spent_pct'] = _percent(day['spent'], daily_scale)
+
+    branch_scale = branches[0]['total'] if branches else ZERO
+    for branch in branches:
+        branch['pct'] = _percent(branch['total'], branch_scale)
+
+    return {
+        'series': series,
+        'daily': daily,
+        'branches': branches,
+        'burn_rate': burn_rate.quantize(ZERO),
+        'burn_rate_months': len(recent),
+        'spent_to_date': spent_to_date,
+        'released_to_date': series[-1]['cumulative_released'],
+        'unspent_budget': unspent_budget,
+        'runway_months': runway,
+        'budget_pct': _percent(project.amount, cumulative_scale),
+    }
@@ -0,0 +1,380 @@
+"""
+Versioned JSON API for the mobile field app, mounted under ``/api/v1/``.
+
+    GET  session/                          current user and CSRF token
+    POST session/                          log in with ``email`` and ``password``
+    GET  projects/            POST         the user's projects
+    GET  projects/<id>/                    one project
+    GET  branches/?project=1,2             POST (with ``project_id``)
+    GET  subbranches/?branch=1,2           POST (with ``branch_id``), or ?project=
+    GET  releases/?project=1,2             POST (with ``project_id``)
+    GET  changes/?since=<cursor>           what changed after a sync cursor
+
+List endpoints return ``{"results": [...], "next": <url or null>}`` ordered by
+id and keyset-paginated (``?page_size=`` up to 1000), so a client can fetch
+the children of many parents in a handful of calls. ``?fields=id,name`` limits
+both the output and the columns read.
+
+Every GET carries an ETag built from the ``content_version`` of the projects
+it covers. A conditional GET for unchanged data is answered ``304`` after one
+small query, before any rows are read.
+
+Requests use the normal session, so POSTs need the CSRF token returned by
+``GET session/``. Errors are JSON (``{"error": ..., "errors": {...}}``) and an
+anonymous request gets 401 rather than a login redirect.
+
+A project with ``archived_at`` set is read-only: POSTs below it get 409, and
+its expenses and releases are no longer listed (see projects.archives).
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.contrib.auth import authenticate, login
+from django.http import Http404, JsonResponse
+from django.middleware.csrf import get_token
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from . import changefeed
+from .forms import ProjectForm, BranchForm, SubBranchForm, ReleasedHistoryForm
+from .models import Project, Branch, SubBranch, ReleasedHistory, ChangeLog
+from .pagination import paginate, page_size_from, encode_cursor, decode_cursor
+
+
+API_VERSION = 'v1'
+API_MAX_PAGE_SIZE = 1000
+# Most parent ids accepted by one batch request (?project= / ?branch=)
+MAX_BATCH_IDS = 500
+API_ORDERING = ('id',)
+
+PROJECT_FIELDS = (
+    'id', 'name', 'amount', 'start_date', 'total_released', 'content_version', 'archived_at', 'created_at',
+)
+BRANCH_FIELDS = ('id', 'project_id', 'name', 'total_spent', 'created_at')
+SUBBRANCH_FIELDS = ('id', 'branch_id', 'name', 'amount', 'date', 'created_at')
+RELEASE_FIELDS = ('id', 'project_id', 'amount', 'date', 'created_at')
+
+# Model and fields sent for each change-log kind
+SYNCED_KINDS = {
+    changefeed.KIND_PROJECT: (Project, PROJECT_FIELDS),
+    changefeed.KIND_BRANCH: (Branch, BRANCH_FIELDS),
+    changefeed.KIND_SUBBRANCH: (SubBranch, SUBBRANCH_FIELDS),
+    changefeed.KIND_RELEASE: (ReleasedHistory, RELEASE_FIELDS),
+}
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400, errors=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.errors = errors
+
+
+def _error_response(message, status, errors=None):
+    payload = {'error': message}
+    if errors:
+        payload['errors'] = errors
+    return JsonResponse(payload, status=status)
+
+
+def api_view(methods, login_required=True):
+    """Turn auth failures, 404s and ``ApiError`` into JSON responses."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                response = _error_response('Method not allowed.', 405)
+                response['Allow'] = ', '.join(methods)
+                return response
+            if login_required and not request.user.is_authenticated:
+                return _error_response('Authentication required.', 401)
+            try:
+                return view(request, *args, **kwargs)
+            except ApiError as exc:
+                return _error_response(exc.message, exc.status, exc.errors)
+            except Http404:
+                return _error_response('Not found.', 404)
+        return wrapper
+    return decorator
+
+
+# ═══════════════════════════════════════════════════════════
+# REQUEST PARSING
+# ═══════════════════════════════════════════════════════════
+def _request_data(request):
+    if request.content_type != 'application/json':
+        return request.POST
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        raise ApiError('Request body is not valid JSON.')
+    if not isinstance(data, dict):
+        raise ApiError('Request body must be a JSON object.')
+    return data
+
+
+def _selected_fields(request, available):
+    """The fields named by ``?fields=``, in request order; all of them by default."""
+    raw = request.GET.get('fields', '')
+    fields = tuple(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    if not fields:
+        return available
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise ApiError(f'Unknown field(s): {", ".join(unknown)}', errors={'fields': list(available)})
+    return fields
+
+
+def _id_list(request, name):
+    """Parse ``?<name>=1,2,3``; None when the parameter is absent."""
+    raw = request.GET.get(name)
+    if raw is None:
+        return None
+    try:
+        ids = {int(value) for value in raw.split(',') if value.strip()}
+    except ValueError:
+        raise ApiError(f'"{name}" must be a comma-separated list of ids.')
+    if len(ids) > MAX_BATCH_IDS:
+        raise ApiError(f'At most {MAX_BATCH_IDS} ids can be requested at once.')
+    return ids
+
+
+def _parent_id(data, name):
+    try:
+        return int(data.get(name))
+    except (TypeError, ValueError):
+        raise ApiError('Invalid data.', errors={name: [{'message': 'A valid id is required.', 'code': 'required'}]})
+
+
+def _writable(project):
+    if project.archived_at is not None:
+        raise ApiError('Project is archived and read-only.', status=409)
+    return project
+
+
+# ═══════════════════════════════════════════════════════════
+# RESPONSES
+# ═══════════════════════════════════════════════════════════
+def _serialize(obj, fields):
+    # DjangoJSONEncoder writes decimals as strings and dates in ISO format
+    return {name: getattr(obj, name) for name in fields}
+
+
+def _etag(request, projects):
+    # Any write below a project bumps its content_version, and adding or
+    # deleting a project changes the id set, so this changes whenever the
+    # response could.
+    digest = hashlib.sha1(f'{API_VERSION}|{request.user.pk}|{request.get_full_path()}'.encode())
+    versions = projects.order_by('id').values_list('id', 'content_version').distinct()
+    for pk, version in versions.iterator():
+        digest.update(f';{pk}:{version}'.encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def _conditional(request, projects, build):
+    etag = _etag(request, projects)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = build()
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _list_response(request, queryset, available, projects):
+    fields = _selected_fields(request, available)
+
+    def build():
+        page = paginate(
+            queryset.only(*fields, *API_ORDERING),
+            API_ORDERING,
+            cursor=request.GET.get('after'),
+            page_size=page_size_from(request, maximum=API_MAX_PAGE_SIZE),
+        )
+        next_url = None
+        if page.has_next:
+            params = request.GET.copy()
+            params['after'] = page.next_cursor
+            next_url = f'{request.path}?{params.urlencode()}'
+        return JsonResponse({
+            'results': [_serialize(obj, fields) for obj in page],
+            'next': next_url,
+        })
+
+    return _conditional(request, projects, build)
+
+
+def _create(request, data, form_class, fields, **attrs):
+    form = form_class(data)
+    if not form.is_valid():
+        raise ApiError('Invalid data.', errors=form.errors.get_json_data())
+    obj = form.save(commit=False)
+    for name, value in attrs.items():
+        setattr(obj, name, value)
+    obj.save()
+    # Read back the stored row so numbers come out as the list endpoints show them
+    obj.refresh_from_db()
+    return JsonResponse(_serialize(obj, fields), status=201)
+
+
+# ═══════════════════════════════════════════════════════════
+# SESSION
+# ═══════════════════════════════════════════════════════════
+@api_view(['GET', 'POST'], login_required=False)
+def session(request):
+    if request.method == 'POST':
+        data = _request_data(request)
+        user = authenticate(request, email=data.get('email'), password=data.get('password'))
+        if user is None:
+            raise ApiError('Invalid email or password.', status=401)
+        login(request, user)
+
+    user = request.user
+    return JsonResponse({
+        'authenticated': user.is_authenticated,
+        'email': user.email if user.is_authenticated else None,
+        # Rotated on login, so always read it after the login above
+        'csrf_token': get_token(request),
+    })
+
+
+# ═══════════════════════════════════════════════════════════
+# PROJECTS
+# ═══════════════════════════════════════════════════════════
+@api_view(['GET', 'POST'])
+def projects(request):
+    if request.method == 'POST':
+        return _create(request, _request_data(request), ProjectForm, PROJECT_FIELDS, user=request.user)
+
+    owned = request.user.projects.all()
+    return _list_response(request, owned, PROJECT_FIELDS, owned)
+
+
+@api_view(['GET'])
+def project_detail(request, project_id):
+    owned = request.user.projects.filter(pk=project_id)
+    fields = _selected_fields(request, PROJECT_FIELDS)
+
+    def build():
+        project = get_object_or_404(owned.only(*fields))
+        return JsonResponse(_serialize(project, fields))
+
+    return _conditional(request, owned, build)
+
+
+# ═══════════════════════════════════════════════════════════
+# BRANCHES
+# ═══════════════════════════════════════════════════════════
+@api_view(['GET', 'POST'])
+def branches(request):
+    if request.method == 'POST':
+        data = _request_data(request)
+        project = _writable(get_object_or_404(Project, pk=_parent_id(data, 'project_id'), user=request.user))
+        return _create(request, data, BranchForm, BRANCH_FIELDS, project=project)
+
+    projects = request.user.projects.all()
+    project_ids = _id_list(request, 'project')
+    if project_ids is not None:
+        projects = projects.filter(pk__in=project_ids)
+    queryset = Branch.objects.filter(project__in=projects)
+    return _list_response(request, queryset, BRANCH_FIELDS, projects)
+
+
+# ═══════════════════════════════════════════════════════════
+# SUB-BRANCHES (EXPENSES)
+# ═══════════════════════════════════════════════════════════
+@api_view(['GET', 'POST'])
+def subbranches(request):
+    if request.method == 'POST':
+        data = _request_data(request)
+        branch = get_object_or_404(
+            Branch.objects.select_related('project'), pk=_parent_id(data, 'branch_id'), project__user=request.user,
+        )
+        _writable(branch.project)
+        return _create(request, data, SubBranchForm, SUBBRANCH_FIELDS, branch=branch)
+
+    projects = request.user.projects.all()
+    queryset = SubBranch.objects.active().filter(branch__project__user=request.user)
+    branch_ids = _id_list(request, 'branch')
+    if branch_ids is not None:
+        projects = projects.filter(branches__in=branch_ids)
+        queryset = queryset.filter(branch__in=branch_ids)
+    project_ids = _id_list(request, 'project')
+    if project_ids is not None:
+        projects = projects.filter(pk__in=project_ids)
+        queryset = queryset.filter(branch__project__in=project_ids)
+    return _list_response(request, queryset, SUBBRANCH_FIELDS, projects)
+
+
+# ═══════════════════════════════════════════════════════════
+# RELEASED HISTORY
+# ═══════════════════════════════════════════════════════════
+@api_view(['GET', 'POST'])
+def releases(request):
+    if request.method == 'POST':
+        data = _request_data(request)
+        project = _writable(get_object_or_404(Project, pk=_parent_id(data, 'project_id'), user=request.user))
+        return _create(request, data, ReleasedHistoryForm, RELEASE_FIELDS, project=project)
+
+    projects = request.user.projects.all()
+    project_ids = _id_list(request, 'project')
+    if project_ids is not None:
+        projects = projects.filter(pk__in=project_ids)
+    queryset = ReleasedHistory.objects.filter(project__in=projects)
+    return _list_response(request, queryset, RELEASE_FIELDS, projects)
+
+
+# ═══════════════════════════════════════════════════════════
+# DELTA SYNC
+# ═══════════════════════════════════════════════════════════
+@api_view(['GET'])
+def changes(request):
+    """
+    Everything that changed after ``?since=<cursor>``.
+
+    Without ``since`` no changes are returned, only the current cursor: a new
+    client takes it, downloads its data through the list endpoints and then
+    polls from there. Upserts carry the object as it is now; tombstones only
+    its kind and id. Keep requesting with the returned cursor while
+    ``has_more`` is true.
+    """
+    id_field = ChangeLog._meta.pk
+    since = request.GET.get('since')
+    if not since:
+        head = changefeed.head_cursor(request.user)
+        return JsonResponse({'changes': [], 'cursor': encode_cursor([head]), 'has_more': False})
+
+    decoded = decode_cursor(since, [id_field])
+    if decoded is None:
+        raise ApiError('Invalid sync cursor.')
+    limit = page_size_from(request, maximum=API_MAX_PAGE_SIZE)
+    entries, last_id, has_more = changefeed.changes_since(request.user, decoded[0], limit)
+
+    # Current state of the upserted objects, one query per kind
+    wanted = {}
+    for kind, object_id, action in entries:
+        if action == changefeed.ACTION_UPSERT:
+            wanted.setdefault(kind, []).append(object_id)
+    current = {}
+    for kind, ids in wanted.items():
+        model, fields = SYNCED_KINDS[kind]
+        for obj in model.objects.filter(pk__in=ids).only(*fields).order_by():
+            current[kind, obj.pk] = _serialize(obj, fields)
+
+    results = []
+    for kind, object_id, action in entries:
+        data = current.get((kind, object_id))
+        if action == changefeed.ACTION_UPSERT and data is not None:
+            results.append({'kind': kind, 'id': object_id, 'action': action, 'data': data})
+        else:
+            # Deleted, possibly after this page's last entry: send the
+            # tombstone now rather than an upsert of a missing object
+            results.append({'kind': kind, 'id': object_id, 'action': changefeed.ACTION_DELETE})
+
+    return JsonResponse({
+        'changes': results,
+        'cursor': encode_cursor([last_id]),
+        'has_more': has_more,
+    })
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
 
 
 class ProjectsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'projects'
+
+    def ready(self):
+        if settings.CIVITRACK_SQLITE_TUNING:
+            from civitrack.database import check_sqlite_tuning, tune_sqlite_connection
+
+            check_sqlite_tuning()
+            connection_created.connect(tune_sqlite_connection, dispatch_uid='civitrack_sqlite_tuning')
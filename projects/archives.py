@@ -0,0 +1,318 @@
+"""
+Cold storage for the expenses and releases of finished projects.
+
+A project nobody writes to any more still keeps every SubBranch and
+ReleasedHistory row in the hot tables, whose indexes every user's queries
+walk. ``archive_project`` moves those rows into one gzip-compressed
+JSON-lines file per project, ``MEDIA_ROOT/archives/<project id>.jsonl.gz``,
+and deletes them (with their search entries) a batch at a time. The project,
+its branches with their stored totals and the SpendRollup rows stay, so the
+project list, portfolio, project page and analytics read as before.
+
+An archived project (``archived_at`` set) is read-only. Its expense and
+release pages and the PDF export read the file instead, which holds the
+releases and then the expenses in the order those pages show them, so a page
+only decompresses as far as it needs. ``restore_project`` puts the rows back
+with their original ids and timestamps.
+
+Archiving runs in steps, none of which holds a long transaction:
+
+1. ``archived_at`` is set, after which the pages and the API refuse writes.
+2. The rows are streamed to a temporary file, read back to check it and
+   renamed into place.
+3. The archived rows are deleted by id.
+
+A row added in between (by a request that had already passed its check) is
+still in the tables after step 3; the project is then restored and
+``ArchiveError`` raised, so nothing is lost.
+
+In the change feed archiving is an upsert of the project, whose
+``archived_at`` tells clients to drop its expenses and releases; a restore
+logs an upsert of each of them again.
+"""
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import time
+from decimal import Decimal
+from itertools import groupby, islice
+from operator import attrgetter
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import changefeed, search
+from .models import Branch, Project, ReleasedHistory, SearchEntry, SubBranch
+
+
+ARCHIVE_DIR = 'archives'
+FORMAT_VERSION = 1
+ARCHIVE_BATCH_SIZE = 1000
+
+KIND_HEADER = 'archive'
+KIND_END = 'end'
+# Sections of the file, in order: (kind, model, lookup of the project, row
+# ordering). Expenses are grouped by branch in snapshots.BRANCH_ORDERING, as
+# the PDF reads them.
+SECTIONS = [
+    (changefeed.KIND_RELEASE, ReleasedHistory, 'project', ('-date', '-id')),
+    (changefeed.KIND_SUBBRANCH, SubBranch, 'branch__project', ('-branch__created_at', '-branch_id', '-date', '-id')),
+]
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def archive_path(project_id):
+    return Path(settings.MEDIA_ROOT) / ARCHIVE_DIR / f'{project_id}.jsonl.gz'
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _encode(value):
+    # Full precision, unlike DjangoJSONEncoder's millisecond timestamps
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'Cannot archive {type(value).__name__} values')
+
+
+def _line(record):
+    return json.dumps(record, default=_encode, separators=(',', ':')) + '\n'
+
+
+# ═══════════════════════════════════════════════════════════
+# Reading
+# ═══════════════════════════════════════════════════════════
+def _records(project_id, kind):
+    # The rows of one section as dicts; stops reading at the next section
+    seen = False
+    with gzip.open(archive_path(project_id), 'rt', encoding='utf-8') as fileobj:
+        for line in fileobj:
+            record = json.loads(line)
+            if record['kind'] == kind:
+                seen = True
+                yield record
+            elif seen:
+                return
+
+
+def _instances(model, records):
+    fields = {field.attname: field for field in model._meta.concrete_fields}
+    for record in records:
+        yield model(**{name: field.to_python(record[name]) for name, field in fields.items()})
+
+
+def releases(project):
+    """The archived releases of ``project`` (unsaved instances), newest first."""
+    return _instances(ReleasedHistory, _records(project.pk, changefeed.KIND_RELEASE))
+
+
+def subbranches(project, branch_ids=None):
+    """
+    The archived expenses of ``project``, grouped by branch like
+    ``snapshots.project_subbranch_stream``; only those of ``branch_ids`` if given.
+    """
+    records = _records(project.pk, changefeed.KIND_SUBBRANCH)
+    if branch_ids is not None:
+        records = (record for record in records if record['branch_id'] in branch_ids)
+    return _instances(SubBranch, records)
+
+
+def branch_subbranches(branch):
+    """One branch's archived expenses, newest first."""
+    def group():
+        seen = False
+        for record in _records(branch.project_id, changefeed.KIND_SUBBRANCH):
+            if record['branch_id'] == branch.pk:
+                seen = True
+                yield record
+            elif seen:
+                return
+    return _instances(SubBranch, group())
+
+
+def _check(project_id):
+    # Read the whole file back; returns its row counts
+    counts = dict.fromkeys((kind for kind, *_ in SECTIONS), 0)
+    end = None
+    with gzip.open(archive_path(project_id), 'rt', encoding='utf-8') as fileobj:
+        for line in fileobj:
+            record = json.loads(line)
+            if record['kind'] in counts:
+                counts[record['kind']] += 1
+            elif record['kind'] == KIND_END:
+                end = record
+    if end is None or any(end[kind] != count for kind, count in counts.items()):
+        raise ArchiveError(f'The archive of project {project_id} is incomplete.')
+    return counts
+
+
+# ═══════════════════════════════════════════════════════════
+# Archiving
+# ═══════════════════════════════════════════════════════════
+def _write(project):
+    path = archive_path(project.pk)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    counts = {}
+
+    # Write next to the final name and rename into place, as exports do
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as raw:
+            with gzip.open(raw, 'wt', encoding='utf-8') as fileobj:
+                fileobj.write(_line({'kind': KIND_HEADER, 'format': FORMAT_VERSION, 'project_id': project.pk}))
+                for kind, model, parent, ordering in SECTIONS:
+                    columns = [field.attname for field in model._meta.concrete_fields]
+                    rows = (model.objects.filter(**{parent: project}).order_by(*ordering)
+                            .values_list(*columns).iterator(chunk_size=ARCHIVE_BATCH_SIZE))
+                    counts[kind] = 0
+                    for values in rows:
+                        fileobj.write(_line({'kind': kind, **dict(zip(columns, values))}))
+                        counts[kind] += 1
+                fileobj.write(_line({'kind': KIND_END, **counts}))
+            # On disk before any row is deleted
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+    if _check(project.pk) != counts:
+        raise ArchiveError(f'The archive of project {project.pk} does not match what was written.')
+    return counts
+
+
+def _delete_archived(project, batch_size, pause):
+    for kind, model, _, _ in SECTIONS:
+        ids = (record['id'] for record in _records(project.pk, kind))
+        for chunk in _chunks(ids, batch_size):
+            with transaction.atomic():
+                model.objects.filter(pk__in=chunk).delete()
+                if kind == changefeed.KIND_SUBBRANCH:
+                    SearchEntry.objects.filter(kind=kind, object_id__in=chunk).delete()
+            if pause:
+                time.sleep(pause)
+
+
+def _hot_rows_left(project):
+    return any(model.objects.filter(**{parent: project}).exists() for _, model, parent, _ in SECTIONS)
+
+
+def archive_project(project, batch_size=ARCHIVE_BATCH_SIZE, pause=0):
+    """
+    Move the expenses and releases of ``project`` into its archive file.
+
+    Returns ``{kind: rows archived}``. Raises ``ArchiveError`` if the project
+    is already archived, or was written to while being archived (it is then
+    restored).
+    """
+    with transaction.atomic():
+        if not Project.objects.filter(pk=project.pk, archived_at__isnull=True).update(
+            archived_at=timezone.now(), content_version=F('content_version') + 1,
+        ):
+            raise ArchiveError(f'Project {project.pk} is already archived or deleted.')
+        changefeed.record_changes(
+            [(changefeed.KIND_PROJECT, changefeed.ACTION_UPSERT, project.pk)],
+            project_id=project.pk, user_id=project.user_id,
+        )
+
+    try:
+        counts = _write(project)
+    except BaseException:
+        archive_path(project.pk).unlink(missing_ok=True)
+        _reopen(project)
+        raise
+
+    _delete_archived(project, batch_size, pause)
+    if _hot_rows_left(project):
+        restore_project(project, batch_size)
+        raise ArchiveError(f'Project {project.pk} changed while it was being archived and was restored; try again.')
+    project.refresh_from_db(fields=['archived_at', 'content_version'])
+    return counts
+
+
+# ═══════════════════════════════════════════════════════════
+# Restoring
+# ═══════════════════════════════════════════════════════════
+def _insert(model, objs):
+    # Plain INSERTs keep the archived ids and created_at (bulk_create would
+    # stamp auto_now_add fields); rows already back from an interrupted
+    # restore are skipped. Returns the rows inserted.
+    existing = set(model._base_manager.filter(pk__in=[obj.pk for obj in objs]).values_list('pk', flat=True))
+    objs = [obj for obj in objs if obj.pk not in existing]
+    if not objs:
+        return objs
+    fields = model._meta.concrete_fields
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    sql = f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({columns}) VALUES ({placeholders})'
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [field.get_db_prep_save(getattr(obj, field.attname), connection=connection) for field in fields]
+            for obj in objs
+        ])
+    return objs
+
+
+def _reopen(project):
+    with transaction.atomic():
+        Project.all_objects.filter(pk=project.pk).update(
+            archived_at=None, content_version=F('content_version') + 1,
+        )
+        changefeed.record_changes(
+            [(changefeed.KIND_PROJECT, changefeed.ACTION_UPSERT, project.pk)],
+            project_id=project.pk, user_id=project.user_id,
+        )
+
+
+def restore_project(project, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Put the archived rows of ``project`` back and make it writable again.
+
+    Returns ``{kind: rows restored}``. Can be run again after an interruption;
+    expenses of branches purged in the meantime are dropped.
+    """
+    if not Project.all_objects.filter(pk=project.pk, archived_at__isnull=False).exists():
+        raise ArchiveError(f'Project {project.pk} is not archived.')
+    path = archive_path(project.pk)
+    counts = dict.fromkeys((kind for kind, *_ in SECTIONS), 0)
+    if not path.exists():
+        # Interrupted before the file was written: the rows never left
+        _reopen(project)
+        return counts
+    _check(project.pk)
+
+    branch_ids = set(Branch.all_objects.filter(project_id=project.pk).values_list('pk', flat=True))
+    sources = [
+        (changefeed.KIND_RELEASE, ReleasedHistory, releases(project)),
+        (changefeed.KIND_SUBBRANCH, SubBranch, subbranches(project, branch_ids)),
+    ]
+    for kind, model, rows in sources:
+        for chunk in _chunks(rows, batch_size):
+            with transaction.atomic():
+                restored = _insert(model, chunk)
+                if kind == changefeed.KIND_SUBBRANCH:
+                    for branch_id, objs in groupby(restored, key=attrgetter('branch_id')):
+                        search.index_new_subbranches(Branch(pk=branch_id, project_id=project.pk), list(objs))
+                changefeed.record_changes(
+                    [(kind, changefeed.ACTION_UPSERT, obj.pk) for obj in restored],
+                    project_id=project.pk, user_id=project.user_id,
+                )
+            counts[kind] += len(restored)
+
+    _reopen(project)
+    path.unlink(missing_ok=True)
+    project.refresh_from_db(fields=['archived_at', 'content_version'])
+    return counts
@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models.functions import Lower
+
+
+# Accounts sharing an address (created before registration enforced
+# uniqueness) are tried in turn; this bounds the password checks per attempt.
+MAX_EMAIL_MATCHES = 5
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def users_with_email(email):
+    """Users whose address matches ``email`` case-insensitively."""
+    UserModel = get_user_model()
+    return (UserModel._default_manager
+            .annotate(email_lower=Lower(UserModel.get_email_field_name()))
+            .filter(email_lower=normalize_email(email)))
+
+
+class EmailBackend(ModelBackend):
+    """
+    Authenticate with an email address and password in a single query.
+
+    The lookup compares ``LOWER(email)``, which is served by the expression
+    index created in migration 0006, so its cost does not grow with the
+    number of users.
+    """
+
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if not email or password is None:
+            return None
+
+        candidates = list(users_with_email(email)[:MAX_EMAIL_MATCHES])
+        if not candidates:
+            # Run the password hasher once anyway so a missing account takes
+            # as long as a wrong password (same as ModelBackend).
+            get_user_model()().set_password(password)
+            return None
+
+        for user in candidates:
+            if user.check_password(password) and self.user_can_authenticate(user):
+                return user
+        return None
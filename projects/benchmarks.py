@@ -0,0 +1,464 @@
+"""
+Synthetic data and timed scenarios behind the benchmark commands.
+
+``seed_benchmark_data`` creates users named ``benchmark-<n>`` with projects,
+branches and as many expense (SubBranch) and release rows as asked for,
+written with ``bulk_create`` and then brought in line with the stored
+totals, rollups and search index the same way ``reconcile_totals`` and the
+importer do.
+
+``run_benchmarks`` drives the main pages through Django's test client as
+the first of those users: the project page, the branch history, adding an
+expense, the PDF export and logging in. For each it records latency
+percentiles, queries per request and the peak memory Python allocated
+during one extra, traced request. Results are written as JSON named after
+the time and git commit, and can be compared with an earlier file.
+
+``benchmark_asgi`` loads the async read pages many at a time, once through
+the WSGI handler from a pool of threads (as a threaded WSGI server would)
+and once through the ASGI handler from one event loop.
+
+``benchmark_login`` grows a separate set of bare accounts step by step (10k,
+100k and 1M by default) and times logging in by email at each size, the
+indexed lookup on its own and the whole ``authenticate`` call, whose
+password hashing costs the same at any size.
+"""
+import asyncio
+import datetime
+import json
+import random
+import statistics
+import subprocess
+import time
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import rollups, search
+from .backends import MAX_EMAIL_MATCHES, users_with_email
+from .middleware import QueryRecorder
+from .models import Branch, Project, ReleasedHistory, SubBranch
+
+
+USERNAME_PREFIX = 'benchmark-'
+PASSWORD = 'benchmark-password'
+SEED_BATCH_SIZE = 5000
+# Days back from today that seeded entries are spread over
+SEED_DAYS = 730
+# p95 this much slower than the compared run is reported as a regression
+REGRESSION_THRESHOLD = 0.10
+# Accounts of benchmark_login, kept apart from the seeded benchmark users
+LOGIN_USERNAME_PREFIX = 'login-benchmark-'
+LOGIN_USER_COUNTS = (10000, 100000, 1000000)
+
+
+# ═══════════════════════════════════════════════════════════
+# Seeding
+# ═══════════════════════════════════════════════════════════
+def benchmark_users():
+    return User.objects.filter(username__startswith=USERNAME_PREFIX)
+
+
+def clear_benchmark_data():
+    """Delete the benchmark users and everything they own; returns the count of users."""
+    count = 0
+    for user in benchmark_users():
+        with transaction.atomic():
+            for project in user.projects.all():
+                project.delete()
+            user.delete()
+        count += 1
+    return count
+
+
+def _spread(total, parts):
+    # ``total`` split into ``parts`` near-equal counts
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+
+def seed(users=5, projects=4, branches=5, subbranches=200000, releases=20000, seed=0, stdout=None):
+    """
+    Create the benchmark data set; returns a dict of row counts.
+
+    ``projects`` is per user and ``branches`` per project; the expense and
+    release rows are shared out evenly between them.
+    """
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    password = make_password(PASSWORD)
+    start = benchmark_users().count()
+
+    created_projects, created_branches = [], []
+    for n in range(start, start + users):
+        user = User.objects.create(username=f'{USERNAME_PREFIX}{n}', email=f'benchmark{n}@example.com',
+                                   password=password)
+        for p in range(projects):
+            project = Project.objects.create(
+                user=user, name=f'Benchmark project {n}.{p}', amount=Decimal(rng.randrange(10**6, 10**8)),
+                start_date=today - datetime.timedelta(days=SEED_DAYS),
+            )
+            created_projects.append(project)
+            for b in range(branches):
+                created_branches.append(Branch.objects.create(project=project, name=f'Branch {b}'))
+
+    def random_row():
+        return {
+            'amount': Decimal(rng.randrange(100, 10**6)) / 100,
+            'date': today - datetime.timedelta(days=rng.randrange(SEED_DAYS)),
+        }
+
+    for branch, count in zip(created_branches, _spread(subbranches, len(created_branches))):
+        with transaction.atomic():
+            for offset in range(0, count, SEED_BATCH_SIZE):
+                batch = [SubBranch(branch=branch, name=f'Expense {i}', **random_row())
+                         for i in range(offset, min(count, offset + SEED_BATCH_SIZE))]
+                SubBranch.objects.bulk_create(batch)
+                search.index_new_subbranches(branch, batch)
+        if stdout:
+            stdout.write(f'  {branch.project.name} / {branch.name}: {count} expense(s)')
+
+    for project, count in zip(created_projects, _spread(releases, len(created_projects))):
+        ReleasedHistory.objects.bulk_create(
+            [ReleasedHistory(project=project, **random_row()) for _ in range(count)],
+            batch_size=SEED_BATCH_SIZE,
+        )
+
+    # Bring the stored totals and rollups in line with the bulk-created rows
+    project_ids = [project.pk for project in created_projects]
+    rollups.reconcile_branch_totals(Branch.objects.filter(project_id__in=project_ids))
+    rollups.reconcile_project_totals(Project.objects.filter(pk__in=project_ids))
+    rollups.rebuild_timeseries(project_ids)
+    return {
+        'users': users,
+        'projects': len(created_projects),
+        'branches': len(created_branches),
+        'subbranches': subbranches,
+        'releases': releases,
+    }
+
+
+# ═══════════════════════════════════════════════════════════
+# Scenarios
+# ═══════════════════════════════════════════════════════════
+def _target():
+    # The first benchmark user's first project and its largest branch
+    user = benchmark_users().order_by('id').first()
+    if user is None:
+        return None
+    project = user.projects.order_by('id').first()
+    branch = project.branches.order_by('-total_spent', 'id').first() if project else None
+    if branch is None:
+        return None
+    return user, project, branch
+
+
+def _logged_in(user):
+    client = Client()
+    client.force_login(user)
+    return client
+
+
+def scenarios(user, project, branch):
+    """``{name: callable returning a response}`` for the measured paths."""
+    client = _logged_in(user)
+    project_url = reverse('project_details', args=[project.pk])
+    branch_url = reverse('branch_history', args=[branch.pk])
+    counter = iter(range(10**9))
+
+    def add_subbranch():
+        # The whole flow: the POST and the page it redirects back to
+        return client.post(branch_url, {
+            'action': 'add', 'name': f'Benchmark entry {next(counter)}',
+            'amount': '125.50', 'date': datetime.date.today().isoformat(),
+        }, follow=True)
+
+    def export_pdf():
+        response = client.get(reverse('export_project_pdf', args=[project.pk]))
+        # Read the file so it is timed and closed
+        b''.join(response.streaming_content)
+        return response
+
+    def login():
+        return Client().post(reverse('login'), {'email': user.email, 'password': PASSWORD})
+
+    return {
+        'project_details': lambda: client.get(project_url),
+        'branch_history': lambda: client.get(branch_url),
+        'add_subbranch': add_subbranch,
+        'export_project_pdf': export_pdf,
+        'login': login,
+    }
+
+
+def _percentile(values, percent):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+def measure(name, request, iterations):
+    """Time ``iterations`` calls of ``request``, then trace one for memory."""
+    latencies, queries = [], []
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = request()
+            latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{name} answered {response.status_code}')
+        queries.append(len(captured.captured_queries))
+
+    # Tracing slows everything down, so memory comes from a separate request
+    tracemalloc.start()
+    try:
+        request()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'first_ms': round(latencies[0], 2),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(_percentile(latencies, 95), 2),
+        'max_ms': round(max(latencies), 2),
+        'queries': max(queries),
+        'peak_memory_kib': round(peak / 1024, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(iterations=20, only=None):
+    """Run the scenarios (all, or the names in ``only``); returns the result document."""
+    target = _target()
+    if target is None:
+        raise LookupError('No benchmark data; run `manage.py seed_benchmark_data` first.')
+    user, project, branch = target
+    results = {}
+    for name, request in scenarios(user, project, branch).items():
+        if not only or name in only:
+            results[name] = measure(name, request, iterations)
+    return {
+        'commit': git_commit(),
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'database': connection.vendor,
+        'data': {
+            'project_subbranches': SubBranch.objects.filter(branch__project=project).count(),
+            'branch_subbranches': branch.subbranches.count(),
+            'subbranches': SubBranch.objects.count(),
+            'releases': ReleasedHistory.objects.count(),
+        },
+        'scenarios': results,
+    }
+
+
+# ═══════════════════════════════════════════════════════════
+# WSGI threads against the ASGI event loop
+# ═══════════════════════════════════════════════════════════
+def read_paths(project, branch):
+    return [
+        reverse('project_list'),
+        reverse('project_details', args=[project.pk]),
+        reverse('released_history', args=[project.pk]),
+        reverse('branch_history', args=[branch.pk]),
+    ]
+
+
+def _load_summary(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(_percentile(latencies, 95), 2),
+    }
+
+
+def load_wsgi(user, paths, requests, concurrency):
+    """``requests`` page loads through the WSGI handler from ``concurrency`` threads."""
+    local = threading.local()
+
+    def load(i):
+        if not hasattr(local, 'client'):
+            local.client = _logged_in(user)
+        started = time.perf_counter()
+        response = local.client.get(paths[i % len(paths)])
+        if response.status_code != 200:
+            raise RuntimeError(f'{paths[i % len(paths)]} answered {response.status_code}')
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(load, range(requests)))
+    return _load_summary(latencies, time.perf_counter() - started)
+
+
+def load_asgi(user, paths, requests, concurrency):
+    """``requests`` page loads through the ASGI handler, ``concurrency`` at a time."""
+    async def main():
+        clients = [AsyncClient() for _ in range(concurrency)]
+        for client in clients:
+            await client.aforce_login(user)
+        pending = iter(range(requests))
+        latencies = []
+
+        async def worker(client):
+            for i in pending:
+                started = time.perf_counter()
+                response = await client.get(paths[i % len(paths)])
+                if response.status_code != 200:
+                    raise RuntimeError(f'{paths[i % len(paths)]} answered {response.status_code}')
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for client in clients))
+        return _load_summary(latencies, time.perf_counter() - started)
+
+    return asyncio.run(main())
+
+
+def compare_handlers(requests=200, concurrency=20):
+    target = _target()
+    if target is None:
+        raise LookupError('No benchmark data; run `manage.py seed_benchmark_data` first.')
+    user, project, branch = target
+    paths = read_paths(project, branch)
+    return {
+        'wsgi': load_wsgi(user, paths, requests, concurrency),
+        'asgi': load_asgi(user, paths, requests, concurrency),
+    }
+
+
+# ═══════════════════════════════════════════════════════════
+# Login against the number of accounts
+# ═══════════════════════════════════════════════════════════
+def login_users():
+    return User.objects.filter(username__startswith=LOGIN_USERNAME_PREFIX)
+
+
+def _login_email(n):
+    # Stored in mixed case; logins below use lower case
+    return f'Login.Benchmark{n}@Example.com'
+
+
+def clear_login_users(batch_size=SEED_BATCH_SIZE):
+    """Delete the benchmark_login accounts a batch at a time; returns the count."""
+    deleted = 0
+    while ids := list(login_users().order_by().values_list('pk', flat=True)[:batch_size]):
+        User.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
+    return deleted
+
+
+def grow_login_users(total, password, stdout=None):
+    """Add bare accounts until there are ``total`` of them; all share one password hash."""
+    start = login_users().count()
+    for offset in range(start, total, SEED_BATCH_SIZE):
+        User.objects.bulk_create([
+            User(username=f'{LOGIN_USERNAME_PREFIX}{n}', email=_login_email(n), password=password)
+            for n in range(offset, min(total, offset + SEED_BATCH_SIZE))
+        ])
+    if stdout and total > start:
+        stdout.write(f'  {total} account(s)')
+
+
+def measure_login(total, iterations, rng):
+    """Log in ``iterations`` random accounts out of ``total``, timing the lookup and the whole call."""
+    lookups, logins, queries = [], [], []
+    for _ in range(iterations):
+        email = _login_email(rng.randrange(total)).lower()
+
+        started = time.perf_counter()
+        list(users_with_email(email)[:MAX_EMAIL_MATCHES])
+        lookups.append((time.perf_counter() - started) * 1000)
+
+        # Counted by a wrapper: with DEBUG on, growing the accounts fills
+        # the connection's query log, which CaptureQueriesContext reads
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            started = time.perf_counter()
+            user = authenticate(None, email=email, password=PASSWORD)
+            logins.append((time.perf_counter() - started) * 1000)
+        if user is None:
+            raise RuntimeError(f'Logging in as {email} failed')
+        queries.append(recorder.count)
+
+    return {
+        'users': total,
+        'iterations': iterations,
+        'lookup_p50_ms': round(statistics.median(lookups), 3),
+        'lookup_p95_ms': round(_percentile(lookups, 95), 3),
+        'login_p50_ms': round(statistics.median(logins), 2),
+        'login_p95_ms': round(_percentile(logins, 95), 2),
+        'queries': max(queries),
+    }
+
+
+def login_scaling(user_counts=LOGIN_USER_COUNTS, iterations=20, seed=0, stdout=None):
+    """
+    ``measure_login`` at each of ``user_counts``, growing the accounts in
+    between; returns one result per size. The accounts are left in place, so
+    a later run with larger sizes only adds the difference.
+    """
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)
+    results = []
+    for total in sorted(set(user_counts)):
+        grow_login_users(total, password, stdout)
+        results.append(measure_login(total, iterations, rng))
+    return results
+
+
+# ═══════════════════════════════════════════════════════════
+# Stored results
+# ═══════════════════════════════════════════════════════════
+def save(document, directory):
+    directory.mkdir(parents=True, exist_ok=True)
+    stamp = document['created_at'].replace(':', '').replace('-', '')[:15]
+    path = directory / f"{stamp}-{document['commit']}.json"
+    path.write_text(json.dumps(document, indent=2))
+    return path
+
+
+def latest(directory, exclude=None):
+    """The newest stored result file in ``directory`` other than ``exclude``."""
+    files = sorted(path for path in directory.glob('*.json') if path != exclude)
+    return files[-1] if files else None
+
+
+def compare(document, baseline):
+    """Yield ``(scenario, metric, before, after, change, regressed)`` rows."""
+    for name, after in document['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'queries', 'peak_memory_kib'):
+            old, new = before.get(metric), after.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            if metric == 'queries':
+                regressed = new > old
+            else:
+                regressed = metric == 'p95_ms' and change > REGRESSION_THRESHOLD
+            yield name, metric, old, new, change, regressed
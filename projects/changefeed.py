@@ -0,0 +1,110 @@
+"""
+Per-user change log behind the delta sync endpoint.
+
+The save/delete hooks on Project, Branch, SubBranch and ReleasedHistory (and
+the bulk import) append a ``ChangeLog`` row for every object they write:
+``upsert`` for an insert or edit and ``delete`` for a removal. An offline
+client keeps the id of the last entry it has seen as its cursor and asks for
+everything after it, so reconnect traffic depends on what changed rather than
+on how large its projects are.
+
+A change to an expense or release also logs an upsert of its branch or
+project, whose running total it moved. Deleting a project or branch
+cascades to its children without logging each one; a tombstone for a
+parent means everything below it is gone as well.
+Restoring a soft-deleted one (see projects.trash) logs an upsert for each
+object below it again. Archiving a project (projects.archives) logs only an
+upsert of the project, whose ``archived_at`` means its expenses and releases
+are gone; restoring the archive logs each of them again.
+
+Entries are written while holding a lock on the owning user's row, so a
+user's entries commit in id order and a reader can never move its cursor past
+an entry that is still uncommitted.
+"""
+
+
+KIND_PROJECT = 'project'
+KIND_BRANCH = 'branch'
+KIND_SUBBRANCH = 'subbranch'
+KIND_RELEASE = 'release'
+
+ACTION_UPSERT = 'upsert'
+ACTION_DELETE = 'delete'
+
+LOG_BATCH_SIZE = 1000
+
+
+def owner_of(project_id=None, branch_id=None):
+    """``(project_id, user_id)`` owning a branch or project, or None if it is gone."""
+    from .models import Branch, Project
+
+    if branch_id is not None:
+        return Branch.objects.filter(pk=branch_id).values_list('project_id', 'project__user_id').first()
+    user_id = Project.objects.filter(pk=project_id).values_list('user_id', flat=True).first()
+    return (project_id, user_id) if user_id is not None else None
+
+
+def record_changes(changes, project_id=None, branch_id=None, user_id=None):
+    """
+    Append a log entry for each ``(kind, action, object_id)`` in ``changes``.
+
+    The owner is looked up from ``branch_id`` or ``project_id`` unless
+    ``user_id`` is given. Must run inside the transaction that made the change.
+    """
+    from django.contrib.auth.models import User
+    from .models import ChangeLog
+
+    changes = [change for change in changes if change[2] is not None]
+    if not changes:
+        return
+    if user_id is None:
+        owner = owner_of(project_id, branch_id)
+        if owner is None:
+            return
+        project_id, user_id = owner
+
+    # Serialise this user's log writers until commit (see module docstring).
+    # Always the last lock a hook takes, after the rows and rollups.
+    list(User.objects.select_for_update().filter(pk=user_id).values_list('pk', flat=True))
+    ChangeLog.objects.bulk_create(
+        [
+            ChangeLog(user_id=user_id, project_id=project_id, kind=kind, object_id=pk, action=action)
+            for kind, action, pk in changes
+        ],
+        batch_size=LOG_BATCH_SIZE,
+    )
+
+
+def head_cursor(user):
+    """Id of the user's newest entry (0 if there is none)."""
+    from .models import ChangeLog
+
+    return ChangeLog.objects.filter(user=user).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def changes_since(user, after, limit):
+    """
+    Return ``(entries, last_id, has_more)`` for the user's entries after ``after``.
+
+    Several entries for the same object are collapsed into the newest one, so
+    ``entries`` holds at most one ``(kind, object_id, action)`` per object, in
+    the order of their first change.
+    """
+    from .models import ChangeLog
+
+    rows = list(
+        ChangeLog.objects.filter(user=user, id__gt=after)
+        .order_by('id')
+        .values_list('id', 'kind', 'object_id', 'action')[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # A dict keeps each object at its first position (so a new parent still
+    # comes before its children) with the action of its last entry.
+    latest = {}
+    for entry_id, kind, object_id, action in rows:
+        latest[(kind, object_id)] = action
+    entries = [(kind, object_id, action) for (kind, object_id), action in latest.items()]
+    last_id = rows[-1][0] if rows else after
+    return entries, last_id, has_more
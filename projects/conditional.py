@@ -0,0 +1,116 @@
+"""
+Conditional GET (``ETag`` / ``If-None-Match``) for the project pages.
+
+Every save/delete hook below a project bumps ``Project.content_version``
+with an atomic ``F()`` update (see rollups.py), and so do the bulk import
+and batch entry paths. A page scoped to one project therefore cannot change
+while that number stays the same. ``project_etag`` wraps such a view: a GET
+first reads the version, in one indexed query, through the project, branch,
+expense or release id in the URL and restricted to the user's projects. If
+the browser already has the page it gets a ``304`` without the view running.
+
+The ETag also covers:
+
+* the user and the full path, so query strings and pages differ;
+* the CSRF cookie, because cached forms carry a token derived from it;
+* the day, because the analytics range and form defaults depend on it;
+* a release stamp, so a deploy with new templates or static files is not
+  answered from pages the browser cached before it (set
+  ``CIVITRACK_RELEASE`` to cover view code changes too).
+
+A page with flash messages waiting is rendered normally and sent without
+an ETag, so a later ``304`` cannot bring the message back.
+"""
+import datetime
+import hashlib
+from functools import lru_cache, wraps
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from .models import Project
+
+
+# URL argument -> lookup from Project to the object it names
+SCOPES = {
+    'project_id': 'pk',
+    'branch_id': 'branches__id',
+    'subbranch_id': 'branches__subbranches__id',
+    'history_id': 'released_history__id',
+}
+
+
+@lru_cache(maxsize=None)
+def release_stamp():
+    """Hash of the templates, the static files manifest and CIVITRACK_RELEASE, once per process."""
+    digest = hashlib.sha1(settings.CIVITRACK_RELEASE.encode())
+    digest.update(getattr(staticfiles_storage, 'manifest_hash', '').encode())
+    for directory in settings.TEMPLATES[0]['DIRS']:
+        for path in sorted(Path(directory).rglob('*.html')):
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def project_version(user, **kwargs):
+    """``content_version`` of the user's project the URL arguments point into, or None."""
+    for argument, lookup in SCOPES.items():
+        if argument in kwargs:
+            return (
+                Project.objects.filter(user=user, **{lookup: kwargs[argument]})
+                .values_list('content_version', flat=True)
+                .first()
+            )
+    raise TypeError(f'project_etag needs one of {", ".join(SCOPES)} in the URL')
+
+
+def _precondition(request, user, kwargs):
+    """Return ``(etag, not_modified_response)``; etag is None when the page must not be cached."""
+    if len(messages.get_messages(request)):
+        return None, None
+    version = project_version(user, **kwargs)
+    if version is None:
+        # Not the user's (or gone): let the view answer 404
+        return None, None
+    parts = (
+        release_stamp(), user.pk, request.get_full_path(), version,
+        request.META.get('CSRF_COOKIE', ''), datetime.date.today().isoformat(),
+    )
+    etag = '"%s"' % hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()
+    return etag, get_conditional_response(request, etag=etag)
+
+
+def _finish(response, etag):
+    if etag and response.status_code in (200, 304):
+        response['ETag'] = etag
+    if etag:
+        # Always revalidate; the page is for this user only
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def project_etag(view):
+    """Answer unchanged GETs of a project-scoped page with 304. Goes below the login check."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await view(request, *args, **kwargs)
+            user = await request.auser()
+            etag, response = await sync_to_async(_precondition)(request, user, kwargs)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            return _finish(response, etag)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            etag, response = _precondition(request, request.user, kwargs)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return _finish(response, etag)
+    return wrapper
@@ -0,0 +1,158 @@
+"""
+Background generation and on-disk caching of project PDF reports.
+
+Reports are stored under ``MEDIA_ROOT/exports/<project id>/`` and named after
+the project's ``content_version``. As long as nothing in the project changes
+the stored file is served as-is, so it holds nothing specific to one download;
+any write bumps the version, so the next export renders a new file and the
+ones for older versions are removed. Export jobs are
+``ExportJob`` rows processed by the ``run_export_worker`` management command.
+"""
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import reports
+from .models import ExportJob
+from .snapshots import load_project_snapshot
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = 'exports'
+
+
+def artifact_name(project_id, version):
+    """Path of a cached report relative to MEDIA_ROOT."""
+    return f'{EXPORT_DIR}/{project_id}/v{version}.pdf'
+
+
+def artifact_path(name):
+    return Path(settings.MEDIA_ROOT) / name
+
+
+def cached_export(project):
+    """Return the name of the cached report for the project's current version, or None."""
+    name = artifact_name(project.pk, project.content_version)
+    return name if artifact_path(name).exists() else None
+
+
+def render_export(project):
+    """
+    Render the report for ``project`` into the cache and return its name.
+
+    The version is taken from ``project`` as loaded, before any rows are read,
+    so a file can contain newer data than its name says but never older.
+    """
+    name = artifact_name(project.pk, project.content_version)
+    path = artifact_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Write next to the final name and rename into place, so a reader never
+    # sees a half-written file.
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as fileobj:
+            reports.build_project_pdf(project, fileobj)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+    # Only older versions: a worker still holding an out-of-date snapshot
+    # must not delete the file a newer render has just written
+    for stale in path.parent.glob('v*.pdf'):
+        if _artifact_version(stale) < project.content_version:
+            stale.unlink(missing_ok=True)
+    return name
+
+
+def _artifact_version(path):
+    try:
+        return int(path.stem[1:])
+    except ValueError:
+        return -1
+
+
+def get_or_render_export(project):
+    return cached_export(project) or render_export(project)
+
+
+def enqueue_export(project, user):
+    """
+    Return an export job for the project's current version.
+
+    The job is already done if the report is cached, and a job that is still
+    pending for the same version is reused rather than queueing a duplicate.
+    """
+    name = cached_export(project)
+    if name:
+        return ExportJob.objects.create(
+            project=project,
+            user=user,
+            content_version=project.content_version,
+            status=ExportJob.STATUS_DONE,
+            file=name,
+            finished_at=timezone.now(),
+        )
+
+    pending = ExportJob.objects.filter(
+        project=project,
+        content_version=project.content_version,
+        status__in=[ExportJob.STATUS_QUEUED, ExportJob.STATUS_RUNNING],
+    ).first()
+    if pending:
+        return pending
+    return ExportJob.objects.create(project=project, user=user, content_version=project.content_version)
+
+
+def claim_next_job():
+    """
+    Take the oldest queued job and mark it running, or return None.
+
+    The claim is a conditional UPDATE, so several workers can poll the same
+    table without processing a job twice.
+    """
+    while True:
+        job = (ExportJob.objects.filter(status=ExportJob.STATUS_QUEUED)
+               .order_by('created_at', 'id')
+               .first())
+        if job is None:
+            return None
+        claimed = ExportJob.objects.filter(pk=job.pk, status=ExportJob.STATUS_QUEUED).update(
+            status=ExportJob.STATUS_RUNNING,
+            started_at=timezone.now(),
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def requeue_stale_jobs(older_than):
+    """Put running jobs started before ``older_than`` back in the queue (their worker died)."""
+    return ExportJob.objects.filter(
+        status=ExportJob.STATUS_RUNNING,
+        started_at__lt=older_than,
+    ).update(status=ExportJob.STATUS_QUEUED, started_at=None)
+
+
+def run_job(job):
+    """Render the report for a claimed job and record the outcome."""
+    try:
+        project = load_project_snapshot(job.user, job.project_id, branches=True)
+        name = get_or_render_export(project)
+    except Exception as exc:
+        logger.exception('Export job %s failed', job.pk)
+        job.status = ExportJob.STATUS_FAILED
+        job.error = str(exc) or exc.__class__.__name__
+    else:
+        job.status = ExportJob.STATUS_DONE
+        job.file = name
+        job.content_version = project.content_version
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'file', 'error', 'content_version', 'finished_at'])
+    return job
@@ -1,7 +1,9 @@
 from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
+from .backends import normalize_email, users_with_email
 from .models import Project, Branch, SubBranch, ReleasedHistory
+from .portfolio import DEFAULT_SORT
 
 
 class UserRegisterForm(UserCreationForm):
@@ -16,6 +18,12 @@ class UserRegisterForm(UserCreationForm):
         self.fields['password1'].label = 'DOB (Password)'
         self.fields['password1'].help_text = 'Enter 8 digits (Ex: 25042004)'
         self.fields['password2'].label = 'Confirm Password'
+    
+    def clean_email(self):
+        email = normalize_email(self.cleaned_data['email'])
+        if users_with_email(email).exists():
+            raise forms.ValidationError('An account with this email already exists.')
+        return email
 
 
 class UserLoginForm(forms.Form):
@@ -54,6 +62,31 @@ class SubBranchForm(forms.ModelForm):
         }
 
 
+# Blank rows shown on the batch entry page (more can be added there) and the
+# most one submit may carry
+BATCH_ENTRY_ROWS = 10
+MAX_BATCH_ENTRY_ROWS = 200
+
+# Rows left blank are ignored; at least one must be filled in
+SubBranchBatchFormSet = forms.formset_factory(
+    SubBranchForm,
+    extra=BATCH_ENTRY_ROWS - 1,
+    min_num=1,
+    validate_min=True,
+    max_num=MAX_BATCH_ENTRY_ROWS,
+    absolute_max=MAX_BATCH_ENTRY_ROWS,
+    validate_max=True,
+)
+
+
+class SubBranchImportForm(forms.Form):
+    file = forms.FileField(
+        widget=forms.ClearableFileInput(attrs={'class': 'input-field', 'accept': '.csv,text/csv'}),
+        label='CSV file',
+        help_text='Columns: name, amount, date (YYYY-MM-DD)',
+    )
+
+
 class ReleasedHistoryForm(forms.ModelForm):
     class Meta:
         model = ReleasedHistory
@@ -62,3 +95,55 @@ class ReleasedHistoryForm(forms.ModelForm):
             'amount': forms.NumberInput(attrs={'class': 'input-field', 'placeholder': 'Enter amount', 'step': '0.01'}),
             'date': forms.DateInput(attrs={'class': 'input-field', 'type': 'date'}),
         }
+
+
+class PortfolioFilterForm(forms.Form):
+    SORT_CHOICES = [
+        ('-utilisation', 'Utilisation (high to low)'),
+        ('utilisation', 'Utilisation (low to high)'),
+        ('-spent', 'Spent (high to low)'),
+        ('-remaining', 'Remaining to release (high to low)'),
+        ('unspent', 'Unspent releases (low to high)'),
+        ('-budget', 'Budget (high to low)'),
+        ('name', 'Name'),
+        ('-start_date', 'Newest first'),
+    ]
+    STATUS_CHOICES = [
+        ('', 'All projects'),
+        ('over_budget', 'Over budget'),
+        ('overspent', 'Spent more than released'),
+        ('pending_release', 'Budget not fully released'),
+    ]
+    
+    q = forms.CharField(required=False, widget=forms.TextInput(attrs={'class': 'input-field', 'placeholder': 'Search projects'}))
+    status = forms.ChoiceField(required=False, choices=STATUS_CHOICES, widget=forms.Select(attrs={'class': 'input-field'}))
+    min_utilisation = forms.DecimalField(required=False, min_value=0, widget=forms.NumberInput(attrs={'class': 'input-field', 'placeholder': 'Min %'}))
+    max_utilisation = forms.DecimalField(required=False, min_value=0, widget=forms.NumberInput(attrs={'class': 'input-field', 'placeholder': 'Max %'}))
+    sort = forms.ChoiceField(required=False, choices=SORT_CHOICES, widget=forms.Select(attrs={'class': 'input-field'}))
+    
+    def portfolio_options(self):
+        """Keyword arguments for ``portfolio.get_portfolio``; defaults if invalid."""
+        data = self.cleaned_data if self.is_valid() else {}
+        return {
+            'sort': data.get('sort') or DEFAULT_SORT,
+            'q': data.get('q', '').strip(),
+            'status': data.get('status', ''),
+            'min_utilisation': data.get('min_utilisation'),
+            'max_utilisation': data.get('max_utilisation'),
+        }
+
+
+class SearchForm(forms.Form):
+    KIND_CHOICES = [
+        ('', 'Everything'),
+        ('subbranch', 'Expenses'),
+        ('branch', 'Branches'),
+        ('project', 'Projects'),
+    ]
+    
+    q = forms.CharField(required=False, max_length=200, widget=forms.TextInput(attrs={'class': 'input-field', 'placeholder': 'Search expenses, branches, projects', 'autofocus': True}))
+    kind = forms.ChoiceField(required=False, choices=KIND_CHOICES, widget=forms.Select(attrs={'class': 'input-field'}))
+    min_amount = forms.DecimalField(required=False, widget=forms.NumberInput(attrs={'class': 'input-field', 'placeholder': 'Min amount', 'step': '0.01'}))
+    max_amount = forms.DecimalField(required=False, widget=forms.NumberInput(attrs={'class': 'input-field', 'placeholder': 'Max amount', 'step': '0.01'}))
+    date_from = forms.DateField(required=False, widget=forms.DateInput(attrs={'class': 'input-field', 'type': 'date'}))
+    date_to = forms.DateField(required=False, widget=forms.DateInput(attrs={'class': 'input-field', 'type': 'date'}))
@@ -0,0 +1,190 @@
+"""
+Streaming bulk import of expense entries (SubBranch rows) from CSV.
+
+The file is read one line at a time and rows are inserted with ``bulk_create``
+in fixed-size batches, so memory use does not depend on the size of the file.
+Each row is validated with the same field rules as ``SubBranchForm``; invalid
+rows are skipped and reported with their line number. Each batch goes
+through ``bulk_insert_subbranches``, which the batch entry form uses as well.
+
+Every batch is committed in its own transaction. SQLite lets one connection
+write at a time, so one transaction around a 100k-row file would hold up
+everyone else's saves until the whole file was in; this way they wait for
+one batch at most. A file is therefore not all-or-nothing: should a line
+turn out to be unreadable halfway through, the batches before it stay and
+the error says how many entries that was.
+"""
+import csv
+import datetime
+import io
+from collections import defaultdict
+from decimal import Decimal
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from . import changefeed, rollups, search
+from .forms import SubBranchForm
+from .models import SubBranch
+
+
+IMPORT_BATCH_SIZE = 1000
+# Only the first errors are kept for reporting; the rest are just counted.
+MAX_REPORTED_ERRORS = 200
+IMPORT_COLUMNS = ('name', 'amount', 'date')
+
+
+class ImportFormatError(ValueError):
+    """The uploaded file cannot be read as an expense CSV at all."""
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def _open_text(fileobj, encoding):
+    if isinstance(fileobj, io.TextIOBase):
+        return fileobj
+    # Uploaded files and files opened in binary mode; utf-8-sig drops the BOM
+    # that spreadsheet applications put in front of exported CSVs.
+    return io.TextIOWrapper(fileobj, encoding=encoding, newline='')
+
+
+def _header_positions(header):
+    normalised = [column.strip().lower() for column in header]
+    missing = [column for column in IMPORT_COLUMNS if column not in normalised]
+    if missing:
+        raise ImportFormatError(f"Missing column(s): {', '.join(missing)}")
+    return {column: normalised.index(column) for column in IMPORT_COLUMNS}
+
+
+def _clean_value(field, raw):
+    # ISO dates are by far the most common input; parsing them directly skips
+    # the locale-aware format probing in DateField.to_python, which dominates
+    # the cost of large imports. Anything else goes through the full field.
+    if isinstance(field, forms.DateField):
+        try:
+            value = datetime.date.fromisoformat(raw)
+        except ValueError:
+            return field.clean(raw)
+        field.validate(value)
+        field.run_validators(value)
+        return value
+    return field.clean(raw)
+
+
+def _clean_row(fields, row, positions):
+    values = {}
+    errors = []
+    for column, position in positions.items():
+        raw = row[position].strip() if position < len(row) else ''
+        try:
+            values[column] = _clean_value(fields[column], raw)
+        except ValidationError as exc:
+            errors.append(f"{column}: {' '.join(exc.messages)}")
+    return values, errors
+
+
+def import_subbranches(branch, fileobj, batch_size=IMPORT_BATCH_SIZE, encoding='utf-8-sig'):
+    """
+    Import expense rows for ``branch`` from a CSV file object.
+
+    The first line must be a header containing ``name``, ``amount`` and
+    ``date`` (in any order, extra columns are ignored). Returns an
+    ``ImportResult``; raises ``ImportFormatError`` if the header is unusable.
+    """
+    reader = csv.reader(_open_text(fileobj, encoding))
+    try:
+        positions = _header_positions(next(reader))
+    except StopIteration:
+        raise ImportFormatError('The file is empty.')
+    except (UnicodeDecodeError, csv.Error) as exc:
+        raise ImportFormatError(f'Could not read the file: {exc}')
+
+    # Reuse the form's field rules without building a form per row.
+    fields = SubBranchForm.base_fields
+    result = ImportResult()
+    batch = []
+
+    try:
+        for row in reader:
+            line = reader.line_num
+            if not any(cell.strip() for cell in row):
+                continue
+            values, errors = _clean_row(fields, row, positions)
+            if errors:
+                result.add_error(line, '; '.join(errors))
+                continue
+            batch.append(SubBranch(branch=branch, **values))
+            if len(batch) >= batch_size:
+                result.created += _insert_batch(branch, batch)
+                batch = []
+    except (UnicodeDecodeError, csv.Error) as exc:
+        raise ImportFormatError(
+            f'Could not read line {reader.line_num + 1}: {exc}. '
+            f'The {result.created} entries before it were imported.'
+        )
+
+    result.created += _insert_batch(branch, batch)
+    return result
+
+
+def _insert_batch(branch, batch):
+    # One short transaction per batch (see the module docstring)
+    with transaction.atomic():
+        return bulk_insert_subbranches(branch, batch)
+
+
+def bulk_insert_subbranches(branch, subbranches):
+    """
+    Insert new expense rows of ``branch`` with one ``bulk_create``.
+
+    Everything ``SubBranch.save()`` would do follows once for the whole list:
+    the branch total, the spending rollups, the project's content_version,
+    the change log and the search index. Must run inside a transaction.
+    Returns the number of rows inserted.
+    """
+    subbranches = list(subbranches)
+    if not subbranches:
+        return 0
+    for obj in subbranches:
+        obj.branch = branch
+
+    SubBranch.objects.bulk_create(subbranches)
+    if not connection.features.can_return_rows_from_bulk_insert:
+        _fetch_ids(branch, subbranches)
+    search.index_new_subbranches(branch, subbranches)
+
+    daily = defaultdict(Decimal)
+    for obj in subbranches:
+        daily[branch.pk, obj.date] += obj.amount
+    rollups.adjust_branch_spent(branch.pk, sum(daily.values(), rollups.ZERO))
+    rollups.adjust_spending(daily)
+    rollups.bump_project_version(branch.project_id)
+    changefeed.record_changes(
+        [(changefeed.KIND_SUBBRANCH, changefeed.ACTION_UPSERT, obj.pk) for obj in subbranches]
+        + [(changefeed.KIND_BRANCH, changefeed.ACTION_UPSERT, branch.pk)],
+        branch_id=branch.pk,
+    )
+    return len(subbranches)
+
+
+def _fetch_ids(branch, subbranches):
+    # bulk_create leaves the ids unset on SQLite before 3.35 (the only
+    # backend Django 5.0 supports without RETURNING). SQLite runs one writer
+    # at a time and its AUTOINCREMENT ids only grow, so within our
+    # transaction the branch's newest rows are the ones just inserted, in
+    # list order.
+    ids = (SubBranch._base_manager.filter(branch=branch).order_by('-pk')
+           .values_list('pk', flat=True)[:len(subbranches)])
+    for obj, pk in zip(subbranches, reversed(list(ids))):
+        obj.pk = pk
@@ -0,0 +1,80 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from projects import archives
+from projects.models import Project, ReleasedHistory, SubBranch
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the expenses and releases of finished projects into compressed archive files '
+        'under MEDIA_ROOT; the projects stay viewable and exportable, read-only.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='*', type=int, help='Projects to archive.')
+        parser.add_argument(
+            '--inactive-days',
+            type=int,
+            default=None,
+            help='Archive every project with no expense or release added in this many days.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=archives.ARCHIVE_BATCH_SIZE,
+            help='Rows removed per DELETE statement (default: %(default)s).',
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0.05,
+            help='Seconds to sleep after each batch, to leave room for other writers (default: %(default)s).',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only list what would be archived.',
+        )
+
+    def handle(self, *args, **options):
+        if not options['project_ids'] and options['inactive_days'] is None:
+            raise CommandError('Give project ids or --inactive-days.')
+
+        projects = Project.objects.filter(archived_at__isnull=True).order_by('id')
+        if options['project_ids']:
+            projects = projects.filter(pk__in=options['project_ids'])
+        if options['inactive_days'] is not None:
+            cutoff = timezone.now() - datetime.timedelta(days=options['inactive_days'])
+            projects = projects.filter(created_at__lt=cutoff).exclude(
+                Exists(SubBranch.objects.filter(branch__project=OuterRef('pk'), created_at__gte=cutoff))
+            ).exclude(
+                Exists(ReleasedHistory.objects.filter(project=OuterRef('pk'), created_at__gte=cutoff))
+            )
+
+        archived = failed = 0
+        for project in list(projects):
+            if options['dry_run']:
+                self.stdout.write(f'Project {project.pk} "{project.name}"')
+                continue
+            try:
+                counts = archives.archive_project(project, batch_size=options['batch_size'], pause=options['pause'])
+            except archives.ArchiveError as exc:
+                self.stderr.write(self.style.ERROR(str(exc)))
+                failed += 1
+                continue
+            rows = ', '.join(f'{count} {kind}(s)' for kind, count in counts.items())
+            self.stdout.write(f'Project {project.pk} "{project.name}": {rows} archived')
+            archived += 1
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Dry run: nothing was archived.'))
+        elif archived or failed:
+            self.stdout.write(self.style.SUCCESS(f'Archived {archived} project(s).'))
+            if failed:
+                raise CommandError(f'{failed} project(s) could not be archived.')
+        else:
+            self.stdout.write(self.style.SUCCESS('Nothing to archive.'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from projects import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Load the project list, project, release history and branch history pages '
+        'concurrently through the WSGI handler (a thread pool) and the ASGI handler '
+        '(one event loop), using the data from seed_benchmark_data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Page loads per handler (default: 200).')
+        parser.add_argument('--concurrency', type=int, default=20,
+                            help='Requests in flight at once: WSGI threads or ASGI clients (default: 20).')
+
+    def handle(self, *args, **options):
+        # The test client needs "testserver" in ALLOWED_HOSTS
+        setup_test_environment()
+        try:
+            results = benchmarks.compare_handlers(options['requests'], options['concurrency'])
+        except (LookupError, RuntimeError) as exc:
+            raise CommandError(exc)
+        finally:
+            teardown_test_environment()
+
+        for handler, result in results.items():
+            self.stdout.write(
+                f"{handler.upper():>5}: {result['requests']} requests, {options['concurrency']} at a time, "
+                f"in {result['seconds']}s = {result['requests_per_second']}/s; "
+                f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms"
+            )
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from projects import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Time logging in by email with 10k, 100k and 1M accounts (or the --users given), '
+        'adding bare accounts between the sizes. Use a scratch database: the rows are real.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, action='append',
+                            help='Number of accounts to measure at; repeat for several '
+                                 '(default: 10000, 100000, 1000000).')
+        parser.add_argument('--iterations', type=int, default=20, help='Logins per size (default: 20).')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the accounts picked.')
+        parser.add_argument('--clear', action='store_true', help='Delete the benchmark accounts afterwards.')
+
+    def handle(self, *args, **options):
+        try:
+            results = benchmarks.login_scaling(
+                options['users'] or benchmarks.LOGIN_USER_COUNTS,
+                iterations=options['iterations'],
+                seed=options['seed'],
+                stdout=self.stdout if options['verbosity'] > 1 else None,
+            )
+        except RuntimeError as exc:
+            raise CommandError(exc)
+        finally:
+            if options['clear']:
+                removed = benchmarks.clear_login_users()
+                self.stdout.write(f'Removed {removed} benchmark account(s).')
+
+        for result in results:
+            self.stdout.write(
+                f"{result['users']:>9} users: lookup p50 {result['lookup_p50_ms']:>7.3f} ms  "
+                f"p95 {result['lookup_p95_ms']:>7.3f} ms  login p50 {result['login_p50_ms']:>8.2f} ms  "
+                f"p95 {result['login_p95_ms']:>8.2f} ms  {result['queries']} query(ies)"
+            )
+        first, last = results[0], results[-1]
+        if len(results) > 1 and first['lookup_p50_ms']:
+            self.stdout.write(
+                f"Lookup p50 at {last['users']} users is {last['lookup_p50_ms'] / first['lookup_p50_ms']:.2f}x "
+                f"that at {first['users']}."
+            )
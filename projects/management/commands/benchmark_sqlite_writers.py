@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError
+
+
+PROFILES = {
+    'default': '0',
+    'tuned': '1',
+}
+# Head start for the processes to import Django before the timed run begins
+START_DELAY = 3.0
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure expense-entry throughput with several processes writing to one '
+        'SQLite database at once, with and without CIVITRACK_SQLITE_TUNING. '
+        'Runs against throwaway database files, never the configured one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4, help='Parallel writer processes (default: 4).')
+        parser.add_argument('--readers', type=int, default=2,
+                            help='Parallel processes reading project summaries meanwhile (default: 2).')
+        parser.add_argument('--entries', type=int, default=200,
+                            help='Expenses saved (or summaries read) by each process (default: 200).')
+        parser.add_argument('--profile', choices=sorted(PROFILES), action='append',
+                            help='Profile to run; repeat for several (default: all).')
+        # Internal: how the worker processes are started
+        parser.add_argument('--role', choices=['setup', 'writer', 'reader'], help=argparse.SUPPRESS)
+        parser.add_argument('--target', type=int, help=argparse.SUPPRESS)
+        parser.add_argument('--start-at', type=float, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['role'] == 'setup':
+            return self.setup(options['writers'])
+        if options['role']:
+            return self.work(options['role'], options['target'], options['entries'], options['start_at'])
+
+        results = {}
+        for profile in options['profile'] or sorted(PROFILES):
+            results[profile] = self.run_profile(profile, options)
+            self.report(profile, results[profile])
+        if {'default', 'tuned'} <= results.keys() and results['default']['writes_per_second']:
+            speedup = results['tuned']['writes_per_second'] / results['default']['writes_per_second']
+            self.stdout.write(self.style.SUCCESS(f'Tuned writes/s: {speedup:.2f}x the default profile.'))
+
+    # ─── Coordinator ───
+    def run_profile(self, profile, options):
+        directory = tempfile.mkdtemp(prefix='civitrack-bench-')
+        env = dict(os.environ)
+        env['DATABASE_URL'] = f'sqlite:///{os.path.join(directory, "bench.sqlite3")}'
+        env['CIVITRACK_SQLITE_TUNING'] = PROFILES[profile]
+        manage = [sys.executable, str(settings.BASE_DIR / 'manage.py')]
+        command = manage + ['benchmark_sqlite_writers', '--entries', str(options['entries'])]
+        try:
+            subprocess.run(manage + ['migrate', '-v0'], env=env, check=True)
+            setup = subprocess.run(command + ['--role', 'setup', '--writers', str(options['writers'])],
+                                   env=env, check=True, capture_output=True, text=True)
+            targets = json.loads(setup.stdout)
+
+            start_at = time.time() + START_DELAY
+            workers = [
+                subprocess.Popen(command + ['--role', role, '--target', str(target), '--start-at', str(start_at)],
+                                 env=env, stdout=subprocess.PIPE, text=True)
+                for role, target in (
+                    [('writer', branch_id) for branch_id in targets['branches']]
+                    + [('reader', targets['projects'][i % len(targets['projects'])])
+                       for i in range(options['readers'])]
+                )
+            ]
+            outputs = [json.loads(worker.communicate()[0]) for worker in workers]
+            if any(worker.returncode for worker in workers):
+                raise CommandError(f'A benchmark process failed ({profile} profile).')
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        writers = [out for out in outputs if out['role'] == 'writer']
+        readers = [out for out in outputs if out['role'] == 'reader']
+        elapsed = max(out['finished_at'] for out in writers) - start_at
+        write_latencies = sorted(latency for out in writers for latency in out['latencies'])
+        read_latencies = sorted(latency for out in readers for latency in out['latencies'])
+        saved = sum(out['done'] for out in writers)
+        return {
+            'writers': len(writers),
+            'readers': len(readers),
+            'seconds': round(elapsed, 3),
+            'saved': saved,
+            'locked_errors': sum(out['errors'] for out in writers),
+            'writes_per_second': round(saved / elapsed, 1) if elapsed > 0 else 0,
+            'write_p95_ms': _percentile(write_latencies, 95),
+            'read_p95_ms': _percentile(read_latencies, 95),
+            'read_max_ms': read_latencies[-1] if read_latencies else None,
+        }
+
+    def report(self, profile, result):
+        self.stdout.write(
+            f"{profile:>8}: {result['saved']} expenses by {result['writers']} writer(s) in {result['seconds']}s "
+            f"= {result['writes_per_second']}/s, {result['locked_errors']} 'database is locked' error(s); "
+            f"write p95 {result['write_p95_ms']} ms; read p95 {result['read_p95_ms']} ms, "
+            f"max {result['read_max_ms']} ms"
+        )
+
+    # ─── Worker processes ───
+    def setup(self, writers):
+        from django.contrib.auth.models import User
+        from projects.models import Branch, Project
+
+        # One user, project and branch per writer, as with separate people
+        # entering expenses at the same time
+        branches, projects = [], []
+        for i in range(writers):
+            user = User.objects.create_user(f'bench{i}', f'bench{i}@example.com')
+            project = Project.objects.create(user=user, name=f'Benchmark {i}', amount=Decimal('1000000'),
+                                             start_date=date.today())
+            branches.append(Branch.objects.create(project=project, name='Materials').pk)
+            projects.append(project.pk)
+        self.stdout.write(json.dumps({'branches': branches, 'projects': projects}))
+
+    def work(self, role, target, entries, start_at):
+        from projects.models import SubBranch
+        from projects.summaries import compute_summary
+
+        time.sleep(max(0, start_at - time.time()))
+        done = errors = 0
+        latencies = []
+        for i in range(entries):
+            started = time.perf_counter()
+            try:
+                if role == 'writer':
+                    SubBranch.objects.create(branch_id=target, name=f'Cement {i}', amount=Decimal('10.00'),
+                                             date=date.today())
+                else:
+                    compute_summary(target)
+            except OperationalError as exc:
+                if 'locked' not in str(exc):
+                    raise
+                errors += 1
+                continue
+            latencies.append(round((time.perf_counter() - started) * 1000, 2))
+            done += 1
+        self.stdout.write(json.dumps({
+            'role': role, 'done': done, 'errors': errors, 'latencies': latencies, 'finished_at': time.time(),
+        }))
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return round(statistics.quantiles(values, n=100)[percent - 1], 2)
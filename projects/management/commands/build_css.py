@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from civitrack import assets
+
+
+class Command(BaseCommand):
+    help = (
+        'Build static/css/app.css from assets/css and the utility classes the templates use. '
+        'Run it after changing a template or assets/css, then collectstatic when deploying.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Fail if static/css/app.css is not up to date instead of writing it.')
+
+    def handle(self, *args, **options):
+        css, unknown = assets.build(settings.BASE_DIR)
+        for name in unknown:
+            self.stderr.write(self.style.WARNING(f'Unknown class (no utility or component rule): {name}'))
+
+        target = settings.BASE_DIR / 'static' / 'css' / 'app.css'
+        current = target.read_text(encoding='utf-8') if target.exists() else None
+        if options['check']:
+            if current != css:
+                raise CommandError(f'{target} is out of date; run `python manage.py build_css`.')
+            self.stdout.write(self.style.SUCCESS(f'{target} is up to date.'))
+            return
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(css, encoding='utf-8')
+        self.stdout.write(self.style.SUCCESS(f'Wrote {target} ({len(css.encode()):,} bytes).'))
@@ -0,0 +1,101 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+
+from civitrack.database import parse_database_url
+
+
+SOURCE_ALIAS = 'copy_source'
+
+# Parents before children. Derived tables (rollups, change log, search
+# entries) are copied as they are rather than rebuilt, so totals, sync
+# cursors and search results carry over unchanged.
+COPIED_MODELS = [
+    'auth.User',
+    'projects.Project',
+    'projects.Branch',
+    'projects.SubBranch',
+    'projects.ReleasedHistory',
+    'projects.ExportJob',
+    'projects.ChangeLog',
+    'projects.SpendRollup',
+    'projects.SearchEntry',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy users and all project data from another database (e.g. the old '
+        'SQLite file) into the configured default database, such as PostgreSQL.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'source',
+            help='DATABASE_URL of the database to copy from, e.g. sqlite:///db.sqlite3',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Rows read and inserted at a time (default: 2000).',
+        )
+
+    def handle(self, *args, **options):
+        config = parse_database_url(options['source'], base_dir=settings.BASE_DIR)
+        connections.settings[SOURCE_ALIAS] = connections.configure_settings(
+            {DEFAULT_DB_ALIAS: {}, SOURCE_ALIAS: config}
+        )[SOURCE_ALIAS]
+        source, target = connections[SOURCE_ALIAS], connections[DEFAULT_DB_ALIAS]
+        if source.settings_dict['ENGINE'] == target.settings_dict['ENGINE'] and \
+                str(source.settings_dict['NAME']) == str(target.settings_dict['NAME']):
+            raise CommandError('The source is the default database itself.')
+
+        for connection, label in ((source, 'source'), (target, 'target')):
+            executor = MigrationExecutor(connection)
+            if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+                raise CommandError(f'The {label} database has unapplied migrations; run migrate on it first.')
+
+        models = [apps.get_model(label) for label in COPIED_MODELS]
+        if any(model._base_manager.using(DEFAULT_DB_ALIAS).exists() for model in models):
+            raise CommandError('The target database already holds data; copy into a freshly migrated database.')
+
+        try:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                for model in models:
+                    copied = self.copy_table(model, source, target, options['batch_size'])
+                    self.stdout.write(f'{model._meta.label}: {copied} row(s)')
+                # Continue the id sequences after the copied ids
+                with target.cursor() as cursor:
+                    for sql in target.ops.sequence_reset_sql(no_style(), models):
+                        cursor.execute(sql)
+        finally:
+            source.close()
+        self.stdout.write(self.style.SUCCESS('Copy complete.'))
+
+    def copy_table(self, model, source, target, batch_size):
+        # Plain INSERTs rather than bulk_create, which would stamp
+        # auto_now/auto_now_add fields with the current time
+        fields = model._meta.concrete_fields
+        columns = ', '.join(target.ops.quote_name(field.column) for field in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        sql = f'INSERT INTO {target.ops.quote_name(model._meta.db_table)} ({columns}) VALUES ({placeholders})'
+
+        rows = (model._base_manager.using(SOURCE_ALIAS).order_by('pk')
+                .values_list(*[field.attname for field in fields]).iterator(chunk_size=batch_size))
+        copied = 0
+        batch = []
+        with target.cursor() as cursor:
+            for row in rows:
+                batch.append([field.get_db_prep_save(value, connection=target) for field, value in zip(fields, row)])
+                if len(batch) >= batch_size:
+                    cursor.executemany(sql, batch)
+                    copied += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(sql, batch)
+                copied += len(batch)
+        return copied
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from projects import importers
+from projects.models import Branch
+
+
+class Command(BaseCommand):
+    help = 'Bulk import expense entries (name, amount, date) from a CSV file into a branch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('branch_id', type=int, help='Branch that receives the entries.')
+        parser.add_argument('csv_path', help='Path to the CSV file.')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=importers.IMPORT_BATCH_SIZE,
+            help='Rows per INSERT batch (default: %(default)s).',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            branch = Branch.objects.get(pk=options['branch_id'])
+        except Branch.DoesNotExist:
+            raise CommandError(f"Branch {options['branch_id']} does not exist.")
+
+        try:
+            with open(options['csv_path'], 'rb') as fileobj:
+                result = importers.import_subbranches(
+                    branch, fileobj, batch_size=options['batch_size'],
+                )
+        except OSError as exc:
+            raise CommandError(f'Cannot open {options["csv_path"]}: {exc}')
+        except importers.ImportFormatError as exc:
+            raise CommandError(str(exc))
+
+        for line, error in result.errors:
+            self.stderr.write(f'Line {line}: {error}')
+        if result.error_count > len(result.errors):
+            self.stderr.write(f'...and {result.error_count - len(result.errors)} more rows skipped.')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result.created} entries into "{branch.name}" '
+            f'({result.error_count} rows skipped).'
+        ))
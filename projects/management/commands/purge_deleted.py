@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+
+from projects import trash
+from projects.models import Branch, Project
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove deleted projects and branches whose undo window (CIVITRACK_UNDO_WINDOW) has '
+        'passed, their entries first and in small batches.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=trash.PURGE_BATCH_SIZE,
+            help='Rows removed per DELETE statement (default: %(default)s).',
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0.05,
+            help='Seconds to sleep after each batch, to leave room for other writers (default: %(default)s).',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Purge at most this many projects and this many branches, then exit.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only list what would be purged.',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = trash.undo_cutoff()
+        batches = {'batch_size': options['batch_size'], 'pause': options['pause']}
+        purges = [
+            ('Project', trash.purgeable(Project, cutoff), trash.purge_project),
+            ('Branch', trash.purgeable(Branch, cutoff), trash.purge_branch),
+        ]
+
+        purged = 0
+        for label, queryset, purge in purges:
+            for obj in list(queryset[:options['limit']]):
+                if options['dry_run']:
+                    self.stdout.write(f'{label} {obj.pk} "{obj.name}" (deleted {obj.deleted_at:%Y-%m-%d %H:%M})')
+                    continue
+                rows = purge(obj, **batches)
+                self.stdout.write(f'{label} {obj.pk} "{obj.name}": {rows} row(s) deleted')
+                purged += 1
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Dry run: nothing was deleted.'))
+        elif purged:
+            self.stdout.write(self.style.SUCCESS(f'Purged {purged} deleted project(s) and branch(es).'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Nothing to purge.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from projects import search
+
+
+class Command(BaseCommand):
+    help = 'Recreate the full-text search entries for every project, branch and expense.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            written = search.rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {written} object(s).'))
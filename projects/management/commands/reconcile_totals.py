@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from projects import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute Branch.total_spent and Project.total_released from their '
+        'child rows and report any drift.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report mismatched totals, do not correct them.',
+        )
+        parser.add_argument(
+            '--rebuild-timeseries',
+            action='store_true',
+            help='Also recompute the daily and monthly spending rollups behind the analytics page.',
+        )
+
+    def handle(self, *args, **options):
+        fix = not options['dry_run']
+        checks = [
+            ('Branch', 'total_spent', rollups.reconcile_branch_totals),
+            ('Project', 'total_released', rollups.reconcile_project_totals),
+        ]
+
+        drift = 0
+        for label, field, reconcile in checks:
+            mismatches = reconcile(fix=fix)
+            drift += len(mismatches)
+            for pk, stored, actual in mismatches:
+                self.stdout.write(f'{label} {pk}: {field} stored {stored} != actual {actual}')
+
+        if options['rebuild_timeseries'] and fix:
+            written = rollups.rebuild_timeseries()
+            self.stdout.write(f'Rebuilt {written} spending rollup row(s).')
+        elif options['rebuild_timeseries']:
+            self.stdout.write(self.style.WARNING('Dry run: spending rollups were not rebuilt.'))
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('All totals are consistent.'))
+        elif fix:
+            self.stdout.write(self.style.SUCCESS(f'Corrected {drift} total(s).'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{drift} total(s) out of date.'))
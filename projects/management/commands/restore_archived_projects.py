@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from projects import archives
+from projects.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Bring archived projects back: put their expenses and releases back in the database and make them writable.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='+', type=int, help='Archived projects to restore.')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=archives.ARCHIVE_BATCH_SIZE,
+            help='Rows inserted per statement (default: %(default)s).',
+        )
+
+    def handle(self, *args, **options):
+        projects = Project.objects.filter(pk__in=options['project_ids'], archived_at__isnull=False).order_by('id')
+        found = {project.pk: project for project in projects}
+        missing = sorted(set(options['project_ids']) - set(found))
+        if missing:
+            raise CommandError(f'Not archived or not found: {", ".join(map(str, missing))}')
+
+        for project in found.values():
+            try:
+                counts = archives.restore_project(project, batch_size=options['batch_size'])
+            except archives.ArchiveError as exc:
+                raise CommandError(str(exc))
+            rows = ', '.join(f'{count} {kind}(s)' for kind, count in counts.items())
+            self.stdout.write(f'Project {project.pk} "{project.name}": {rows} restored')
+        self.stdout.write(self.style.SUCCESS(f'Restored {len(found)} project(s).'))
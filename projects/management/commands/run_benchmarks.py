@@ -0,0 +1,73 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from projects import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the main request paths against the data from seed_benchmark_data '
+        'and store the results as JSON for comparison between commits.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20,
+                            help='Requests per scenario (default: 20).')
+        parser.add_argument('--scenario', action='append',
+                            help='Only run this scenario; repeat for several.')
+        parser.add_argument('--output-dir', type=Path, default=settings.BASE_DIR / 'benchmark_results',
+                            help='Where result files are written (default: benchmark_results/).')
+        parser.add_argument('--compare', metavar='FILE',
+                            help='Result file to compare with, or "latest" for the newest other file.')
+        parser.add_argument('--no-save', action='store_true', help='Do not write a result file.')
+
+    def handle(self, *args, **options):
+        # The test client needs "testserver" in ALLOWED_HOSTS
+        setup_test_environment()
+        try:
+            document = benchmarks.run(options['iterations'], options['scenario'])
+        except (LookupError, RuntimeError) as exc:
+            raise CommandError(exc)
+        finally:
+            teardown_test_environment()
+
+        self.stdout.write(f"Commit {document['commit']} on {document['database']}, "
+                          f"{document['data']['subbranches']} expenses:")
+        for name, result in document['scenarios'].items():
+            self.stdout.write(
+                f"  {name:<20} p50 {result['p50_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  "
+                f"first {result['first_ms']:>9.2f} ms  {result['queries']:>3} queries  "
+                f"peak {result['peak_memory_kib']:>9.1f} KiB"
+            )
+
+        path = None
+        if not options['no_save']:
+            path = benchmarks.save(document, options['output_dir'])
+            self.stdout.write(f'Saved {path}')
+
+        if options['compare']:
+            self.compare(document, options['compare'], options['output_dir'], path)
+
+    def compare(self, document, name, directory, path):
+        baseline_path = benchmarks.latest(directory, exclude=path) if name == 'latest' else Path(name)
+        if baseline_path is None or not baseline_path.exists():
+            raise CommandError(f'No result file to compare with ({name}).')
+        baseline = json.loads(baseline_path.read_text())
+
+        self.stdout.write(f"Compared with {baseline_path.name} (commit {baseline['commit']}):")
+        regressions = 0
+        for scenario, metric, old, new, change, regressed in benchmarks.compare(document, baseline):
+            line = f'  {scenario:<20} {metric:<16} {old:>10} -> {new:<10} ({change:+.1%})'
+            if regressed:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            self.stdout.write(self.style.WARNING(f'{regressions} regression(s).'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No regressions.'))
@@ -0,0 +1,60 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from projects import exports
+
+
+class Command(BaseCommand):
+    help = 'Process queued PDF export jobs in the background.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when the queue is empty instead of waiting for new jobs.',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait between polls of an empty queue (default: %(default)s).',
+        )
+        parser.add_argument(
+            '--stale-after',
+            type=int,
+            default=600,
+            help='Requeue jobs left running for this many seconds by a dead worker (default: %(default)s).',
+        )
+
+    def handle(self, *args, **options):
+        requeued = exports.requeue_stale_jobs(
+            timezone.now() - timedelta(seconds=options['stale_after'])
+        )
+        if requeued:
+            self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale job(s).'))
+
+        self.stdout.write('Export worker started.')
+        try:
+            while True:
+                job = exports.claim_next_job()
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                started = time.monotonic()
+                job = exports.run_job(job)
+                elapsed = time.monotonic() - started
+                if job.status == job.STATUS_DONE:
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Job {job.pk}: project {job.project_id} v{job.content_version} done in {elapsed:.1f}s'
+                    ))
+                else:
+                    self.stdout.write(self.style.ERROR(f'Job {job.pk}: failed: {job.error}'))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write('Export worker stopped.')
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from projects import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Create synthetic users, projects, branches, expenses and releases for '
+        'run_benchmarks. Use a scratch database: the rows are real.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5)
+        parser.add_argument('--projects', type=int, default=4, help='Projects per user (default: 4).')
+        parser.add_argument('--branches', type=int, default=5, help='Branches per project (default: 5).')
+        parser.add_argument('--subbranches', type=int, default=200000,
+                            help='Expense rows in total (default: 200000).')
+        parser.add_argument('--releases', type=int, default=20000,
+                            help='Release rows in total (default: 20000).')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable data.')
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete earlier benchmark users and their data first.',
+        )
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            removed = benchmarks.clear_benchmark_data()
+            self.stdout.write(f'Removed {removed} benchmark user(s).')
+
+        counts = benchmarks.seed(
+            users=options['users'],
+            projects=options['projects'],
+            branches=options['branches'],
+            subbranches=options['subbranches'],
+            releases=options['releases'],
+            seed=options['seed'],
+            stdout=self.stdout if options['verbosity'] > 1 else None,
+        )
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Created {summary}.'))
@@ -0,0 +1,190 @@
+"""
+Opt-in per-request instrumentation (``CIVITRACK_REQUEST_METRICS``).
+
+For every request ``RequestMetricsMiddleware`` records the wall time, the
+number and total time of SQL queries (through ``connection.execute_wrapper``),
+how many of those repeated an earlier statement of the same request (the
+usual sign of a query in a loop) and the response size, under WSGI and
+ASGI alike. Each record is
+
+* logged as one JSON line on the ``civitrack.requests`` logger,
+* sent back in a ``Server-Timing`` header, which browser dev tools show
+  under the request's timing tab,
+* kept in a bounded in-memory sample per URL name, which the staff-only
+  ``request_stats`` page turns into percentiles. Samples are per process
+  and reset on restart.
+"""
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+logger = logging.getLogger('civitrack.requests')
+
+# Requests kept per URL name for the stats page
+SAMPLES_PER_VIEW = 500
+# Statements listed in the log line when a request repeats queries
+DUPLICATES_LOGGED = 3
+
+
+class QueryRecorder:
+    """``execute_wrapper`` callable counting and timing the queries it sees."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+    def most_repeated(self, limit):
+        return [(sql, count) for sql, count in self.statements.most_common(limit) if count > 1]
+
+
+class MetricsStore:
+    """Recent request records per URL name, shared by the threads of a process."""
+
+    def __init__(self, size=SAMPLES_PER_VIEW):
+        self.size = size
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=self.size))
+
+    def add(self, name, record):
+        with self.lock:
+            self.samples[name].append(record)
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+    def summary(self):
+        """One row per URL name with percentiles and averages, slowest p95 first."""
+        with self.lock:
+            samples = {name: list(records) for name, records in self.samples.items()}
+        rows = []
+        for name, records in samples.items():
+            durations = sorted(record['duration_ms'] for record in records)
+            count = len(records)
+            rows.append({
+                'name': name,
+                'count': count,
+                'p50_ms': _percentile(durations, 50),
+                'p95_ms': _percentile(durations, 95),
+                'p99_ms': _percentile(durations, 99),
+                'max_ms': durations[-1],
+                'queries': sum(record['queries'] for record in records) / count,
+                'max_queries': max(record['queries'] for record in records),
+                'db_ms': sum(record['db_ms'] for record in records) / count,
+                'duplicates': sum(record['duplicate_queries'] for record in records) / count,
+                'bytes': sum(record['bytes'] or 0 for record in records) / count,
+            })
+        rows.sort(key=lambda row: row['p95_ms'], reverse=True)
+        return rows
+
+
+def _percentile(ordered, percent):
+    # Nearest-rank percentile of an already sorted list
+    index = max(0, min(len(ordered) - 1, -(-len(ordered) * percent // 100) - 1))
+    return ordered[index]
+
+
+store = MetricsStore()
+
+
+def _response_size(response):
+    if response.streaming:
+        length = response.get('Content-Length')
+        return int(length) if length and length.isdigit() else None
+    return len(response.content)
+
+
+def _recording(recorder):
+    """An ExitStack holding ``recorder`` around the calling thread's connections."""
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(recorder))
+    return stack
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.CIVITRACK_REQUEST_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        with _recording(recorder):
+            started = time.perf_counter()
+            response = self.get_response(request)
+            duration = time.perf_counter() - started
+        return self.finish(request, response, recorder, duration)
+
+    async def __acall__(self, request):
+        # Database connections belong to a thread, and the async views reach
+        # them through sync_to_async, which runs all of a request's calls in
+        # one thread. The wrapper goes on that thread's connections rather
+        # than the event loop's, or the queries would go unrecorded.
+        recorder = QueryRecorder()
+        stack = await sync_to_async(_recording)(recorder)
+        try:
+            started = time.perf_counter()
+            response = await self.get_response(request)
+            duration = time.perf_counter() - started
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response, recorder, duration)
+
+    def finish(self, request, response, recorder, duration):
+        match = request.resolver_match
+        name = (match.view_name if match else None) or '<unresolved>'
+        record = {
+            'view': name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'queries': recorder.count,
+            'db_ms': round(recorder.duration * 1000, 2),
+            'duplicate_queries': recorder.duplicates,
+            'bytes': _response_size(response),
+        }
+        store.add(name, record)
+
+        logged = dict(record)
+        if recorder.duplicates:
+            logged['repeated'] = [{'sql': sql[:200], 'count': count}
+                                  for sql, count in recorder.most_repeated(DUPLICATES_LOGGED)]
+        logger.info(json.dumps(logged))
+
+        response['Server-Timing'] = (
+            f'app;dur={record["duration_ms"]}, '
+            f'db;dur={record["db_ms"]};desc="{recorder.count} queries, {recorder.duplicates} repeated"'
+        )
+        return response
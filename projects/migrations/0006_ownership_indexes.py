@@ -0,0 +1,55 @@
+# Generated by Django 5.0 on 2026-10-18 07:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+EMAIL_INDEX_NAME = 'projects_user_email_lower_idx'
+
+
+def _user_table(apps, schema_editor):
+    user_model = apps.get_model(settings.AUTH_USER_MODEL)
+    quote = schema_editor.quote_name
+    return quote(user_model._meta.db_table), quote(user_model._meta.get_field('email').column)
+
+
+def create_email_index(apps, schema_editor):
+    # Login looks users up by LOWER(email). The user table belongs to another
+    # app, so the expression index is created here rather than in Meta.indexes.
+    # It is not unique because existing installs may already share addresses.
+    table, column = _user_table(apps, schema_editor)
+    schema_editor.execute(
+        f'CREATE INDEX {schema_editor.quote_name(EMAIL_INDEX_NAME)} ON {table} (LOWER({column}))'
+    )
+
+
+def drop_email_index(apps, schema_editor):
+    schema_editor.execute(f'DROP INDEX {schema_editor.quote_name(EMAIL_INDEX_NAME)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0005_export_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='branch',
+            index=models.Index(fields=['project', '-created_at'], name='projects_br_project_6eecad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['user', 'created_at'], name='projects_pr_user_id_29bec8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='releasedhistory',
+            index=models.Index(fields=['project', '-date'], name='projects_re_project_9bdf69_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subbranch',
+            index=models.Index(fields=['branch', '-date'], name='projects_su_branch__a2c73d_idx'),
+        ),
+        migrations.RunPython(create_email_index, drop_email_index),
+    ]
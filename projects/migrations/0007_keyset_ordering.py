@@ -0,0 +1,51 @@
+# Generated by Django 5.0 on 2026-10-18 07:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0006_ownership_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='project',
+            options={'ordering': ['created_at', 'id']},
+        ),
+        migrations.AlterModelOptions(
+            name='releasedhistory',
+            options={'ordering': ['-date', '-id']},
+        ),
+        migrations.AlterModelOptions(
+            name='subbranch',
+            options={'ordering': ['-date', '-id']},
+        ),
+        migrations.RemoveIndex(
+            model_name='project',
+            name='projects_pr_user_id_29bec8_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='releasedhistory',
+            name='projects_re_project_9bdf69_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='subbranch',
+            name='projects_su_branch__a2c73d_idx',
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='projects_pr_user_id_12508c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='releasedhistory',
+            index=models.Index(fields=['project', '-date', '-id'], name='projects_re_project_eb418e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subbranch',
+            index=models.Index(fields=['branch', '-date', '-id'], name='projects_su_branch__7d60da_idx'),
+        ),
+    ]
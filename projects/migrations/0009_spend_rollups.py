@@ -0,0 +1,45 @@
+# Generated by Django 5.0 on 2026-10-18 07:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_rollups(apps, schema_editor):
+    # Existing entries predate the hooks that maintain the table
+    from projects.rollups import rebuild_timeseries
+
+    rebuild_timeseries(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0008_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpendRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(choices=[('spent', 'Spent'), ('released', 'Released')], max_length=10)),
+                ('period', models.CharField(choices=[('day', 'Day'), ('month', 'Month')], max_length=5)),
+                ('start', models.DateField()),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('branch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='spend_rollups', to='projects.branch')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spend_rollups', to='projects.project')),
+            ],
+            options={
+                'ordering': ['start'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='spendrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('branch__isnull', True)), fields=('project', 'metric', 'period', 'start'), name='spend_rollup_project_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='spendrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('branch__isnull', False)), fields=('branch', 'metric', 'period', 'start'), name='spend_rollup_branch_unique'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
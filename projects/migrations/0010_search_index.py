@@ -0,0 +1,48 @@
+# Generated by Django 5.0 on 2026-10-18 07:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_text_index(apps, schema_editor):
+    from projects import search
+
+    search.create_text_index(schema_editor)
+    search.rebuild_search_index(apps=apps)
+
+
+def drop_text_index(apps, schema_editor):
+    from projects import search
+
+    search.drop_text_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0009_spend_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('project', 'Project'), ('branch', 'Branch'), ('subbranch', 'Expense')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('name', models.CharField(max_length=200)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('date', models.DateField(blank=True, null=True)),
+                ('branch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='projects.branch')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='projects.project')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='searchentry',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='search_entry_unique_object'),
+        ),
+        migrations.RunPython(create_text_index, drop_text_index),
+    ]
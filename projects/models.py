@@ -1,5 +1,56 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from . import changefeed, rollups, search
+
+
+STATE_FIELDS = ('deleted_at', 'archived_at')
+
+
+def _writable_fields(instance, update_fields):
+    # Counter columns are only ever changed with atomic UPDATEs (see
+    # projects.rollups). A plain save() of an existing row writes every other
+    # column, so a stale in-memory copy cannot undo concurrent increments.
+    # The state columns are likewise only set by projects.trash and
+    # projects.archives.
+    if update_fields is not None or instance._state.adding:
+        return update_fields
+    return [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in instance.COUNTER_FIELDS and field.name not in STATE_FIELDS
+    ]
+
+
+class ActiveManager(models.Manager):
+    """Default manager that leaves out soft-deleted rows (see projects.trash)."""
+    active_filter = {'deleted_at__isnull': True}
+    
+    def get_queryset(self):
+        return super().get_queryset().filter(**self.active_filter)
+
+
+class ActiveBranchManager(ActiveManager):
+    # A branch disappears with its project as well
+    active_filter = {'deleted_at__isnull': True, 'project__deleted_at__isnull': True}
+
+
+class SubBranchQuerySet(models.QuerySet):
+    def active(self):
+        """Leave out the entries of soft-deleted branches and projects."""
+        return self.filter(branch__deleted_at__isnull=True, branch__project__deleted_at__isnull=True)
+
+
+class ReleasedHistoryQuerySet(models.QuerySet):
+    def active(self):
+        """Leave out the releases of soft-deleted projects."""
+        return self.filter(project__deleted_at__isnull=True)
+
+
+def _moved_from(previous, parent_field, parent_id):
+    # The former parent of a row that was just moved, else None
+    if previous is None or previous[parent_field] == parent_id:
+        return None
+    return previous[parent_field]
+
 
 class Project(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='projects')
@@ -7,13 +58,55 @@ class Project(models.Model):
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     start_date = models.DateField()
     total_released = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    content_version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the project is deleted; purge_deleted removes it later
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # Set while the project's entries and releases are in cold storage
+    # (see projects.archives); the project is read-only meanwhile
+    archived_at = models.DateTimeField(null=True, blank=True)
+    
+    objects = ActiveManager()
+    all_objects = models.Manager()
+    
+    COUNTER_FIELDS = ('total_released', 'content_version')
     
     class Meta:
-        ordering = ['created_at']
+        ordering = ['created_at', 'id']
+        indexes = [
+            # request.user.projects.all() in created_at order; the id makes
+            # the order total, as keyset pagination needs
+            models.Index(fields=['user', 'created_at', 'id']),
+            # purge_deleted's scan; live rows are left out of the index
+            models.Index(fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False),
+                         name='project_deleted_at_idx'),
+        ]
     
     def __str__(self):
         return self.name
+    
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        kwargs['update_fields'] = _writable_fields(self, kwargs.get('update_fields'))
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if not adding:
+                rollups.bump_project_version(self.pk)
+            changefeed.record_changes(
+                [(changefeed.KIND_PROJECT, changefeed.ACTION_UPSERT, self.pk)],
+                project_id=self.pk, user_id=self.user_id,
+            )
+            search.index_project(self)
+    
+    def delete(self, *args, **kwargs):
+        pk, user_id = self.pk, self.user_id
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            changefeed.record_changes(
+                [(changefeed.KIND_PROJECT, changefeed.ACTION_DELETE, pk)],
+                project_id=pk, user_id=user_id,
+            )
+        return result
 
 
 class Branch(models.Model):
@@ -21,16 +114,49 @@ class Branch(models.Model):
     name = models.CharField(max_length=200)
     total_spent = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    
+    objects = ActiveBranchManager()
+    all_objects = models.Manager()
+    
+    COUNTER_FIELDS = ('total_spent',)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['project', '-created_at']),
+            models.Index(fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False),
+                         name='branch_deleted_at_idx'),
+        ]
     
     def __str__(self):
         return f"{self.project.name} - {self.name}"
     
+    def save(self, *args, **kwargs):
+        kwargs['update_fields'] = _writable_fields(self, kwargs.get('update_fields'))
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            rollups.bump_project_version(self.project_id)
+            changefeed.record_changes(
+                [(changefeed.KIND_BRANCH, changefeed.ACTION_UPSERT, self.pk)],
+                project_id=self.project_id,
+            )
+            search.index_branch(self)
+    
+    def delete(self, *args, **kwargs):
+        pk, project_id = self.pk, self.project_id
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            rollups.bump_project_version(project_id)
+            changefeed.record_changes(
+                [(changefeed.KIND_BRANCH, changefeed.ACTION_DELETE, pk)],
+                project_id=project_id,
+            )
+        return result
+    
     def recalculate_total_spent(self):
-        self.total_spent = sum(sb.amount for sb in self.subbranches.all())
-        self.save()
+        rollups.reconcile_branch_totals(Branch.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=['total_spent'])
 
 
 class SubBranch(models.Model):
@@ -40,20 +166,64 @@ class SubBranch(models.Model):
     date = models.DateField()
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = SubBranchQuerySet.as_manager()
+    
     class Meta:
-        ordering = ['-date']
+        ordering = ['-date', '-id']
+        indexes = [
+            # A branch's entries newest first, without a sort step
+            models.Index(fields=['branch', '-date', '-id']),
+        ]
     
     def __str__(self):
         return f"{self.branch.name} - {self.name}"
     
+    def _locked_previous(self):
+        # The row as currently stored, locked until the surrounding
+        # transaction commits so concurrent edits apply their deltas in turn.
+        if self.pk is None:
+            return None
+        return (SubBranch.objects.select_for_update()
+                .filter(pk=self.pk)
+                .values('branch_id', 'amount', 'date')
+                .first())
+    
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.branch.recalculate_total_spent()
+        with transaction.atomic():
+            previous = self._locked_previous()
+            super().save(*args, **kwargs)
+            rollups.subbranch_saved(previous, self.branch_id, self.amount, self.date)
+            rollups.bump_branch_project_version(
+                self.branch_id, previous and previous['branch_id'],
+            )
+            # Both branches' totals changed if the entry moved
+            changefeed.record_changes(
+                [
+                    (changefeed.KIND_SUBBRANCH, changefeed.ACTION_UPSERT, self.pk),
+                    (changefeed.KIND_BRANCH, changefeed.ACTION_UPSERT, self.branch_id),
+                    (changefeed.KIND_BRANCH, changefeed.ACTION_UPSERT, _moved_from(previous, 'branch_id', self.branch_id)),
+                ],
+                branch_id=self.branch_id,
+            )
+            search.index_subbranch(self)
     
     def delete(self, *args, **kwargs):
-        branch = self.branch
-        super().delete(*args, **kwargs)
-        branch.recalculate_total_spent()
+        pk = self.pk
+        with transaction.atomic():
+            previous = self._locked_previous()
+            result = super().delete(*args, **kwargs)
+            if previous is not None:
+                rollups.subbranch_deleted(previous)
+                rollups.bump_branch_project_version(previous['branch_id'])
+                changefeed.record_changes(
+                    [
+                        (changefeed.KIND_SUBBRANCH, changefeed.ACTION_DELETE, pk),
+                        (changefeed.KIND_BRANCH, changefeed.ACTION_UPSERT, previous['branch_id']),
+                    ],
+                    branch_id=previous['branch_id'],
+                )
+                search.unindex_subbranch(pk)
+        return result
 
 
 class ReleasedHistory(models.Model):
@@ -62,21 +232,203 @@ class ReleasedHistory(models.Model):
     date = models.DateField()
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = ReleasedHistoryQuerySet.as_manager()
+    
     class Meta:
-        ordering = ['-date']
+        ordering = ['-date', '-id']
+        indexes = [
+            models.Index(fields=['project', '-date', '-id']),
+        ]
     
     def __str__(self):
         return f"{self.project.name} - ₹{self.amount}"
     
+    def _locked_previous(self):
+        # Same locking read as SubBranch._locked_previous.
+        if self.pk is None:
+            return None
+        return (ReleasedHistory.objects.select_for_update()
+                .filter(pk=self.pk)
+                .values('project_id', 'amount', 'date')
+                .first())
+    
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        # Update project's total_released
-        self.project.total_released = sum(rh.amount for rh in self.project.released_history.all())
-        self.project.save()
+        with transaction.atomic():
+            previous = self._locked_previous()
+            super().save(*args, **kwargs)
+            # Update project's total_released
+            rollups.release_saved(previous, self.project_id, self.amount, self.date)
+            rollups.bump_project_version(self.project_id)
+            if previous and previous['project_id'] != self.project_id:
+                rollups.bump_project_version(previous['project_id'])
+            changefeed.record_changes(
+                [
+                    (changefeed.KIND_RELEASE, changefeed.ACTION_UPSERT, self.pk),
+                    (changefeed.KIND_PROJECT, changefeed.ACTION_UPSERT, self.project_id),
+                    (changefeed.KIND_PROJECT, changefeed.ACTION_UPSERT, _moved_from(previous, 'project_id', self.project_id)),
+                ],
+                project_id=self.project_id,
+            )
     
     def delete(self, *args, **kwargs):
-        project = self.project
-        super().delete(*args, **kwargs)
-        # Update project's total_released after deletion
-        project.total_released = sum(rh.amount for rh in project.released_history.all())
-        project.save()
+        pk = self.pk
+        with transaction.atomic():
+            previous = self._locked_previous()
+            result = super().delete(*args, **kwargs)
+            # Update project's total_released after deletion
+            if previous is not None:
+                rollups.release_deleted(previous)
+                rollups.bump_project_version(previous['project_id'])
+                changefeed.record_changes(
+                    [
+                        (changefeed.KIND_RELEASE, changefeed.ACTION_DELETE, pk),
+                        (changefeed.KIND_PROJECT, changefeed.ACTION_UPSERT, previous['project_id']),
+                    ],
+                    project_id=previous['project_id'],
+                )
+        return result
+
+
+class ExportJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='export_jobs')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    content_version = models.PositiveIntegerField()
+    # Path of the generated PDF relative to MEDIA_ROOT
+    file = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.project.name} - v{self.content_version} ({self.status})"
+
+
+class ChangeLog(models.Model):
+    """One insert, edit or delete of a synced object (see projects.changefeed)."""
+    KIND_CHOICES = [
+        (changefeed.KIND_PROJECT, 'Project'),
+        (changefeed.KIND_BRANCH, 'Branch'),
+        (changefeed.KIND_SUBBRANCH, 'Sub-branch'),
+        (changefeed.KIND_RELEASE, 'Release'),
+    ]
+    ACTION_CHOICES = [
+        (changefeed.ACTION_UPSERT, 'Upsert'),
+        (changefeed.ACTION_DELETE, 'Delete'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='change_log')
+    # Plain ids: entries outlive the objects they describe
+    project_id = models.BigIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # The sync feed: one user's entries after a cursor
+            models.Index(fields=['user', 'id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.action} {self.kind} {self.object_id}"
+
+
+class SpendRollup(models.Model):
+    """
+    Total spent or released per day and per month (see projects.rollups).
+
+    Rows with a branch hold that branch's spending; rows without one hold the
+    whole project's, so project charts never have to add up branches.
+    """
+    METRIC_SPENT = 'spent'
+    METRIC_RELEASED = 'released'
+    METRIC_CHOICES = [
+        (METRIC_SPENT, 'Spent'),
+        (METRIC_RELEASED, 'Released'),
+    ]
+    PERIOD_DAY = 'day'
+    PERIOD_MONTH = 'month'
+    PERIOD_CHOICES = [
+        (PERIOD_DAY, 'Day'),
+        (PERIOD_MONTH, 'Month'),
+    ]
+    
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='spend_rollups')
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, null=True, blank=True, related_name='spend_rollups')
+    metric = models.CharField(max_length=10, choices=METRIC_CHOICES)
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    # First day of the day or month the row covers
+    start = models.DateField()
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        ordering = ['start']
+        constraints = [
+            # Also the indexes behind the chart range queries
+            models.UniqueConstraint(
+                fields=['project', 'metric', 'period', 'start'],
+                condition=models.Q(branch__isnull=True),
+                name='spend_rollup_project_unique',
+            ),
+            models.UniqueConstraint(
+                fields=['branch', 'metric', 'period', 'start'],
+                condition=models.Q(branch__isnull=False),
+                name='spend_rollup_branch_unique',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.metric} {self.period} {self.start}: {self.amount}"
+
+
+class SearchEntry(models.Model):
+    """
+    The searchable text of one project, branch or expense (see projects.search).
+
+    On SQLite the FTS5 index is kept in sync by triggers on this table, which
+    a migration that rebuilds the table must create again.
+    """
+    KIND_CHOICES = [
+        (changefeed.KIND_PROJECT, 'Project'),
+        (changefeed.KIND_BRANCH, 'Branch'),
+        (changefeed.KIND_SUBBRANCH, 'Expense'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_entries')
+    # Entries go with the project or branch they belong to
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='search_entries')
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, null=True, blank=True, related_name='search_entries')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    name = models.CharField(max_length=200)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    date = models.DateField(null=True, blank=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='search_entry_unique_object'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} {self.object_id}: {self.name}"
@@ -0,0 +1,163 @@
+"""
+Keyset (seek) pagination for the list pages.
+
+A page is requested with the sort key of the last row already shown
+(``?after=<cursor>``) instead of an OFFSET, and the next rows are found with a
+``WHERE (date, id) < (last date, last id)`` condition on the same index that
+provides the ordering. Every page therefore costs the same, however deep into
+the history it is.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+MAX_PAGE_SIZE = 200
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor, page_size, is_first):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.page_size = page_size
+        self.is_first = is_first
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def page_size_from(request, default=None, maximum=MAX_PAGE_SIZE):
+    """The ``page_size`` query parameter, clamped to 1..maximum."""
+    if default is None:
+        default = settings.CIVITRACK_PAGE_SIZE
+    try:
+        size = int(request.GET.get('page_size', default))
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maximum))
+
+
+def encode_cursor(values):
+    raw = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, fields):
+    """Decode a cursor into Python values for ``fields``; None if it is not valid."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(raw, list) or len(raw) != len(fields):
+            return None
+        return [field.to_python(value) for field, value in zip(fields, raw)]
+    except (ValueError, TypeError, ValidationError):
+        return None
+
+
+def _after(names, descending, values):
+    # (a, b) after (x, y) in the given directions:
+    #   a >= x  AND  (a > x  OR  (a = x AND b > y))   with < for descending keys
+    # The redundant leading bound lets the database start a range scan on the
+    # index at the cursor instead of walking every row before it.
+    condition = Q()
+    for i, name in enumerate(names):
+        lookup = 'lt' if descending[i] else 'gt'
+        term = Q(**{f'{name}__{lookup}': values[i]})
+        for prev in range(i):
+            term &= Q(**{names[prev]: values[prev]})
+        condition |= term
+    bound = 'lte' if descending[0] else 'gte'
+    return Q(**{f'{names[0]}__{bound}': values[0]}) & condition
+
+
+def _seek(queryset, ordering, cursor):
+    # The ordered queryset positioned after ``cursor``, the ordering's model
+    # fields and the decoded cursor values (None on the first page)
+    names = [key.lstrip('-') for key in ordering]
+    descending = [key.startswith('-') for key in ordering]
+    try:
+        fields = [queryset.model._meta.get_field(name) for name in names]
+    except FieldDoesNotExist:
+        raise ValueError(f'Keyset ordering must use model fields: {ordering}')
+
+    values = decode_cursor(cursor, fields)
+    queryset = queryset.order_by(*ordering)
+    if values is not None:
+        queryset = queryset.filter(_after(names, descending, values))
+    return queryset, fields, values
+
+
+def _page(items, fields, values, page_size):
+    # One extra row was fetched to tell whether there is a next page
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, field.attname) for field in fields])
+    return KeysetPage(items, next_cursor, page_size, is_first=values is None)
+
+
+def paginate(queryset, ordering, cursor=None, page_size=None):
+    """
+    Return the ``KeysetPage`` of ``queryset`` that follows ``cursor``.
+
+    ``ordering`` must identify rows uniquely, e.g. ``('-date', '-id')``, and
+    should match an index. An invalid or missing cursor gives the first page.
+    """
+    if page_size is None:
+        page_size = settings.CIVITRACK_PAGE_SIZE
+    queryset, fields, values = _seek(queryset, ordering, cursor)
+    return _page(list(queryset[:page_size + 1]), fields, values, page_size)
+
+
+async def apaginate(queryset, ordering, cursor=None, page_size=None):
+    """``paginate`` for async views, reading the page with the async ORM."""
+    if page_size is None:
+        page_size = settings.CIVITRACK_PAGE_SIZE
+    queryset, fields, values = _seek(queryset, ordering, cursor)
+    return _page([item async for item in queryset[:page_size + 1]], fields, values, page_size)
+
+
+def _follows(key, values, descending):
+    # Python counterpart of _after for one row's sort key
+    for value, bound, desc in zip(key, values, descending):
+        if value != bound:
+            return value < bound if desc else value > bound
+    return False
+
+
+def paginate_rows(rows, model, ordering, cursor=None, page_size=None):
+    """
+    ``paginate`` for rows that are not in the database (e.g. an archive).
+
+    ``rows`` must be an iterable of ``model`` instances already sorted by
+    ``ordering``; it is read up to the end of the requested page. Cursors are
+    the same as ``paginate``'s.
+    """
+    if page_size is None:
+        page_size = settings.CIVITRACK_PAGE_SIZE
+    names = [key.lstrip('-') for key in ordering]
+    descending = [key.startswith('-') for key in ordering]
+    fields = [model._meta.get_field(name) for name in names]
+    values = decode_cursor(cursor, fields)
+
+    items = []
+    for row in rows:
+        if values is not None and not _follows([getattr(row, field.attname) for field in fields], values, descending):
+            continue
+        items.append(row)
+        if len(items) > page_size:
+            break
+    return _page(items, fields, values, page_size)
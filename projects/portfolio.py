@@ -0,0 +1,125 @@
+"""
+The portfolio overview: budget, released, spent, remaining and utilisation
+for every project of a user.
+
+All of it comes from one grouped query over the projects and their branches'
+stored totals, with sorting and filtering applied to the computed columns by
+the database. Results can be cached per user under a stamp of the user's
+projects (count, newest id and the sum of their ``content_version``), which
+changes whenever a project is added, deleted or modified.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, DecimalField, F, FloatField, Max, Q, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from .rollups import ZERO
+
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+# Soft-deleted branches are joined too; keep their totals out
+ACTIVE_BRANCHES = Q(branches__deleted_at__isnull=True)
+
+PORTFOLIO_COLUMNS = ('id', 'name', 'start_date', 'amount', 'total_released', 'spent', 'remaining', 'unspent', 'utilisation')
+
+SORT_FIELDS = {
+    'name': 'name',
+    'start_date': 'start_date',
+    'budget': 'amount',
+    'released': 'total_released',
+    'spent': 'spent',
+    'remaining': 'remaining',
+    'unspent': 'unspent',
+    'utilisation': 'utilisation',
+}
+DEFAULT_SORT = '-utilisation'
+
+STATUS_FILTERS = {
+    # Spent more than the whole budget
+    'over_budget': Q(spent__gt=F('amount')),
+    # Spent more than has been released so far
+    'overspent': Q(spent__gt=F('total_released')),
+    # Budget not yet fully released
+    'pending_release': Q(remaining__gt=0),
+}
+
+
+def portfolio_queryset(user):
+    """The user's projects annotated with the computed portfolio columns."""
+    return (
+        user.projects.order_by()
+        .annotate(spent=Coalesce(Sum('branches__total_spent', filter=ACTIVE_BRANCHES), Value(ZERO), output_field=MONEY))
+        .annotate(
+            remaining=F('amount') - F('total_released'),
+            unspent=F('total_released') - F('spent'),
+            utilisation=Case(
+                When(amount__gt=0, then=Cast('spent', FloatField()) * 100.0 / Cast('amount', FloatField())),
+                default=None,
+                output_field=FloatField(),
+            ),
+        )
+    )
+
+
+def filter_portfolio(queryset, q='', min_utilisation=None, max_utilisation=None, status=''):
+    if q:
+        queryset = queryset.filter(name__icontains=q)
+    if min_utilisation is not None:
+        queryset = queryset.filter(utilisation__gte=min_utilisation)
+    if max_utilisation is not None:
+        queryset = queryset.filter(utilisation__lte=max_utilisation)
+    if status:
+        queryset = queryset.filter(STATUS_FILTERS[status])
+    return queryset
+
+
+def sort_portfolio(queryset, sort):
+    name = SORT_FIELDS.get(sort.lstrip('-'), SORT_FIELDS[DEFAULT_SORT.lstrip('-')])
+    if sort.startswith('-'):
+        key = F(name).desc(nulls_last=True)
+    else:
+        key = F(name).asc(nulls_last=True)
+    return queryset.order_by(key, 'id')
+
+
+def _totals(rows):
+    totals = {name: sum((row[name] for row in rows), ZERO)
+              for name in ('amount', 'total_released', 'spent', 'remaining', 'unspent')}
+    totals['utilisation'] = float(totals['spent'] * 100 / totals['amount']) if totals['amount'] else None
+    totals['count'] = len(rows)
+    return totals
+
+
+def _stamp(user):
+    # Cheap to read (user's projects only, no join) and changes with any
+    # write that could change the portfolio
+    stamp = user.projects.order_by().aggregate(
+        count=Count('id'), newest=Max('id'), versions=Sum('content_version'),
+    )
+    return f"{stamp['count']}:{stamp['newest']}:{stamp['versions']}"
+
+
+def get_portfolio(user, sort=DEFAULT_SORT, **filters):
+    """
+    Return ``(rows, totals)`` for the user's portfolio.
+
+    ``rows`` are dicts of ``PORTFOLIO_COLUMNS`` in the requested order;
+    ``totals`` adds up the filtered rows.
+    """
+    key = None
+    if settings.CIVITRACK_CACHE_PORTFOLIO:
+        params = '|'.join(f'{name}={filters[name]}' for name in sorted(filters))
+        digest = hashlib.md5(f'{sort}|{params}'.encode(), usedforsecurity=False).hexdigest()
+        key = f'portfolio:{user.pk}:{_stamp(user)}:{digest}'
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    queryset = sort_portfolio(filter_portfolio(portfolio_queryset(user), **filters), sort)
+    rows = list(queryset.values(*PORTFOLIO_COLUMNS))
+    result = (rows, _totals(rows))
+    if key is not None:
+        cache.set(key, result, settings.CIVITRACK_SUMMARY_CACHE_TIMEOUT)
+    return result
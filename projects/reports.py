@@ -0,0 +1,247 @@
+"""
+PDF export of a project.
+
+The report is produced as a stream of reportlab flowables: sub-branch and
+release rows are read from the database with ``.iterator()`` and turned into
+page-sized tables as the document is laid out, so neither the model instances
+nor one giant ``Table`` per branch are ever held in memory at once.
+"""
+from datetime import datetime
+from itertools import groupby
+from operator import attrgetter
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
+from . import archives
+from .snapshots import project_subbranch_stream, release_queryset
+
+
+# Rows fetched from the database per round trip
+PDF_FETCH_CHUNK_SIZE = 2000
+# Rows per table; roughly one A4 page, so reportlab never has to split a
+# long table (which re-measures every remaining row on each page).
+PDF_TABLE_ROWS = 35
+
+EXPENSE_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#DDD6FE')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+    ('ALIGN', (2, 0), (2, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ('TOPPADDING', (0, 0), (-1, -1), 6),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#F8FAFC')]),
+])
+
+RELEASE_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#D1FAE5')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+    ('TOPPADDING', (0, 0), (-1, -1), 8),
+    ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#F0FDF4')]),
+])
+
+SUMMARY_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#E0E7FF')),
+    ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+    ('TOPPADDING', (0, 0), (-1, -1), 8),
+    ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+])
+
+
+class FlowableStream(list):
+    """
+    List facade over a flowable generator for ``doc.build``.
+
+    reportlab consumes the story from the front (``len``, ``[0]``, ``del [0]``
+    and re-inserting split parts), so only a small look-ahead buffer needs to
+    exist; it is topped up from the generator whenever the length is asked for.
+    """
+
+    def __init__(self, flowables, lookahead=8):
+        super().__init__()
+        self._source = iter(flowables)
+        self._lookahead = lookahead
+
+    def _fill(self):
+        while self._source is not None and list.__len__(self) < self._lookahead:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._source = None
+
+    def __len__(self):
+        self._fill()
+        return list.__len__(self)
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _styles():
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=18,
+        textColor=colors.HexColor('#1E40AF'),
+        spaceAfter=12,
+        fontName='Helvetica-Bold'
+    )
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontSize=12,
+        textColor=colors.HexColor('#1E3A8A'),
+        spaceAfter=8,
+        spaceBefore=8,
+        fontName='Helvetica-Bold'
+    )
+    return title_style, heading_style, styles['Normal']
+
+
+def _expense_tables(subbranches):
+    for chunk in _chunks(subbranches, PDF_TABLE_ROWS):
+        data = [['Expense Name', 'Amount', 'Date']]
+        for subbranch in chunk:
+            data.append([
+                subbranch.name,
+                f"Rs. {subbranch.amount:,.2f}",
+                str(subbranch.date)
+            ])
+        table = Table(data, colWidths=[2.5*inch, 1.2*inch, 1.3*inch])
+        table.setStyle(EXPENSE_TABLE_STYLE)
+        yield table
+
+
+def _release_tables(releases):
+    for chunk in _chunks(releases, PDF_TABLE_ROWS):
+        data = [['Amount', 'Date']]
+        for release in chunk:
+            data.append([
+                f"Rs. {release.amount:,.2f}",
+                str(release.date)
+            ])
+        table = Table(data, colWidths=[1.5*inch, 1.5*inch])
+        table.setStyle(RELEASE_TABLE_STYLE)
+        yield table
+
+
+def project_story(project, chunk_size=PDF_FETCH_CHUNK_SIZE):
+    """
+    Yield the flowables of a project report one at a time.
+
+    ``project`` should come from ``load_project_snapshot(..., branches=True)``;
+    all sub-branches are then read with one streamed query, whatever the
+    number of branches. An archived project's entries and releases are
+    streamed from its archive file instead.
+    """
+    title_style, heading_style, normal_style = _styles()
+
+    # Project Header
+    yield Paragraph(f"CiviTrack - {project.name}", title_style)
+    yield Spacer(1, 0.2 * inch)
+
+    # Summary Section
+    yield Paragraph("Project Summary", heading_style)
+
+    branches = list(project.branches.all())
+    total_spent = sum(b.total_spent for b in branches)
+    remaining = project.amount - project.total_released
+
+    summary_data = [
+        ['Total Budget', f"Rs. {project.amount:,.2f}"],
+        ['Total Released', f"Rs. {project.total_released:,.2f}"],
+        ['Total Spent', f"Rs. {total_spent:,.2f}"],
+        ['Remaining Balance', f"Rs. {remaining:,.2f}"],
+        ['Start Date', str(project.start_date)],
+    ]
+    summary_table = Table(summary_data, colWidths=[3*inch, 1.5*inch])
+    summary_table.setStyle(SUMMARY_TABLE_STYLE)
+    yield summary_table
+    yield Spacer(1, 0.3 * inch)
+
+    # Branches & Expenses Section
+    yield Paragraph("Branches & Expenses", heading_style)
+
+    if branches:
+        # Sub-branch rows arrive grouped by branch in the same order as
+        # ``branches``; branches without entries have no group.
+        if project.archived_at:
+            subbranches = archives.subbranches(project, {branch.id for branch in branches})
+        else:
+            subbranches = project_subbranch_stream(project, chunk_size)
+        groups = groupby(subbranches, key=attrgetter('branch_id'))
+        group = next(groups, None)
+
+        for branch in branches:
+            yield Paragraph(f"<b>{branch.name}</b> | Total Spent: Rs. {branch.total_spent:,.2f}", normal_style)
+
+            has_expenses = False
+            if group is not None and group[0] == branch.id:
+                for table in _expense_tables(group[1]):
+                    has_expenses = True
+                    yield table
+                group = next(groups, None)
+            if not has_expenses:
+                yield Paragraph("<i>No expenses recorded</i>", normal_style)
+
+            yield Spacer(1, 0.15 * inch)
+
+        yield Spacer(1, 0.2 * inch)
+
+    # Released History Section
+    yield Paragraph("Fund Release History", heading_style)
+
+    if project.archived_at:
+        releases = archives.releases(project)
+    else:
+        releases = release_queryset().filter(project=project).iterator(chunk_size=chunk_size)
+    has_releases = False
+    for table in _release_tables(releases):
+        has_releases = True
+        yield table
+    if not has_releases:
+        yield Paragraph("<i>No fund releases recorded</i>", normal_style)
+
+    yield Spacer(1, 0.3 * inch)
+
+    # Footer. The file is cached and served again until the project changes
+    # (projects.exports), so it names when it was rendered, not who
+    # downloaded it when; the download's filename carries that day.
+    footer_text = f"<i>Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</i>"
+    yield Paragraph(footer_text, normal_style)
+
+
+def build_project_pdf(project, fileobj, chunk_size=PDF_FETCH_CHUNK_SIZE):
+    """Render the report for ``project`` into the binary file object ``fileobj``."""
+    doc = SimpleDocTemplate(fileobj, pagesize=A4)
+    doc.build(FlowableStream(project_story(project, chunk_size)))
+
+
+def export_filename(project):
+    return f'CiviTrack_{project.name}_{datetime.now().strftime("%Y%m%d")}.pdf'
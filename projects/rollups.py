@@ -0,0 +1,447 @@
+"""
+Incremental maintenance of the denormalised totals on Branch and Project.
+
+Every SubBranch write adjusts ``Branch.total_spent`` and every ReleasedHistory
+write adjusts ``Project.total_released`` by the difference between the old and
+the new row, using a single ``UPDATE ... SET total = total + delta``. An insert,
+edit or delete therefore costs the same number of queries no matter how many
+rows the parent already holds, and concurrent writers cannot lose each other's
+updates. ``reconcile_branch_totals`` and ``reconcile_project_totals`` recompute
+the stored values from the rows themselves and back the ``reconcile_totals``
+management command.
+
+The same hooks keep ``SpendRollup`` up to date: per-day and per-month totals
+of spending (per branch and per project) and of releases (per project), which
+the analytics page reads instead of the entries themselves.
+``rebuild_timeseries`` recomputes them from scratch. A soft-deleted branch's
+spending is taken off its project's rows until it is restored or purged.
+
+``Project.content_version`` is maintained the same way: any write that changes
+what a project's pages or report show increments it, which lets exported
+artifacts and page summaries be cached per version. Corrections made by the
+reconcile functions bump it as well.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.apps import apps as global_apps
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+ZERO = Decimal('0.00')
+# Rows moved by one UPDATE in _add_to_rollups
+ROLLUP_UPDATE_CHUNK = 500
+
+
+def as_decimal(value):
+    if value is None:
+        return ZERO
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def _adjust(model, pk, field, delta):
+    delta = as_decimal(delta)
+    if not delta:
+        return
+    # Counters move whether or not the row is soft-deleted
+    model.all_objects.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def _apply_change(adjust, previous, parent_field, parent_id, amount):
+    amount = as_decimal(amount)
+    if previous is None:
+        adjust(parent_id, amount)
+        return
+
+    old_parent_id = previous[parent_field]
+    old_amount = as_decimal(previous['amount'])
+    if old_parent_id == parent_id:
+        adjust(parent_id, amount - old_amount)
+        return
+
+    # The row moved to another parent: take it off the old one and add it
+    # to the new one, always touching the lower id first so two concurrent
+    # moves in opposite directions cannot deadlock.
+    deltas = {old_parent_id: -old_amount, parent_id: amount}
+    for target_id in sorted(deltas):
+        adjust(target_id, deltas[target_id])
+
+
+def _totals(queryset, stored_field, child_amount):
+    # One grouped aggregate query; parents without children report zero.
+    rows = (
+        queryset.order_by()
+        .annotate(actual=Coalesce(
+            Sum(child_amount),
+            Value(ZERO),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ))
+        .values_list('pk', stored_field, 'actual')
+    )
+    for pk, stored, actual in rows.iterator(chunk_size=2000):
+        yield pk, as_decimal(stored).quantize(ZERO), as_decimal(actual).quantize(ZERO)
+
+
+def _reconcile(model, rows, stored_field, fix):
+    mismatches = [(pk, stored, actual) for pk, stored, actual in rows if stored != actual]
+    if fix and mismatches:
+        model.all_objects.bulk_update(
+            [model(pk=pk, **{stored_field: actual}) for pk, _, actual in mismatches],
+            [stored_field],
+            batch_size=500,
+        )
+    return mismatches
+
+
+# ═══════════════════════════════════════════════════════════
+# Branch.total_spent
+# ═══════════════════════════════════════════════════════════
+def adjust_branch_spent(branch_id, delta):
+    """Atomically add ``delta`` to one branch's total_spent."""
+    from .models import Branch
+
+    _adjust(Branch, branch_id, 'total_spent', delta)
+
+
+def subbranch_saved(previous, branch_id, amount, day):
+    """
+    Apply the rollups for a SubBranch that was just written.
+
+    ``previous`` is the row as it was before the save (a dict with
+    ``branch_id``, ``amount`` and ``date``) or ``None`` for an insert.
+    """
+    _apply_change(adjust_branch_spent, previous, 'branch_id', branch_id, amount)
+    adjust_spending(_dated_deltas(previous, 'branch_id', branch_id, amount, day))
+
+
+def subbranch_deleted(previous):
+    """Apply the rollups for a SubBranch row that was just deleted."""
+    adjust_branch_spent(previous['branch_id'], -as_decimal(previous['amount']))
+    adjust_spending({(previous['branch_id'], as_date(previous['date'])): -as_decimal(previous['amount'])})
+
+
+def branch_spent_totals(queryset=None):
+    """Yield ``(branch_id, stored_total, actual_total)`` for every branch."""
+    from .models import Branch
+
+    if queryset is None:
+        queryset = Branch.all_objects.all()
+    # An archived project's entries are not in the table (see projects.archives)
+    queryset = queryset.filter(project__archived_at__isnull=True)
+    return _totals(queryset, 'total_spent', 'subbranches__amount')
+
+
+def reconcile_branch_totals(queryset=None, fix=True):
+    """
+    Compare every branch's stored total_spent with the sum of its entries.
+
+    Returns the list of ``(branch_id, stored_total, actual_total)`` that did
+    not match. With ``fix`` the mismatched rows are corrected in place.
+    """
+    from .models import Branch
+
+    mismatches = _reconcile(Branch, branch_spent_totals(queryset), 'total_spent', fix)
+    if fix:
+        bump_branch_project_version(*(pk for pk, _, _ in mismatches))
+    return mismatches
+
+
+# ═══════════════════════════════════════════════════════════
+# Project.total_released
+# ═══════════════════════════════════════════════════════════
+def adjust_project_released(project_id, delta):
+    """Atomically add ``delta`` to one project's total_released."""
+    from .models import Project
+
+    _adjust(Project, project_id, 'total_released', delta)
+
+
+def release_saved(previous, project_id, amount, day):
+    """
+    Apply the rollups for a ReleasedHistory row that was just written.
+
+    ``previous`` is the row as it was before the save (a dict with
+    ``project_id``, ``amount`` and ``date``) or ``None`` for an insert.
+    """
+    _apply_change(adjust_project_released, previous, 'project_id', project_id, amount)
+    adjust_releases(_dated_deltas(previous, 'project_id', project_id, amount, day))
+
+
+def release_deleted(previous):
+    """Apply the rollups for a ReleasedHistory row that was just deleted."""
+    adjust_project_released(previous['project_id'], -as_decimal(previous['amount']))
+    adjust_releases({(previous['project_id'], as_date(previous['date'])): -as_decimal(previous['amount'])})
+
+
+def project_released_totals(queryset=None):
+    """Yield ``(project_id, stored_total, actual_total)`` for every project."""
+    from .models import Project
+
+    if queryset is None:
+        queryset = Project.all_objects.all()
+    queryset = queryset.filter(archived_at__isnull=True)
+    return _totals(queryset, 'total_released', 'released_history__amount')
+
+
+def reconcile_project_totals(queryset=None, fix=True):
+    """Like ``reconcile_branch_totals`` for ``Project.total_released``."""
+    from .models import Project
+
+    mismatches = _reconcile(Project, project_released_totals(queryset), 'total_released', fix)
+    if fix:
+        bump_project_version(*(pk for pk, _, _ in mismatches))
+    return mismatches
+
+
+# ═══════════════════════════════════════════════════════════
+# SpendRollup (daily and monthly totals)
+# ═══════════════════════════════════════════════════════════
+def as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    return value
+
+
+def _dated_deltas(previous, parent_field, parent_id, amount, day):
+    # {(parent id, day): delta} for a row written over ``previous``; an edit
+    # that changes neither amount, date nor parent cancels out to nothing.
+    deltas = defaultdict(Decimal)
+    if previous is not None:
+        deltas[previous[parent_field], as_date(previous['date'])] -= as_decimal(previous['amount'])
+    deltas[parent_id, as_date(day)] += as_decimal(amount)
+    return deltas
+
+
+def _rollup_keys(project_id, branch_id, day):
+    # Every (project, branch, period, start) row one dated amount counts
+    # towards: the project's day and month, and the branch's if it has one.
+    from .models import SpendRollup
+
+    for period, start in ((SpendRollup.PERIOD_DAY, day), (SpendRollup.PERIOD_MONTH, day.replace(day=1))):
+        yield project_id, None, period, start
+        if branch_id is not None:
+            yield project_id, branch_id, period, start
+
+
+def _add_to_rollup_row(metric, key, delta):
+    # One row on its own: an atomic UPDATE, or a create when the row is
+    # missing, retried as an update if a concurrent insert got there first
+    from .models import SpendRollup
+
+    project_id, branch_id, period, start = key
+    rows = SpendRollup.objects.filter(
+        project_id=project_id, branch_id=branch_id, metric=metric, period=period, start=start,
+    )
+    if rows.update(amount=F('amount') + delta):
+        return
+    try:
+        with transaction.atomic():
+            SpendRollup.objects.create(
+                project_id=project_id, branch_id=branch_id, metric=metric,
+                period=period, start=start, amount=delta,
+            )
+    except IntegrityError:
+        rows.update(amount=F('amount') + delta)
+
+
+def _add_to_rollups(metric, deltas):
+    """
+    Add ``{(project_id, branch_id, day): delta}`` to the SpendRollup rows.
+
+    However many rows are touched, the existing ones are read and locked in
+    one query (in id order, so concurrent writers cannot deadlock), moved by
+    one ``UPDATE ... amount + CASE ...`` per ``ROLLUP_UPDATE_CHUNK`` rows, and
+    the missing ones are inserted with one ``bulk_create``. Should a
+    concurrent writer insert one of those first, the unique constraints
+    reject the insert and the missing rows are applied one at a time instead.
+    """
+    from .models import SpendRollup
+
+    combined = defaultdict(Decimal)
+    for (project_id, branch_id, day), delta in deltas.items():
+        for key in _rollup_keys(project_id, branch_id, as_date(day)):
+            combined[key] += as_decimal(delta)
+    combined = {key: delta for key, delta in combined.items() if delta}
+    if not combined:
+        return
+
+    candidates = (
+        SpendRollup.objects.select_for_update()
+        .filter(
+            metric=metric,
+            project_id__in={key[0] for key in combined},
+            start__in={key[3] for key in combined},
+        )
+        .order_by('pk')
+        .values_list('pk', 'project_id', 'branch_id', 'period', 'start')
+    )
+    existing = {}
+    for pk, *key in candidates:
+        if tuple(key) in combined:
+            existing[tuple(key)] = pk
+
+    updates = [(pk, combined[key]) for key, pk in existing.items()]
+    for offset in range(0, len(updates), ROLLUP_UPDATE_CHUNK):
+        chunk = updates[offset:offset + ROLLUP_UPDATE_CHUNK]
+        SpendRollup.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+            amount=F('amount') + Case(*[When(pk=pk, then=Value(delta)) for pk, delta in chunk],
+                                      output_field=DecimalField(max_digits=14, decimal_places=2)),
+        )
+
+    missing = sorted((key for key in combined if key not in existing), key=lambda k: (k[0], k[1] or 0, k[2], k[3]))
+    if not missing:
+        return
+    try:
+        with transaction.atomic():
+            SpendRollup.objects.bulk_create([
+                SpendRollup(project_id=project_id, branch_id=branch_id, metric=metric,
+                            period=period, start=start, amount=combined[project_id, branch_id, period, start])
+                for project_id, branch_id, period, start in missing
+            ])
+    except IntegrityError:
+        for key in missing:
+            _add_to_rollup_row(metric, key, combined[key])
+
+
+def adjust_spending(deltas):
+    """Add ``{(branch_id, day): delta}`` to the spending rollups of those branches."""
+    from .models import Branch, SpendRollup
+
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    projects = dict(Branch.all_objects.filter(pk__in={branch_id for branch_id, _ in deltas})
+                    .values_list('id', 'project_id'))
+    _add_to_rollups(SpendRollup.METRIC_SPENT, {
+        (projects[branch_id], branch_id, day): delta
+        for (branch_id, day), delta in deltas.items()
+        if branch_id in projects
+    })
+
+
+def adjust_releases(deltas):
+    """Add ``{(project_id, day): delta}`` to the release rollups of those projects."""
+    from .models import SpendRollup
+
+    _add_to_rollups(SpendRollup.METRIC_RELEASED, {
+        (project_id, None, day): delta
+        for (project_id, day), delta in deltas.items()
+        if delta
+    })
+
+
+def hide_branch_spending(project_id, branch_id, hidden=True):
+    """
+    Take a soft-deleted branch's spending off its project's rollups.
+
+    The branch's own rows are kept, so ``hidden=False`` can add them back
+    when the branch is restored. Reads one row per day the branch spent on.
+    """
+    from .models import SpendRollup
+
+    sign = -1 if hidden else 1
+    days = (
+        SpendRollup.objects.filter(branch_id=branch_id, metric=SpendRollup.METRIC_SPENT,
+                                   period=SpendRollup.PERIOD_DAY)
+        .values_list('start', 'amount')
+    )
+    _add_to_rollups(SpendRollup.METRIC_SPENT, {
+        (project_id, None, start): sign * as_decimal(amount)
+        for start, amount in days.iterator(chunk_size=2000)
+    })
+
+
+def rebuild_timeseries(project_ids=None, apps=global_apps):
+    """
+    Recompute the SpendRollup rows (of ``project_ids``, or all) from the entries.
+
+    Returns the number of rows written. ``apps`` lets a data migration pass
+    its historical models.
+    """
+    from . import models
+
+    SpendRollup = apps.get_model('projects', 'SpendRollup')
+    Project = apps.get_model('projects', 'Project')
+    Branch = apps.get_model('projects', 'Branch')
+    SubBranch = apps.get_model('projects', 'SubBranch')
+    ReleasedHistory = apps.get_model('projects', 'ReleasedHistory')
+
+    # Soft-deleted branches keep their own rows but do not count towards
+    # their project's (see hide_branch_spending). Older historical models
+    # have no deleted_at yet.
+    hidden = set()
+    if any(field.name == 'deleted_at' for field in Branch._meta.get_fields()):
+        hidden = set(Branch._base_manager.filter(deleted_at__isnull=False).values_list('pk', flat=True))
+    # Archived projects keep their rows: their entries are not in the tables
+    archived = set()
+    if any(field.name == 'archived_at' for field in Project._meta.get_fields()):
+        archived = set(Project._base_manager.filter(archived_at__isnull=False).values_list('pk', flat=True))
+
+    # (metric, rows as (project, branch, day), project field); releases have
+    # no branch
+    sources = [
+        (models.SpendRollup.METRIC_SPENT,
+         SubBranch.objects.values_list('branch__project_id', 'branch_id', 'date'), 'branch__project_id'),
+        (models.SpendRollup.METRIC_RELEASED,
+         ReleasedHistory.objects.values_list('project_id', Value(None, output_field=IntegerField()), 'date'),
+         'project_id'),
+    ]
+    written = 0
+    with transaction.atomic():
+        existing = SpendRollup.objects.exclude(project_id__in=archived)
+        if project_ids is not None:
+            existing = existing.filter(project_id__in=project_ids)
+        existing.delete()
+
+        for metric, rows, project_field in sources:
+            if project_ids is not None:
+                rows = rows.filter(**{f'{project_field}__in': project_ids})
+            # One grouped query per metric; months and project totals are
+            # added up from the daily sums.
+            rows = rows.order_by().annotate(total=Sum('amount'))
+            combined = defaultdict(Decimal)
+            for project_id, branch_id, day, total in rows.iterator(chunk_size=2000):
+                if project_id in archived:
+                    continue
+                for key in _rollup_keys(project_id, branch_id, day):
+                    if key[1] is None and branch_id in hidden:
+                        continue
+                    combined[key] += as_decimal(total)
+            SpendRollup.objects.bulk_create(
+                [
+                    SpendRollup(project_id=project_id, branch_id=branch_id, metric=metric,
+                                period=period, start=start, amount=amount)
+                    for (project_id, branch_id, period, start), amount in combined.items()
+                ],
+                batch_size=1000,
+            )
+            written += len(combined)
+    return written
+
+
+# ═══════════════════════════════════════════════════════════
+# Project.content_version
+# ═══════════════════════════════════════════════════════════
+def bump_project_version(*project_ids):
+    """Mark the given project(s) as changed, in one query."""
+    from .models import Project
+
+    project_ids = {pk for pk in project_ids if pk is not None}
+    if project_ids:
+        Project.all_objects.filter(pk__in=project_ids).update(content_version=F('content_version') + 1)
+
+
+def bump_branch_project_version(*branch_ids):
+    """Mark the project(s) owning the given branches as changed, in one query."""
+    from .models import Project
+
+    branch_ids = {pk for pk in branch_ids if pk is not None}
+    if branch_ids:
+        Project.all_objects.filter(branches__in=branch_ids).update(content_version=F('content_version') + 1)
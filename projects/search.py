@@ -0,0 +1,275 @@
+"""
+Full-text search over project, branch and expense (SubBranch) names.
+
+Every searchable object has one ``SearchEntry`` row holding its name, owner
+and, for expenses, amount and date. The save hooks keep the rows current;
+deleting a project or branch removes the entries below it through their
+foreign keys. Entries below a soft-deleted one (see projects.trash) stay put
+until it is purged and every query leaves them out, so a restore needs no
+reindexing. The text index itself depends on the database:
+
+* SQLite: a contentless FTS5 table, ``projects_search_fts``, fed by triggers
+  on ``projects_searchentry``. The owner is indexed as a token, so the
+  per-user restriction is part of the index lookup rather than a filter over
+  every match.
+* PostgreSQL: a GIN index on ``to_tsvector('simple', name)``.
+* Anything else falls back to ``icontains``.
+
+Words are matched as prefixes ("cem" finds "Cement"), every word must match,
+and results are ranked by relevance (bm25 / ts_rank).
+"""
+import re
+
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db import connection
+
+from . import changefeed
+
+
+FTS_TABLE = 'projects_search_fts'
+TSVECTOR_INDEX = 'projects_searchentry_name_tsv'
+SEARCH_KINDS = (changefeed.KIND_PROJECT, changefeed.KIND_BRANCH, changefeed.KIND_SUBBRANCH)
+MAX_QUERY_WORDS = 8
+REBUILD_BATCH_SIZE = 2000
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Appended to every raw query on the entry alias "e"
+ACTIVE_CONDITION = (
+    ' AND NOT EXISTS (SELECT 1 FROM projects_project p WHERE p.id = e.project_id AND p.deleted_at IS NOT NULL)'
+    ' AND NOT EXISTS (SELECT 1 FROM projects_branch b WHERE b.id = e.branch_id AND b.deleted_at IS NOT NULL)'
+)
+
+
+# ═══════════════════════════════════════════════════════════
+# Index maintenance (called from the model hooks)
+# ═══════════════════════════════════════════════════════════
+def _upsert(kind, object_id, **values):
+    from .models import SearchEntry
+
+    if not SearchEntry.objects.filter(kind=kind, object_id=object_id).update(**values):
+        SearchEntry.objects.create(kind=kind, object_id=object_id, **values)
+
+
+def index_project(project):
+    _upsert(changefeed.KIND_PROJECT, project.pk,
+            user_id=project.user_id, project_id=project.pk, branch_id=None, name=project.name)
+
+
+def index_branch(branch):
+    owner = changefeed.owner_of(project_id=branch.project_id)
+    if owner is not None:
+        _upsert(changefeed.KIND_BRANCH, branch.pk,
+                user_id=owner[1], project_id=branch.project_id, branch_id=branch.pk, name=branch.name)
+
+
+def index_subbranch(subbranch):
+    owner = changefeed.owner_of(branch_id=subbranch.branch_id)
+    if owner is not None:
+        project_id, user_id = owner
+        _upsert(changefeed.KIND_SUBBRANCH, subbranch.pk,
+                user_id=user_id, project_id=project_id, branch_id=subbranch.branch_id,
+                name=subbranch.name, amount=subbranch.amount, date=subbranch.date)
+
+
+def index_new_subbranches(branch, subbranches):
+    """Index freshly bulk-created expenses of one branch."""
+    from .models import SearchEntry
+
+    owner = changefeed.owner_of(branch_id=branch.pk)
+    if owner is None:
+        return
+    project_id, user_id = owner
+    SearchEntry.objects.bulk_create(
+        [
+            SearchEntry(kind=changefeed.KIND_SUBBRANCH, object_id=obj.pk, user_id=user_id,
+                        project_id=project_id, branch_id=branch.pk,
+                        name=obj.name, amount=obj.amount, date=obj.date)
+            for obj in subbranches if obj.pk is not None
+        ],
+        batch_size=REBUILD_BATCH_SIZE,
+    )
+
+
+def unindex_subbranch(subbranch_id):
+    from .models import SearchEntry
+
+    SearchEntry.objects.filter(kind=changefeed.KIND_SUBBRANCH, object_id=subbranch_id).delete()
+
+
+def rebuild_search_index(apps=global_apps):
+    """Recreate every SearchEntry from the source tables; returns the count."""
+    SearchEntry = apps.get_model('projects', 'SearchEntry')
+    Project = apps.get_model('projects', 'Project')
+    Branch = apps.get_model('projects', 'Branch')
+    SubBranch = apps.get_model('projects', 'SubBranch')
+
+    SearchEntry.objects.all().delete()
+    # (kind, rows, entry fields from a row); soft-deleted rows are indexed
+    # too, the queries leave them out
+    sources = [
+        (changefeed.KIND_PROJECT,
+         Project._base_manager.values('id', 'user_id', 'name'),
+         lambda row: {'user_id': row['user_id'], 'project_id': row['id'], 'name': row['name']}),
+        (changefeed.KIND_BRANCH,
+         Branch._base_manager.values('id', 'project_id', 'project__user_id', 'name'),
+         lambda row: {'user_id': row['project__user_id'], 'project_id': row['project_id'],
+                      'branch_id': row['id'], 'name': row['name']}),
+        (changefeed.KIND_SUBBRANCH,
+         SubBranch.objects.values('id', 'branch_id', 'branch__project_id', 'branch__project__user_id',
+                                  'name', 'amount', 'date'),
+         lambda row: {'user_id': row['branch__project__user_id'], 'project_id': row['branch__project_id'],
+                      'branch_id': row['branch_id'], 'name': row['name'],
+                      'amount': row['amount'], 'date': row['date']}),
+    ]
+    written = 0
+    for kind, rows, fields in sources:
+        batch = []
+        for row in rows.order_by().iterator(chunk_size=REBUILD_BATCH_SIZE):
+            batch.append(SearchEntry(kind=kind, object_id=row['id'], **fields(row)))
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                SearchEntry.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        SearchEntry.objects.bulk_create(batch)
+        written += len(batch)
+    return written
+
+
+# ═══════════════════════════════════════════════════════════
+# Database-specific index objects (created by migration 0010)
+# ═══════════════════════════════════════════════════════════
+def create_text_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        statements = [
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            f"name, owner, content='', prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+            f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON projects_searchentry BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, name, owner) VALUES (new.id, new.name, 'u' || new.user_id); END",
+            f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON projects_searchentry BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, owner) "
+            f"VALUES ('delete', old.id, old.name, 'u' || old.user_id); END",
+            f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF name, user_id ON projects_searchentry BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, owner) "
+            f"VALUES ('delete', old.id, old.name, 'u' || old.user_id); "
+            f"INSERT INTO {FTS_TABLE}(rowid, name, owner) VALUES (new.id, new.name, 'u' || new.user_id); END",
+        ]
+    elif vendor == 'postgresql':
+        statements = [
+            f"CREATE INDEX {TSVECTOR_INDEX} ON projects_searchentry USING GIN (to_tsvector('simple', name))",
+        ]
+    else:
+        statements = []
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_text_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {TSVECTOR_INDEX}')
+
+
+# ═══════════════════════════════════════════════════════════
+# Queries
+# ═══════════════════════════════════════════════════════════
+class SearchPage:
+    def __init__(self, results, page, has_next):
+        self.results = results
+        self.number = page
+        self.has_next = has_next
+
+    @property
+    def has_previous(self):
+        return self.number > 1
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+
+def query_words(text):
+    return WORD_RE.findall(text or '')[:MAX_QUERY_WORDS]
+
+
+def _filters(kind, min_amount, max_amount, date_from, date_to):
+    # (SQL condition on the entry alias "e", params); amount and date
+    # bounds only ever match expenses
+    conditions, params = [], []
+    if kind:
+        conditions.append('e.kind = %s')
+        params.append(kind)
+    for sql, value in (('e.amount >= %s', min_amount), ('e.amount <= %s', max_amount),
+                       ('e.date >= %s', date_from), ('e.date <= %s', date_to)):
+        if value is not None:
+            conditions.append(sql)
+            params.append(value)
+    return ''.join(f' AND {condition}' for condition in conditions) + ACTIVE_CONDITION, params
+
+
+def _ranked_ids(user, words, filters, limit, offset):
+    where, params = filters
+    if connection.vendor == 'sqlite':
+        # Quoted words with '*' are literal prefixes, whatever they contain
+        match = ' AND '.join([f'owner:"u{int(user.pk)}"'] + [f'name:"{word}"*' for word in words])
+        sql = (
+            f'SELECT e.id FROM {FTS_TABLE} f JOIN projects_searchentry e ON e.id = f.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s{where} ORDER BY bm25({FTS_TABLE}), e.id LIMIT %s OFFSET %s'
+        )
+        params = [match, *params, limit, offset]
+    elif connection.vendor == 'postgresql':
+        tsquery = ' & '.join(f"'{word}':*" for word in words)
+        sql = (
+            "SELECT e.id FROM projects_searchentry e, to_tsquery('simple', %s) q "
+            "WHERE e.user_id = %s AND to_tsvector('simple', e.name) @@ q" + where +
+            " ORDER BY ts_rank(to_tsvector('simple', e.name), q) DESC, e.id LIMIT %s OFFSET %s"
+        )
+        params = [tsquery, user.pk, *params, limit, offset]
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search(user, text, kind='', min_amount=None, max_amount=None, date_from=None, date_to=None,
+           page=1, page_size=None):
+    """Return a ``SearchPage`` of the user's ``SearchEntry`` rows matching ``text``."""
+    from .models import SearchEntry
+
+    page_size = page_size or settings.CIVITRACK_PAGE_SIZE
+    words = query_words(text)
+    if not words:
+        return SearchPage([], 1, False)
+    page = max(1, page)
+    limit, offset = page_size + 1, (page - 1) * page_size
+
+    ids = _ranked_ids(user, words, _filters(kind, min_amount, max_amount, date_from, date_to), limit, offset)
+    entries = SearchEntry.objects.select_related('project', 'branch').only(
+        'kind', 'object_id', 'name', 'amount', 'date', 'project__name', 'branch__name',
+    )
+    if ids is None:
+        # branch__deleted_at__isnull also matches entries without a branch
+        queryset = entries.filter(user=user, project__deleted_at__isnull=True, branch__deleted_at__isnull=True)
+        for word in words:
+            queryset = queryset.filter(name__icontains=word)
+        if kind:
+            queryset = queryset.filter(kind=kind)
+        for lookup, value in (('amount__gte', min_amount), ('amount__lte', max_amount),
+                              ('date__gte', date_from), ('date__lte', date_to)):
+            if value is not None:
+                queryset = queryset.filter(**{lookup: value})
+        results = list(queryset.order_by('name', 'id')[offset:offset + limit])
+    else:
+        found = entries.in_bulk(ids)
+        results = [found[pk] for pk in ids if pk in found]
+
+    return SearchPage(results[:page_size], page, len(results) > page_size)
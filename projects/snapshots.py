@@ -0,0 +1,75 @@
+"""
+Loading a project together with its children in a fixed number of queries.
+
+``load_project_snapshot`` fetches the project and, on request, its branches
+(optionally with their sub-branches) and its release history through
+``Prefetch`` objects that select only the columns the pages and the PDF export
+use. The number of queries depends on which parts are requested, never on how
+many branches or entries the project has.
+"""
+from django.db.models import Prefetch
+from django.shortcuts import aget_object_or_404, get_object_or_404
+
+from .models import Project, Branch, SubBranch, ReleasedHistory
+
+
+BRANCH_FIELDS = ('id', 'project_id', 'name', 'total_spent', 'created_at')
+SUBBRANCH_FIELDS = ('id', 'branch_id', 'name', 'amount', 'date')
+RELEASE_FIELDS = ('id', 'project_id', 'amount', 'date')
+
+# Branch order shared by the pages and the PDF; the id breaks created_at ties
+# so the sub-branch stream below can be merged against it.
+BRANCH_ORDERING = ('-created_at', '-id')
+
+
+def branch_queryset(subbranches=False):
+    queryset = Branch.objects.only(*BRANCH_FIELDS).order_by(*BRANCH_ORDERING)
+    if subbranches:
+        queryset = queryset.prefetch_related(
+            Prefetch('subbranches', queryset=SubBranch.objects.only(*SUBBRANCH_FIELDS))
+        )
+    return queryset
+
+
+def release_queryset():
+    return ReleasedHistory.objects.only(*RELEASE_FIELDS)
+
+
+def _snapshot_queryset(user, branches=False, subbranches=False, releases=False):
+    prefetches = []
+    if branches or subbranches:
+        prefetches.append(Prefetch('branches', queryset=branch_queryset(subbranches)))
+    if releases:
+        prefetches.append(Prefetch('released_history', queryset=release_queryset()))
+    return Project.objects.filter(user=user).prefetch_related(*prefetches)
+
+
+def load_project_snapshot(user, project_id, branches=False, subbranches=False, releases=False):
+    """
+    Return the user's project with the requested children prefetched.
+
+    Raises Http404 if the project does not exist or belongs to someone else.
+    Queries: one for the project, plus one each for branches, sub-branches and
+    releases when requested (``subbranches`` implies ``branches``).
+    """
+    return get_object_or_404(_snapshot_queryset(user, branches, subbranches, releases), id=project_id)
+
+
+async def aload_project_snapshot(user, project_id, branches=False, subbranches=False, releases=False):
+    """``load_project_snapshot`` for async views."""
+    return await aget_object_or_404(_snapshot_queryset(user, branches, subbranches, releases), id=project_id)
+
+
+def project_subbranch_stream(project, chunk_size):
+    """
+    Stream every sub-branch of ``project`` with a single query.
+
+    Rows come grouped by branch in ``BRANCH_ORDERING`` and newest first within
+    each branch, so they can be walked alongside the prefetched branch list.
+    """
+    return (
+        SubBranch.objects.filter(branch__project=project, branch__deleted_at__isnull=True)
+        .only(*SUBBRANCH_FIELDS)
+        .order_by('-branch__created_at', '-branch_id', '-date', '-id')
+        .iterator(chunk_size=chunk_size)
+    )
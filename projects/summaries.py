@@ -0,0 +1,89 @@
+"""
+Cached per-project financial summaries.
+
+A summary holds the figures shown at the top of the project page (spent,
+remaining, unspent release balance). It is computed with one aggregate query
+and cached under the project's ``content_version``: every save/delete hook
+that changes a project bumps the version, so the next read misses and
+recomputes, and entries for old versions simply expire. Because the key is
+versioned, a summary computed while a write was in flight can never be
+served as current, and several processes can share a cache safely.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Project
+from .rollups import ZERO
+
+
+def summary_key(project_id, version):
+    return f'project-summary:{project_id}:v{version}'
+
+
+def _summary_query(project_id):
+    return (
+        Project.objects.filter(pk=project_id)
+        .order_by()
+        .annotate(
+            spent=Coalesce(
+                Sum('branches__total_spent', filter=Q(branches__deleted_at__isnull=True)),
+                Value(ZERO),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+            branch_count=Count('branches', filter=Q(branches__deleted_at__isnull=True)),
+        )
+        .values('amount', 'total_released', 'content_version', 'spent', 'branch_count')
+    )
+
+
+def _summary(row):
+    return {
+        'amount': row['amount'],
+        'total_released': row['total_released'],
+        'total_branch_spent': row['spent'],
+        'remaining': row['amount'] - row['total_released'],
+        'bottom_amount': row['total_released'] - row['spent'],
+        'branch_count': row['branch_count'],
+        'content_version': row['content_version'],
+    }
+
+
+def compute_summary(project_id):
+    """Aggregate a project's summary from its branches in one query."""
+    return _summary(_summary_query(project_id).get())
+
+
+def get_project_summary(project):
+    """
+    Return the summary for ``project`` at the version it was loaded with.
+
+    A cache hit costs no queries at all.
+    """
+    key = summary_key(project.pk, project.content_version)
+    summary = cache.get(key)
+    if summary is None:
+        summary = compute_summary(project.pk)
+        # Store under the version actually read, which may be newer than the
+        # one the caller loaded.
+        cache.set(
+            summary_key(project.pk, summary['content_version']),
+            summary,
+            settings.CIVITRACK_SUMMARY_CACHE_TIMEOUT,
+        )
+    return summary
+
+
+async def aget_project_summary(project):
+    """``get_project_summary`` for async views."""
+    key = summary_key(project.pk, project.content_version)
+    summary = await cache.aget(key)
+    if summary is None:
+        summary = _summary(await _summary_query(project.pk).aget())
+        await cache.aset(
+            summary_key(project.pk, summary['content_version']),
+            summary,
+            settings.CIVITRACK_SUMMARY_CACHE_TIMEOUT,
+        )
+    return summary
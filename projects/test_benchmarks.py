@@ -0,0 +1,86 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from . import benchmarks
+from .models import SubBranch
+from .tests import PLAIN_STATIC, MediaRootMixin
+
+
+@PLAIN_STATIC
+class BenchmarkScenarioTests(MediaRootMixin, TestCase):
+    """
+    Runs every scenario of run_benchmarks against a tiny seeded set, so a
+    renamed URL, a failing page or a new query per request shows up here
+    rather than in the next benchmark run.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        call_command('seed_benchmark_data', users=1, projects=2, branches=2, subbranches=40, releases=10,
+                     stdout=StringIO())
+
+    def test_scenarios_report_latency_and_queries(self):
+        document = benchmarks.run(iterations=3)
+
+        # Counted after the run: the seeded 40 and the four added below
+        self.assertEqual(document['data']['subbranches'], 44)
+        self.assertEqual(document['data']['releases'], 10)
+        self.assertEqual({name: result['queries'] for name, result in document['scenarios'].items()}, {
+            'project_details': 6,
+            'branch_history': 5,
+            # The POST and the branch page it redirects to
+            'add_subbranch': 24,
+            # The first request renders the PDF, the others reuse it
+            'export_project_pdf': 7,
+            'login': 9,
+        })
+        for name, result in document['scenarios'].items():
+            with self.subTest(name):
+                self.assertEqual(result['iterations'], 3)
+                self.assertGreater(result['p50_ms'], 0)
+                self.assertGreaterEqual(result['p95_ms'], result['p50_ms'])
+                self.assertGreaterEqual(result['max_ms'], result['p95_ms'])
+                self.assertGreater(result['peak_memory_kib'], 0)
+        # Three timed adds and the traced one
+        self.assertEqual(SubBranch.objects.filter(name__startswith='Benchmark entry').count(), 4)
+
+    def call_run_benchmarks(self, **options):
+        # The command sets up the test environment itself, which the test
+        # runner has already done
+        command = 'projects.management.commands.run_benchmarks'
+        with mock.patch(f'{command}.setup_test_environment'), mock.patch(f'{command}.teardown_test_environment'):
+            call_command('run_benchmarks', no_save=True, **options)
+
+    def test_command_runs_selected_scenarios(self):
+        out = StringIO()
+        self.call_run_benchmarks(iterations=1, scenario=['login', 'branch_history'], stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split()[0] for line in lines[1:]], ['branch_history', 'login'])
+        self.assertIn('p95', lines[1])
+
+    def test_command_without_data(self):
+        benchmarks.clear_benchmark_data()
+        with self.assertRaisesMessage(CommandError, 'seed_benchmark_data'):
+            self.call_run_benchmarks(stdout=StringIO())
+
+
+class LoginBenchmarkTests(TestCase):
+    def test_login_scaling_reports_each_size(self):
+        results = benchmarks.login_scaling(user_counts=(20, 5), iterations=2)
+
+        self.assertEqual([result['users'] for result in results], [5, 20])
+        self.assertEqual(benchmarks.login_users().count(), 20)
+        for result in results:
+            with self.subTest(users=result['users']):
+                # The email lookup; the session is not touched without a request
+                self.assertEqual(result['queries'], 1)
+                self.assertGreater(result['lookup_p50_ms'], 0)
+                self.assertGreaterEqual(result['login_p95_ms'], result['login_p50_ms'])
+
+        self.assertEqual(benchmarks.clear_login_users(batch_size=7), 20)
+        self.assertFalse(benchmarks.login_users().exists())
@@ -0,0 +1,1826 @@
+import datetime
+import gzip
+import json
+import shutil
+import tempfile
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import DecimalField, Sum, Value
+from django.db.models.functions import Coalesce
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from reportlab.platypus import Paragraph, Table
+
+from civitrack.database import parse_database_url
+
+from . import (analytics, api, archives, changefeed, exports, importers, middleware, portfolio, reports, rollups,
+               search, summaries, trash, views)
+from .backends import users_with_email
+from .models import Branch, ChangeLog, ExportJob, Project, ReleasedHistory, SearchEntry, SpendRollup, SubBranch
+from .pagination import encode_cursor
+from .snapshots import branch_queryset, load_project_snapshot
+
+
+# The hashed-name storage needs collectstatic's manifest to render a page
+PLAIN_STATIC = override_settings(STORAGES={
+    **settings.STORAGES,
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+
+
+def seed_project(user, branches=3, entries=4, releases=3, name='Bridge'):
+    """A project with ``branches`` branches of ``entries`` expenses each, and ``releases`` releases."""
+    project = Project.objects.create(
+        user=user, name=name, amount=Decimal('100000'), start_date=datetime.date(2024, 1, 1),
+    )
+    add_rows(project, branches, entries, releases)
+    return project
+
+
+def add_rows(project, branches, entries, releases):
+    day = datetime.date(2024, 2, 1)
+    for b in range(branches):
+        branch = Branch.objects.create(project=project, name=f'Branch {b}')
+        for e in range(entries):
+            SubBranch.objects.create(
+                branch=branch, name=f'Entry {e}', amount=Decimal('125.50'), date=day + datetime.timedelta(days=e),
+            )
+    for r in range(releases):
+        ReleasedHistory.objects.create(project=project, amount=Decimal('5000'), date=day + datetime.timedelta(days=r))
+
+
+class MediaRootMixin:
+    """Keep exported PDFs in a throwaway MEDIA_ROOT."""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+# ═══════════════════════════════════════════════════════════
+# QUERY COUNTS
+# ═══════════════════════════════════════════════════════════
+@PLAIN_STATIC
+class ProjectPageQueryCountTests(MediaRootMixin, TestCase):
+    """
+    The project pages and the PDF export load a project through
+    projects.snapshots in a fixed number of queries. Each count is checked
+    twice, the second time after the project has grown, so a query per
+    branch, expense or release fails here.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.project = seed_project(self.user)
+        self.branch = self.project.branches.order_by('id').first()
+        self.client.force_login(self.user)
+
+    def grow(self):
+        add_rows(self.project, branches=4, entries=6, releases=5)
+        for _ in range(6):
+            SubBranch.objects.create(branch=self.branch, name='Extra', amount=Decimal('1'), date=datetime.date(2024, 3, 1))
+        cache.clear()
+
+    def assertQueriesBeforeAndAfterGrowth(self, count, url):
+        for grown in (False, True):
+            if grown:
+                self.grow()
+            with self.subTest(grown=grown), self.assertNumQueries(count):
+                response = self.client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                response.close()
+            self.assertEqual(response.status_code, 200)
+
+    def test_project_details(self):
+        # Session, user and ETag version (every page below starts with those
+        # three), project, branches, summary
+        self.assertQueriesBeforeAndAfterGrowth(6, reverse('project_details', args=[self.project.id]))
+
+    def test_released_history(self):
+        # Project, one page of releases
+        self.assertQueriesBeforeAndAfterGrowth(5, reverse('released_history', args=[self.project.id]))
+
+    def test_branch_history(self):
+        # Branch with its project, one page of expenses
+        self.assertQueriesBeforeAndAfterGrowth(5, reverse('branch_history', args=[self.branch.id]))
+
+    def test_export_project_pdf(self):
+        # Project, branches, the expense stream, the releases. Rendered on
+        # each request here, since growing the project changes its
+        # content_version.
+        self.assertQueriesBeforeAndAfterGrowth(7, reverse('export_project_pdf', args=[self.project.id]))
+
+    def test_export_project_pdf_cached(self):
+        url = reverse('export_project_pdf', args=[self.project.id])
+        self.client.get(url).close()
+        # Project and branches only; the file is served from MEDIA_ROOT
+        with self.assertNumQueries(5):
+            self.client.get(url).close()
+
+
+# ═══════════════════════════════════════════════════════════
+# PDF EXPORT
+# ═══════════════════════════════════════════════════════════
+@PLAIN_STATIC
+class PdfExportTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.project = seed_project(self.user)
+        self.client.force_login(self.user)
+
+    def download(self):
+        response = self.client.get(reverse('export_project_pdf', args=[self.project.id]))
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_cached_report_holds_nothing_per_download(self):
+        first = self.download()
+        self.assertEqual(self.download(), first)
+
+        project = load_project_snapshot(self.user, self.project.id, branches=True)
+        footer = list(reports.project_story(project))[-1].text
+        self.assertIn('Generated:', footer)
+        self.assertNotIn(self.user.email, footer)
+
+    @mock.patch.object(views, 'PDF_STREAM_BLOCK_SIZE', 1024)
+    async def test_streamed_from_an_async_iterator_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('export_project_pdf', args=[self.project.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIs(response.is_async, True)
+        blocks = [block async for block in response.streaming_content]
+        self.assertGreater(len(blocks), 1)
+
+        body = b''.join(blocks)
+        self.assertEqual(body, await sync_to_async(self.download)())
+        self.assertEqual(response['Content-Length'], str(len(body)))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Content-Disposition'],
+                         f'attachment; filename="{reports.export_filename(self.project)}"')
+
+
+class ExportJobTests(MediaRootMixin, TestCase):
+    """The queued export path: enqueue, claim, run and download."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.project = seed_project(self.user, branches=1, entries=2, releases=1)
+        self.client.force_login(self.user)
+
+    def start(self):
+        response = self.client.post(reverse('start_export_job', args=[self.project.id]))
+        self.assertEqual(response.status_code, 202)
+        return ExportJob.objects.get(pk=response.json()['id'])
+
+    def download(self, job):
+        return self.client.get(reverse('export_job_download', args=[job.id]))
+
+    def bump_version(self):
+        ReleasedHistory.objects.create(project=self.project, amount=Decimal('1'), date=datetime.date(2024, 4, 1))
+
+    def test_claimed_job_runs_to_done(self):
+        job = self.start()
+        self.assertEqual(job.status, ExportJob.STATUS_QUEUED)
+        # A second request for the same version reuses the queued job
+        self.assertEqual(self.start(), job)
+        self.assertEqual(self.download(job).status_code, 409)
+
+        claimed = exports.claim_next_job()
+        self.assertEqual((claimed, claimed.status), (job, ExportJob.STATUS_RUNNING))
+        self.assertIsNotNone(claimed.started_at)
+        self.assertIsNone(exports.claim_next_job())
+
+        exports.run_job(claimed)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.STATUS_DONE)
+        self.assertEqual(job.file, exports.artifact_name(self.project.id, job.content_version))
+        self.assertIsNotNone(job.finished_at)
+
+        status = self.client.get(reverse('export_job_status', args=[job.id])).json()
+        self.assertEqual(status['download_url'], reverse('export_job_download', args=[job.id]))
+        response = self.download(job)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_failed_render_is_recorded(self):
+        job = self.start()
+        with mock.patch.object(reports, 'build_project_pdf', side_effect=ValueError('no fonts')), \
+                self.assertLogs('projects.exports', 'ERROR'):
+            exports.run_job(exports.claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error, job.file), (ExportJob.STATUS_FAILED, 'no fonts', ''))
+        self.assertFalse(list(Path(settings.MEDIA_ROOT).rglob('*.part')))
+
+        status = self.client.get(reverse('export_job_status', args=[job.id])).json()
+        self.assertEqual((status['status'], status['error']), ('failed', 'no fonts'))
+        self.assertNotIn('download_url', status)
+        self.assertEqual(self.download(job).status_code, 409)
+
+    def test_job_for_an_old_version_is_gone(self):
+        job = self.start()
+        exports.run_job(exports.claim_next_job())
+        self.bump_version()
+
+        newer = self.start()
+        exports.run_job(exports.claim_next_job())
+        newer.refresh_from_db()
+        self.assertGreater(newer.content_version, job.content_version)
+
+        response = self.download(job)
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.json()['error'], 'Export is out of date, please start a new one.')
+        self.assertEqual(self.download(newer).status_code, 200)
+
+    def test_stale_render_keeps_the_newer_file(self):
+        old = load_project_snapshot(self.user, self.project.id, branches=True)
+        self.bump_version()
+        current = load_project_snapshot(self.user, self.project.id, branches=True)
+        newer = exports.render_export(current)
+
+        # A worker that loaded the project before the write finishes last
+        older = exports.render_export(old)
+        self.assertTrue(exports.artifact_path(newer).exists())
+        self.assertTrue(exports.artifact_path(older).exists())
+
+        # The next render of the current version drops the older file only
+        self.bump_version()
+        latest = exports.render_export(load_project_snapshot(self.user, self.project.id, branches=True))
+        self.assertEqual(sorted(path.name for path in exports.artifact_path(latest).parent.iterdir()),
+                         [Path(latest).name])
+
+
+# ═══════════════════════════════════════════════════════════
+# REQUEST METRICS
+# ═══════════════════════════════════════════════════════════
+@PLAIN_STATIC
+@override_settings(CIVITRACK_REQUEST_METRICS=True)
+class RequestMetricsTests(TestCase):
+    """The middleware counts a page's queries under both handlers."""
+
+    def setUp(self):
+        cache.clear()
+        middleware.store.clear()
+        self.addCleanup(middleware.store.clear)
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.url = reverse('project_details', args=[seed_project(self.user).id])
+
+    def assertRecorded(self, response, logs):
+        self.assertEqual(response.status_code, 200)
+        # The six queries of ProjectPageQueryCountTests.test_project_details
+        self.assertIn('desc="6 queries, 0 repeated"', response['Server-Timing'])
+        [row] = middleware.store.summary()
+        self.assertEqual((row['name'], row['count'], row['max_queries']), ('project_details', 1, 6))
+
+        # One JSON line per request, without the repeats when there are none
+        [record] = logs.records
+        logged = json.loads(record.getMessage())
+        self.assertEqual(
+            {name: logged[name] for name in ('view', 'method', 'path', 'status', 'queries', 'duplicate_queries')},
+            {'view': 'project_details', 'method': 'GET', 'path': self.url, 'status': 200, 'queries': 6,
+             'duplicate_queries': 0},
+        )
+        self.assertNotIn('repeated', logged)
+        self.assertGreater(logged['duration_ms'], 0)
+        self.assertEqual(logged['bytes'], len(response.content))
+
+    def test_wsgi(self):
+        self.client.force_login(self.user)
+        with self.assertLogs('civitrack.requests', 'INFO') as logs:
+            response = self.client.get(self.url)
+        self.assertRecorded(response, logs)
+
+    async def test_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        with self.assertLogs('civitrack.requests', 'INFO') as logs:
+            response = await self.async_client.get(self.url)
+        self.assertRecorded(response, logs)
+
+
+# ═══════════════════════════════════════════════════════════
+# INDEXES
+# ═══════════════════════════════════════════════════════════
+def index_name(model, fields):
+    return next(index.name for index in model._meta.indexes if index.fields == fields)
+
+
+class IndexUsageTests(TestCase):
+    """
+    The ownership-scoped lookups read through the composite indexes in
+    Meta.indexes, already in page order, and login through the LOWER(email)
+    index from migration 0006. Checked with the database's own query plan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', 'Owner@Example.com', 'correct horse battery')
+        cls.project = seed_project(cls.user, branches=2, entries=3, releases=2)
+        cls.branch = cls.project.branches.first()
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # A handful of rows is cheaper to scan; ask whether the
+                # planner can use an index at all
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}', params)
+            else:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+    def assertUsesIndex(self, queryset, name, sorted_by_index=True):
+        plan = self.query_plan(queryset)
+        self.assertIn(name, plan)
+        if sorted_by_index:
+            sort_step = 'Sort' if connection.vendor == 'postgresql' else 'TEMP B-TREE'
+            self.assertNotIn(sort_step, plan)
+
+    def test_project_list(self):
+        self.assertUsesIndex(self.user.projects.all(), index_name(Project, ['user', 'created_at', 'id']))
+
+    def test_branches_of_project(self):
+        # Ties on created_at are broken by id in a small sort
+        self.assertUsesIndex(
+            branch_queryset().filter(project=self.project), index_name(Branch, ['project', '-created_at']),
+            sorted_by_index=False,
+        )
+
+    def test_branch_history(self):
+        self.assertUsesIndex(self.branch.subbranches.all(), index_name(SubBranch, ['branch', '-date', '-id']))
+
+    def test_released_history(self):
+        self.assertUsesIndex(
+            self.project.released_history.all(), index_name(ReleasedHistory, ['project', '-date', '-id']),
+        )
+
+    def test_login_email_lookup(self):
+        self.assertUsesIndex(users_with_email(' OWNER@example.COM '), 'projects_user_email_lower_idx')
+        self.assertEqual(list(users_with_email('owner@example.com')), [self.user])
+
+
+# ═══════════════════════════════════════════════════════════
+# PAGINATION
+# ═══════════════════════════════════════════════════════════
+@PLAIN_STATIC
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.projects = [seed_project(self.user, 0, 0, 0, name=f'Project {n}') for n in range(3)]
+        self.client.force_login(self.user)
+
+    def test_project_list_second_page(self):
+        first = self.client.get(reverse('project_list'), {'page_size': 2})
+        self.assertEqual([p.id for p in first.context['projects']], [p.id for p in self.projects[:2]])
+
+        second = self.client.get(reverse('project_list'), {'page_size': 2, 'after': first.context['page'].next_cursor})
+        self.assertEqual([p.id for p in second.context['projects']], [self.projects[2].id])
+        # Labelled by id; a keyset page has no running number to restart
+        self.assertContains(second, f'#{self.projects[2].id}')
+        self.assertFalse(second.context['page'].has_next)
+
+
+# ═══════════════════════════════════════════════════════════
+# DATABASE COPY
+# ═══════════════════════════════════════════════════════════
+class CopyDatabaseTests(TestCase):
+    """
+    copy_database from a migrated SQLite file into the default database,
+    which is PostgreSQL when the suite runs with DATABASE_URL=postgres://...
+    """
+
+    SEED_ALIAS = 'copy_test_seed'
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.source_url = f'sqlite:///{Path(directory, "old.sqlite3")}'
+
+        connections.settings[self.SEED_ALIAS] = connections.configure_settings(
+            {DEFAULT_DB_ALIAS: {}, self.SEED_ALIAS: parse_database_url(self.source_url)}
+        )[self.SEED_ALIAS]
+        self.addCleanup(self.forget_connection, self.SEED_ALIAS)
+        self.addCleanup(self.forget_connection, 'copy_source')
+        call_command('migrate', database=self.SEED_ALIAS, verbosity=0)
+        self.seed()
+
+    def forget_connection(self, alias):
+        if alias in connections.settings:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+
+    def seed(self):
+        # Raw rows with ids far above 1; bulk_create skips the save hooks,
+        # which write to the default database
+        using = self.SEED_ALIAS
+        self.created_at = timezone.now() - datetime.timedelta(days=400)
+        User.objects.using(using).bulk_create([
+            User(id=41, username='owner', email='owner@example.com', password='!'),
+        ])
+        Project.all_objects.using(using).bulk_create([
+            Project(id=70, user_id=41, name='Old', amount=Decimal('900'), start_date=datetime.date(2023, 1, 1),
+                    total_released=Decimal('300'), content_version=9),
+        ])
+        Branch.all_objects.using(using).bulk_create([
+            Branch(id=80 + n, project_id=70, name=f'Branch {n}', total_spent=Decimal('20')) for n in range(2)
+        ])
+        SubBranch.objects.using(using).bulk_create([
+            SubBranch(id=500 + n, branch_id=80 + n % 2, name=f'Entry {n}', amount=Decimal('10'),
+                      date=datetime.date(2023, 2, 1)) for n in range(4)
+        ])
+        ReleasedHistory.objects.using(using).bulk_create([
+            ReleasedHistory(id=900, project_id=70, amount=Decimal('300'), date=datetime.date(2023, 1, 5)),
+        ])
+        # auto_now_add stamped the current time; the copy must keep the old one
+        SubBranch.objects.using(using).update(created_at=self.created_at)
+
+    def test_copies_rows_and_resets_sequences(self):
+        out = StringIO()
+        call_command('copy_database', self.source_url, '--batch-size', '3', stdout=out)
+        self.assertIn('projects.SubBranch: 4 row(s)', out.getvalue())
+
+        for model in (User, Project, Branch, SubBranch, ReleasedHistory):
+            with self.subTest(model=model.__name__):
+                self.assertEqual(
+                    sorted(model._base_manager.values_list('pk', flat=True)),
+                    sorted(model._base_manager.using(self.SEED_ALIAS).values_list('pk', flat=True)),
+                )
+        project = Project.objects.get()
+        self.assertEqual((project.total_released, project.content_version), (Decimal('300.00'), 9))
+        self.assertEqual(SubBranch.objects.get(pk=501).created_at, self.created_at)
+
+        # New rows continue after the copied ids instead of colliding with them
+        user = User.objects.create_user('new', 'new@example.com', 'correct horse battery')
+        self.assertGreater(user.pk, 41)
+        new_project = Project.objects.create(user=user, name='New', amount=1, start_date=datetime.date.today())
+        self.assertGreater(new_project.pk, 70)
+        self.assertGreater(SubBranch.objects.create(branch=Branch.objects.get(pk=80), name='x', amount=1,
+                                                    date=datetime.date.today()).pk, 503)
+
+    def test_refuses_a_target_with_data(self):
+        User.objects.create_user('someone', 'someone@example.com', 'correct horse battery')
+        with self.assertRaisesMessage(CommandError, 'already holds data'):
+            call_command('copy_database', self.source_url, stdout=StringIO())
+
+
+# ═══════════════════════════════════════════════════════════
+# ARCHIVES
+# ═══════════════════════════════════════════════════════════
+def story_contents(user, project_id):
+    """The text and table cells of a project's PDF report, without the dated footer."""
+    project = load_project_snapshot(user, project_id, branches=True)
+    contents = []
+    for flowable in list(reports.project_story(project))[:-1]:
+        if isinstance(flowable, Table):
+            contents.append(flowable._cellvalues)
+        elif isinstance(flowable, Paragraph):
+            contents.append(flowable.text)
+    return contents
+
+
+@PLAIN_STATIC
+class ArchiveTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.project = seed_project(self.user)
+        self.branch = self.project.branches.order_by('id').first()
+        self.client.force_login(self.user)
+
+    def hot_rows(self):
+        return (
+            list(SubBranch.objects.filter(branch__project=self.project)
+                 .order_by('id').values_list('id', 'branch_id', 'name', 'amount', 'date', 'created_at')),
+            list(ReleasedHistory.objects.filter(project=self.project)
+                 .order_by('id').values_list('id', 'amount', 'date', 'created_at')),
+        )
+
+    def totals(self):
+        return (
+            Project.objects.get(pk=self.project.pk).total_released,
+            list(Branch.objects.filter(project=self.project).order_by('id').values_list('id', 'total_spent')),
+        )
+
+    def search_entries(self):
+        return SearchEntry.objects.filter(project=self.project, kind=changefeed.KIND_SUBBRANCH).count()
+
+    def test_archive_writes_the_file_and_removes_the_rows(self):
+        totals = self.totals()
+        counts = archives.archive_project(self.project, batch_size=5)
+
+        self.assertEqual(counts, {changefeed.KIND_RELEASE: 3, changefeed.KIND_SUBBRANCH: 12})
+        path = archives.archive_path(self.project.pk)
+        with gzip.open(path, 'rt', encoding='utf-8') as fileobj:
+            lines = [json.loads(line) for line in fileobj]
+        self.assertEqual(lines[0], {'kind': 'archive', 'format': archives.FORMAT_VERSION, 'project_id': self.project.pk})
+        self.assertEqual(lines[-1], {'kind': 'end', **counts})
+        self.assertEqual(len(lines), 2 + 3 + 12)
+
+        self.assertEqual(self.hot_rows(), ([], []))
+        self.assertEqual(self.search_entries(), 0)
+        # The project, its branches and their totals stay
+        self.assertIsNotNone(self.project.archived_at)
+        self.assertEqual(self.totals(), totals)
+        with self.assertRaises(archives.ArchiveError):
+            archives.archive_project(self.project)
+
+    def test_archived_pages_read_the_archive(self):
+        subbranches, releases = self.hot_rows()
+        report = story_contents(self.user, self.project.pk)
+        archives.archive_project(self.project)
+
+        response = self.client.get(reverse('project_details', args=[self.project.pk]))
+        self.assertContains(response, self.branch.name)
+        response = self.client.get(reverse('released_history', args=[self.project.pk]))
+        self.assertEqual([release.id for release in response.context['history']],
+                         [row[0] for row in sorted(releases, key=lambda row: (row[2], row[0]), reverse=True)])
+        response = self.client.get(reverse('branch_history', args=[self.branch.pk]))
+        self.assertEqual(
+            [subbranch.id for subbranch in response.context['subbranches']],
+            [row[0] for row in sorted((row for row in subbranches if row[1] == self.branch.pk),
+                                      key=lambda row: (row[4], row[0]), reverse=True)],
+        )
+        response = self.client.get(reverse('export_project_pdf', args=[self.project.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.assertEqual(story_contents(self.user, self.project.pk), report)
+
+    def test_archived_project_refuses_writes(self):
+        archives.archive_project(self.project)
+        posts = [
+            (reverse('project_details', args=[self.project.pk]),
+             {'action': 'release_amount', 'amount': '10', 'date': '2024-05-01'}),
+            (reverse('project_details', args=[self.project.pk]), {'action': 'update_amount', 'amount': '1'}),
+            (reverse('new_branch', args=[self.project.pk]), {'name': 'Late'}),
+            (reverse('branch_history', args=[self.branch.pk]),
+             {'action': 'add', 'name': 'Late', 'amount': '10', 'date': '2024-05-01'}),
+            (reverse('delete_branch', args=[self.branch.pk]), {}),
+        ]
+        for url, data in posts:
+            with self.subTest(url=url, data=data):
+                response = self.client.post(url, data, follow=True)
+                self.assertContains(response, 'This project is archived and read-only.')
+        self.assertEqual(self.hot_rows(), ([], []))
+        self.assertEqual(Project.objects.get(pk=self.project.pk).amount, Decimal('100000'))
+        self.assertEqual(Branch.objects.filter(project=self.project).count(), 3)
+
+    def test_restore_brings_back_ids_timestamps_and_totals(self):
+        rows, totals, entries = self.hot_rows(), self.totals(), self.search_entries()
+        archives.archive_project(self.project, batch_size=5)
+
+        counts = archives.restore_project(self.project, batch_size=5)
+        self.assertEqual(counts, {changefeed.KIND_RELEASE: 3, changefeed.KIND_SUBBRANCH: 12})
+        self.assertIsNone(self.project.archived_at)
+        self.assertFalse(archives.archive_path(self.project.pk).exists())
+        self.assertEqual(self.hot_rows(), rows)
+        self.assertEqual(self.totals(), totals)
+        self.assertEqual(self.search_entries(), entries)
+
+        # Writable again, and new rows get fresh ids
+        response = self.client.post(reverse('branch_history', args=[self.branch.pk]),
+                                    {'action': 'add', 'name': 'After', 'amount': '1', 'date': '2024-05-01'})
+        self.assertEqual(response.status_code, 302)
+        self.assertGreater(SubBranch.objects.get(name='After').pk, max(row[0] for row in rows[0]))
+
+    def test_row_added_while_archiving_restores_the_project(self):
+        rows, totals = self.hot_rows(), self.totals()
+        write = archives._write
+
+        def write_then_add(project):
+            # A request that passed its read-only check before archived_at was set
+            counts = write(project)
+            SubBranch.objects.create(branch=self.branch, name='Late', amount=Decimal('7'),
+                                     date=datetime.date(2024, 5, 1))
+            return counts
+
+        with mock.patch.object(archives, '_write', write_then_add):
+            with self.assertRaisesMessage(archives.ArchiveError, 'changed while it was being archived'):
+                archives.archive_project(self.project)
+
+        self.project.refresh_from_db()
+        self.assertIsNone(self.project.archived_at)
+        self.assertFalse(archives.archive_path(self.project.pk).exists())
+        late = SubBranch.objects.get(name='Late')
+        subbranches, releases = self.hot_rows()
+        self.assertEqual(([row for row in subbranches if row[0] != late.pk], releases), rows)
+        self.assertEqual(Branch.objects.get(pk=self.branch.pk).total_spent,
+                         dict(totals[1])[self.branch.pk] + Decimal('7'))
+
+
+# ═══════════════════════════════════════════════════════════
+# DELETE, RESTORE AND PURGE
+# ═══════════════════════════════════════════════════════════
+def tree_rows(project_id):
+    """Row counts of everything one project owns, deleted or not."""
+    return {
+        'project': Project.all_objects.filter(pk=project_id).count(),
+        'branches': Branch.all_objects.filter(project_id=project_id).count(),
+        'subbranches': SubBranch.objects.filter(branch__project_id=project_id).count(),
+        'releases': ReleasedHistory.objects.filter(project_id=project_id).count(),
+        'search': SearchEntry.objects.filter(project_id=project_id).count(),
+        'rollups': SpendRollup.objects.filter(project_id=project_id).count(),
+        'export_jobs': ExportJob.objects.filter(project_id=project_id).count(),
+    }
+
+
+def project_spending(project):
+    """The project-wide daily spending rollups as ``{day: amount}``."""
+    return dict(SpendRollup.objects.filter(
+        project=project, branch__isnull=True, metric=SpendRollup.METRIC_SPENT, period=SpendRollup.PERIOD_DAY,
+    ).values_list('start', 'amount'))
+
+
+@PLAIN_STATIC
+class TrashTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.project = seed_project(self.user, name='Bridge')
+        self.other = seed_project(self.user, branches=1, entries=2, releases=1, name='Canal')
+        self.branch = Branch.objects.create(project=self.other, name='Scaffolding')
+        SubBranch.objects.create(branch=self.branch, name='Rebar', amount=Decimal('40'), date=datetime.date(2024, 2, 2))
+        SubBranch.objects.create(branch=self.branch, name='Rebar ties', amount=Decimal('2'), date=datetime.date(2024, 2, 9))
+        self.client.force_login(self.user)
+
+    def backdate(self, obj):
+        # Move a deletion to just before the undo window
+        obj.deleted_at = timezone.now() - datetime.timedelta(seconds=settings.CIVITRACK_UNDO_WINDOW + 1)
+        type(obj).all_objects.filter(pk=obj.pk).update(deleted_at=obj.deleted_at)
+
+    def visible(self):
+        """What the pages, the API and search show of the user's data."""
+        project_list = self.client.get(reverse('project_list')).context['projects']
+        portfolio = self.client.get(reverse('portfolio')).context['rows']
+        api = {name: self.client.get(reverse(name)).json()['results']
+               for name in ('api_projects', 'api_branches', 'api_subbranches', 'api_releases')}
+        results = search.search(self.user, 'Bridge').results + search.search(self.user, 'Rebar').results
+        return {
+            'project_list': [project.id for project in project_list],
+            'portfolio': {row['id']: row['spent'] for row in portfolio},
+            'api_projects': [row['id'] for row in api['api_projects']],
+            'api_branches': [row['id'] for row in api['api_branches']],
+            'api_subbranches': [row['id'] for row in api['api_subbranches']],
+            'api_releases': [row['id'] for row in api['api_releases']],
+            'search': sorted((entry.kind, entry.object_id) for entry in results),
+        }
+
+    def test_deleted_project_disappears(self):
+        before = self.visible()
+        response = self.client.post(reverse('delete_project', args=[self.project.pk]))
+        self.assertRedirects(response, reverse('project_list'), fetch_redirect_response=False)
+
+        after = self.visible()
+        self.assertEqual(after['project_list'], [self.other.pk])
+        self.assertEqual(list(after['portfolio']), [self.other.pk])
+        self.assertEqual(after['api_projects'], [self.other.pk])
+        self.assertEqual(after['api_branches'],
+                         sorted(Branch.objects.filter(project=self.other).values_list('id', flat=True)))
+        self.assertEqual(after['api_subbranches'],
+                         sorted(SubBranch.objects.filter(branch__project=self.other).values_list('id', flat=True)))
+        self.assertEqual(after['api_releases'],
+                         list(ReleasedHistory.objects.filter(project=self.other).values_list('id', flat=True)))
+        self.assertEqual(before['search'][0], (changefeed.KIND_PROJECT, self.project.pk))
+        self.assertEqual(after['search'], [entry for entry in before['search'] if entry[1] != self.project.pk])
+        for name in ('project_details', 'released_history', 'export_project_pdf', 'api_project_detail'):
+            with self.subTest(name):
+                self.assertEqual(self.client.get(reverse(name, args=[self.project.pk])).status_code, 404)
+
+        # Nothing is removed yet
+        self.assertEqual(tree_rows(self.project.pk)['subbranches'], 12)
+        self.assertTrue(trash.restore_project(self.project))
+        self.assertEqual(self.visible(), before)
+
+    def test_deleted_branch_disappears(self):
+        before = self.visible()
+        self.client.post(reverse('delete_branch', args=[self.branch.pk]))
+
+        after = self.visible()
+        self.assertEqual(len(before['search']), 3)
+        self.assertNotIn(self.branch.pk, after['api_branches'])
+        self.assertEqual(len(after['api_subbranches']), len(before['api_subbranches']) - 2)
+        self.assertEqual(after['portfolio'][self.other.pk], before['portfolio'][self.other.pk] - Decimal('42'))
+        self.assertEqual(after['search'], [(changefeed.KIND_PROJECT, self.project.pk)])
+        self.assertNotContains(self.client.get(reverse('project_details', args=[self.other.pk])), 'Scaffolding')
+        self.assertEqual(self.client.get(reverse('branch_history', args=[self.branch.pk])).status_code, 404)
+
+        self.assertTrue(trash.restore_branch(self.branch))
+        self.assertEqual(self.visible(), before)
+
+    def test_restore_only_within_the_undo_window(self):
+        trash.delete_project(self.project)
+        self.backdate(self.project)
+        self.assertFalse(trash.restore_project(self.project))
+        response = self.client.post(reverse('restore_project', args=[self.project.pk]), follow=True)
+        self.assertContains(response, 'This project can no longer be restored.')
+        self.assertIsNotNone(Project.all_objects.get(pk=self.project.pk).deleted_at)
+
+        trash.delete_branch(self.branch)
+        self.backdate(self.branch)
+        self.assertFalse(trash.restore_branch(self.branch))
+
+        # A branch of a deleted project waits for its project
+        branch = self.other.branches.exclude(pk=self.branch.pk).get()
+        trash.delete_branch(branch)
+        trash.delete_project(self.other)
+        self.assertFalse(trash.restore_branch(branch))
+        self.assertTrue(trash.restore_project(self.other))
+        self.assertTrue(trash.restore_branch(branch))
+
+    def test_branch_spending_leaves_the_project_rollups(self):
+        spending = project_spending(self.other)
+        branch_rows = SpendRollup.objects.filter(branch=self.branch).count()
+        self.assertEqual((spending[datetime.date(2024, 2, 2)], spending[datetime.date(2024, 2, 9)]),
+                         (Decimal('165.50'), Decimal('2.00')))
+
+        trash.delete_branch(self.branch)
+        hidden = project_spending(self.other)
+        self.assertEqual(hidden[datetime.date(2024, 2, 2)], Decimal('125.50'))
+        self.assertEqual(hidden[datetime.date(2024, 2, 9)], Decimal('0.00'))
+        self.assertEqual(SpendRollup.objects.filter(branch=self.branch).count(), branch_rows)
+
+        trash.restore_branch(self.branch)
+        self.assertEqual(project_spending(self.other), spending)
+
+    def test_purge_deleted_after_the_cutoff(self):
+        exports.render_export(load_project_snapshot(self.user, self.project.pk, branches=True))
+        exports.enqueue_export(self.project, self.user)
+        export_dir = exports.artifact_path(f'{exports.EXPORT_DIR}/{self.project.pk}')
+        archived = seed_project(self.user, branches=1, entries=1, releases=1, name='Tunnel')
+        archives.archive_project(archived)
+        for project in (self.project, archived):
+            trash.delete_project(project)
+        trash.delete_branch(self.branch)
+        deleted, kept = tree_rows(self.project.pk), tree_rows(self.other.pk)
+        self.assertEqual({**deleted, 'rollups': 0}, {
+            'project': 1, 'branches': 3, 'subbranches': 12, 'releases': 3, 'search': 16, 'rollups': 0, 'export_jobs': 1,
+        })
+        self.assertGreater(deleted['rollups'], 0)
+
+        out = StringIO()
+        call_command('purge_deleted', pause=0, stdout=out)
+        self.assertIn('Nothing to purge.', out.getvalue())
+        self.assertEqual(tree_rows(self.project.pk), deleted)
+        self.assertEqual(tree_rows(self.other.pk), kept)
+        self.assertTrue(any(export_dir.glob('v*.pdf')))
+        self.assertTrue(archives.archive_path(archived.pk).exists())
+
+        for obj in (self.project, archived, self.branch):
+            self.backdate(obj)
+        call_command('purge_deleted', pause=0, batch_size=2, stdout=out)
+        self.assertIn('Purged 3 deleted project(s) and branch(es).', out.getvalue())
+        for project in (self.project, archived):
+            self.assertEqual(set(tree_rows(project.pk).values()), {0})
+        self.assertFalse(export_dir.exists())
+        self.assertFalse(archives.archive_path(archived.pk).exists())
+
+        self.assertFalse(Branch.all_objects.filter(pk=self.branch.pk).exists())
+        self.assertEqual(SearchEntry.objects.filter(branch=self.branch.pk).count(), 0)
+        self.assertEqual(SpendRollup.objects.filter(branch=self.branch.pk).count(), 0)
+        left = tree_rows(self.other.pk)
+        # The branch, its two expenses and their search entries
+        self.assertEqual({**left, 'rollups': 0}, {
+            **kept, 'branches': kept['branches'] - 1, 'subbranches': kept['subbranches'] - 2,
+            'search': kept['search'] - 3, 'rollups': 0,
+        })
+        self.assertLess(left['rollups'], kept['rollups'])
+
+
+# ═══════════════════════════════════════════════════════════
+# RUNNING TOTALS
+# ═══════════════════════════════════════════════════════════
+class BranchTotalTests(TestCase):
+    """Branch.total_spent follows every SubBranch write through F() deltas."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.project = seed_project(self.user, branches=2, entries=3, releases=0)
+        self.low, self.high = self.project.branches.order_by('id')
+        self.entry = self.low.subbranches.order_by('id').first()
+
+    def assertTotalsMatch(self):
+        actual = dict(Branch.all_objects.filter(project=self.project).annotate(
+            actual=Coalesce(Sum('subbranches__amount'), Value(Decimal('0')), output_field=DecimalField()),
+        ).values_list('id', 'actual'))
+        stored = dict(Branch.all_objects.filter(project=self.project).values_list('id', 'total_spent'))
+        self.assertEqual(stored, actual)
+
+    def test_edit_change_move_and_delete(self):
+        self.entry.name = 'Renamed'
+        self.entry.save()
+        self.assertTotalsMatch()
+        self.assertEqual(Branch.objects.get(pk=self.low.pk).total_spent, Decimal('376.50'))
+
+        self.entry.amount = Decimal('300.25')
+        self.entry.save()
+        self.assertTotalsMatch()
+
+        self.entry.branch = self.high
+        self.entry.save()
+        self.assertTotalsMatch()
+        self.assertEqual(Branch.objects.get(pk=self.high.pk).total_spent, Decimal('676.75'))
+
+        self.entry.delete()
+        self.assertTotalsMatch()
+        self.assertEqual(Branch.objects.get(pk=self.high.pk).total_spent, Decimal('376.50'))
+
+    def test_stale_instance_applies_its_delta_to_the_stored_row(self):
+        first, second = SubBranch.objects.get(pk=self.entry.pk), SubBranch.objects.get(pk=self.entry.pk)
+        first.amount = Decimal('10')
+        first.save()
+        second.amount = Decimal('20')
+        second.save()
+        self.assertTotalsMatch()
+
+    def test_move_adjusts_the_lower_branch_id_first(self):
+        for target in (self.high, self.low):
+            with self.subTest(to=target.pk):
+                with mock.patch.object(rollups, 'adjust_branch_spent', wraps=rollups.adjust_branch_spent) as adjust:
+                    self.entry.branch = target
+                    self.entry.save()
+                self.assertEqual([call.args[0] for call in adjust.call_args_list], [self.low.pk, self.high.pk])
+                self.assertTotalsMatch()
+
+    def test_reconcile_dry_run_reports_drift_without_fixing_it(self):
+        Branch.all_objects.filter(pk=self.low.pk).update(total_spent=Decimal('1'))
+        version = Project.objects.get(pk=self.project.pk).content_version
+
+        out = StringIO()
+        call_command('reconcile_totals', '--dry-run', stdout=out)
+        self.assertIn(f'Branch {self.low.pk}: total_spent stored 1.00 != actual 376.50', out.getvalue())
+        self.assertIn('1 total(s) out of date.', out.getvalue())
+        self.assertEqual(Branch.objects.get(pk=self.low.pk).total_spent, Decimal('1'))
+        self.assertEqual(Project.objects.get(pk=self.project.pk).content_version, version)
+
+        out = StringIO()
+        call_command('reconcile_totals', stdout=out)
+        self.assertIn('Corrected 1 total(s).', out.getvalue())
+        self.assertTotalsMatch()
+        self.assertGreater(Project.objects.get(pk=self.project.pk).content_version, version)
+
+
+class ProjectReleasedTotalTests(TestCase):
+    """Project.total_released follows every ReleasedHistory write."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.project = seed_project(self.user, branches=0, entries=0, releases=2)
+        self.other = seed_project(self.user, branches=0, entries=0, releases=1, name='Canal')
+
+    def assertTotalsMatch(self):
+        for project in Project.all_objects.all():
+            actual = project.released_history.aggregate(total=Sum('amount'))['total'] or Decimal('0')
+            self.assertEqual(Project.all_objects.get(pk=project.pk).total_released, actual, project.name)
+
+    def test_create_edit_move_and_delete(self):
+        release = ReleasedHistory.objects.create(project=self.project, amount=Decimal('250'), date=datetime.date(2024, 4, 1))
+        self.assertTotalsMatch()
+        self.assertEqual(Project.objects.get(pk=self.project.pk).total_released, Decimal('10250'))
+
+        release.amount = Decimal('75.25')
+        release.save()
+        self.assertTotalsMatch()
+
+        release.project = self.other
+        release.save()
+        self.assertTotalsMatch()
+        self.assertEqual(Project.objects.get(pk=self.other.pk).total_released, Decimal('5075.25'))
+
+        release.delete()
+        self.assertTotalsMatch()
+        self.assertEqual(Project.objects.get(pk=self.other.pk).total_released, Decimal('5000'))
+
+    def test_stale_project_save_keeps_the_counters(self):
+        stale = Project.objects.get(pk=self.project.pk)
+        ReleasedHistory.objects.create(project=self.project, amount=Decimal('250'), date=datetime.date(2024, 4, 1))
+        version = Project.objects.get(pk=self.project.pk).content_version
+
+        stale.name = 'Renamed'
+        stale.save()
+        stored = Project.objects.get(pk=self.project.pk)
+        self.assertEqual(stored.name, 'Renamed')
+        self.assertEqual(stored.total_released, Decimal('10250'))
+        # Bumped by the save itself, not reset to the stale copy's value
+        self.assertEqual(stored.content_version, version + 1)
+        self.assertTotalsMatch()
+
+    def test_reconcile_corrects_total_released(self):
+        Project.all_objects.filter(pk=self.project.pk).update(total_released=Decimal('3'))
+        out = StringIO()
+        call_command('reconcile_totals', '--dry-run', stdout=out)
+        self.assertIn(f'Project {self.project.pk}: total_released stored 3.00 != actual 10000.00', out.getvalue())
+        call_command('reconcile_totals', stdout=StringIO())
+        self.assertTotalsMatch()
+
+
+# ═══════════════════════════════════════════════════════════
+# LOGIN
+# ═══════════════════════════════════════════════════════════
+@PLAIN_STATIC
+class EmailLoginTests(TestCase):
+    PASSWORD = 'correct horse battery'
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'Owner@Example.com', self.PASSWORD)
+
+    def test_mixed_case_email_in_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(authenticate(None, email=' OWNER@example.COM ', password=self.PASSWORD), self.user)
+        response = self.client.post(reverse('login'), {'email': 'owner@EXAMPLE.com', 'password': self.PASSWORD})
+        self.assertRedirects(response, reverse('welcome'))
+
+    def test_accounts_sharing_an_address(self):
+        # Older accounts, from before registration rejected duplicates
+        other = User.objects.create_user('other', 'owner@example.com', 'another password')
+        self.assertEqual(authenticate(None, email='owner@example.com', password=self.PASSWORD), self.user)
+        self.assertEqual(authenticate(None, email='owner@example.com', password='another password'), other)
+        self.assertIsNone(authenticate(None, email='owner@example.com', password='wrong'))
+
+        other.is_active = False
+        other.save()
+        self.assertIsNone(authenticate(None, email='owner@example.com', password='another password'))
+
+    def test_unknown_email(self):
+        with mock.patch.object(User, 'set_password', autospec=True) as set_password:
+            with self.assertNumQueries(1):
+                self.assertIsNone(authenticate(None, email='nobody@example.com', password=self.PASSWORD))
+        # The hasher still runs, so a missing account takes as long as a wrong password
+        set_password.assert_called_once_with(mock.ANY, self.PASSWORD)
+
+        response = self.client.post(reverse('login'), {'email': 'nobody@example.com', 'password': self.PASSWORD})
+        self.assertContains(response, 'Invalid email or password!')
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+
+# ═══════════════════════════════════════════════════════════
+# CSV IMPORT
+# ═══════════════════════════════════════════════════════════
+class ImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.project = seed_project(self.user, branches=1, entries=0, releases=0)
+        self.branch = self.project.branches.get()
+
+    def run_import(self, text, **kwargs):
+        data = text.encode() if isinstance(text, str) else text
+        return importers.import_subbranches(self.branch, BytesIO(data), **kwargs)
+
+    def test_header_errors(self):
+        for data, message in [
+            (b'', 'The file is empty.'),
+            (b'name,amount\nCement,10\n', 'Missing column(s): date'),
+            (b'Name,Cost,When\n', 'Missing column(s): amount, date'),
+            (b'\xff\xfename,amount,date\n', 'Could not read the file'),
+        ]:
+            with self.subTest(data=data), self.assertRaisesMessage(importers.ImportFormatError, message):
+                self.run_import(data)
+        self.assertFalse(SubBranch.objects.exists())
+
+    def test_rows_errors_and_blank_lines(self):
+        result = self.run_import(
+            '\ufeffDate, Amount ,Name,Note\n'
+            '2024-03-01,120.50,Cement,first\n'
+            '2024-03-02,lots,Sand,\n'
+            '\n'
+            ' , , \n'
+            '02/03/2024,5,Gravel,\n'
+            'not a date,,Bricks\n'
+            '2024-03-04,30,Steel\n',
+            batch_size=2,
+        )
+        # Lines 4 and 5 are blank and neither imported nor reported
+        self.assertEqual(result.errors, [
+            (3, 'amount: Enter a number.'),
+            (7, 'amount: This field is required.; date: Enter a valid date.'),
+        ])
+        self.assertEqual((result.created, result.error_count), (3, 2))
+        self.assertEqual(
+            list(self.branch.subbranches.order_by('id').values_list('name', 'amount', 'date')),
+            [('Cement', Decimal('120.50'), datetime.date(2024, 3, 1)),
+             ('Gravel', Decimal('5.00'), datetime.date(2024, 2, 3)),
+             ('Steel', Decimal('30.00'), datetime.date(2024, 3, 4))],
+        )
+        self.assertEqual(Branch.objects.get(pk=self.branch.pk).total_spent, Decimal('155.50'))
+
+    def test_ids_fetched_when_bulk_create_cannot_return_them(self):
+        features = type(connection.features)
+        with mock.patch.object(features, 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock,
+                               return_value=False):
+            result = self.run_import('name,amount,date\n' + ''.join(
+                f'Entry {n},{n},2024-03-01\n' for n in range(1, 6)
+            ), batch_size=2)
+        self.assertEqual(result.created, 5)
+
+        stored = dict(self.branch.subbranches.values_list('id', 'name'))
+        indexed = dict(SearchEntry.objects.filter(kind=changefeed.KIND_SUBBRANCH).values_list('object_id', 'name'))
+        self.assertEqual(indexed, stored)
+        logged = set(ChangeLog.objects.filter(kind=changefeed.KIND_SUBBRANCH).values_list('object_id', flat=True))
+        self.assertEqual(logged, set(stored))
+
+    def test_batches_commit_on_their_own(self):
+        # A decoding error well past the first read buffer, after several
+        # batches have gone in
+        rows = ''.join(f'Entry {n},1,2024-03-01\n' for n in range(600))
+        with self.assertRaisesMessage(importers.ImportFormatError, 'entries before it were imported') as caught:
+            self.run_import(b'name,amount,date\n' + rows.encode() + b'Bad \xff,1,2024-03-01\n', batch_size=100)
+        imported = self.branch.subbranches.count()
+        self.assertIn(f'The {imported} entries before it', str(caught.exception))
+        self.assertGreater(imported, 0)
+        self.assertEqual(imported % 100, 0)
+        self.assertEqual(Branch.objects.get(pk=self.branch.pk).total_spent, imported)
+
+    def test_import_view_reports_rows(self):
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile('expenses.csv', b'name,amount,date\nCement,10,2024-03-01\nSand,x,2024-03-02\n')
+        response = self.client.post(reverse('import_subbranches', args=[self.branch.pk]), {'file': upload})
+        self.assertRedirects(response, reverse('branch_history', args=[self.branch.pk]), fetch_redirect_response=False)
+        self.assertEqual([str(message) for message in get_messages(response.wsgi_request)],
+                         ['Imported 1 entries!', 'Line 3: amount: Enter a number.'])
+
+
+# ═══════════════════════════════════════════════════════════
+# CONDITIONAL GET
+# ═══════════════════════════════════════════════════════════
+@PLAIN_STATIC
+class ProjectEtagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.project = seed_project(self.user, branches=2, entries=2, releases=1)
+        self.branch = self.project.branches.first()
+        self.client.force_login(self.user)
+        # A fixed CSRF cookie, so the first GET does not differ from the next
+        # ones by the cookie it sets
+        self.client.cookies['csrftoken'] = 'a' * 32
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        return response['ETag']
+
+    def test_repeat_get_is_not_modified(self):
+        subbranch = self.branch.subbranches.first()
+        release = self.project.released_history.first()
+        for url in [
+            reverse('project_details', args=[self.project.id]),
+            reverse('released_history', args=[self.project.id]),
+            reverse('project_analytics', args=[self.project.id]),
+            reverse('new_branch', args=[self.project.id]),
+            reverse('branch_history', args=[self.branch.id]),
+            reverse('batch_subbranches', args=[self.branch.id]),
+            reverse('edit_subbranch', args=[subbranch.id]),
+            reverse('edit_released_history', args=[release.id]),
+        ]:
+            with self.subTest(url):
+                etag = self.etag(url)
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+                self.assertEqual(response.content, b'')
+                # Another page of the same project has its own tag
+                self.assertNotEqual(self.client.get(url + '?page=2', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_write_changes_the_etag(self):
+        url = reverse('branch_history', args=[self.branch.id])
+        etag = self.etag(url)
+        version = Project.objects.get(pk=self.project.pk).content_version
+
+        # A release is on another page, but bumps the whole project
+        ReleasedHistory.objects.create(project=self.project, amount=Decimal('10'), date=datetime.date(2024, 4, 1))
+        self.assertGreater(Project.objects.get(pk=self.project.pk).content_version, version)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_other_user_gets_another_etag(self):
+        url = reverse('project_details', args=[self.project.id])
+        etag = self.etag(url)
+
+        # Same path, same version, same CSRF cookie; only the user differs
+        other = User.objects.create_user('other', 'other@example.com', 'correct horse battery')
+        Project.all_objects.filter(pk=self.project.pk).update(user=other)
+        self.client.force_login(other)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # And nothing at all for a project that is not the user's
+        Project.all_objects.filter(pk=self.project.pk).update(user=self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_no_etag_while_messages_are_pending(self):
+        url = reverse('project_details', args=[self.project.id])
+        other = self.project.branches.last()
+        self.client.post(reverse('delete_branch', args=[other.id]))
+        pending = self.client.cookies['messages'].value
+
+        response = self.client.get(url)
+        self.assertContains(response, 'Branch and all entries deleted successfully!')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Cache-Control'))
+
+        # Once shown, the page is cacheable again and a 304 does not bring
+        # the message back
+        etag = self.etag(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # The same message pending again at the same version: the tag still
+        # matches, but the page has to be rendered to show it
+        self.client.cookies['messages'] = pending
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, reverse('restore_branch', args=[other.id]))
+        self.assertFalse(response.has_header('ETag'))
+
+
+# ═══════════════════════════════════════════════════════════
+# API
+# ═══════════════════════════════════════════════════════════
+class ApiTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.bridge = seed_project(self.user, branches=2, entries=3, releases=2, name='Bridge')
+        self.canal = seed_project(self.user, branches=2, entries=2, releases=1, name='Canal')
+        stranger = User.objects.create_user('stranger', 'stranger@example.com', 'correct horse battery')
+        self.foreign = seed_project(stranger, branches=1, entries=2, releases=1, name='Tunnel')
+        self.client.force_login(self.user)
+
+    def get(self, name, **params):
+        return self.client.get(reverse(name), params)
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()['results']]
+
+    def test_fields_limit_output_and_columns(self):
+        response = self.get('api_projects', fields='name, id,name')
+        self.assertEqual(response.json()['results'], [
+            {'name': 'Bridge', 'id': self.bridge.pk},
+            {'name': 'Canal', 'id': self.canal.pk},
+        ])
+
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.get('api_subbranches', fields='amount').json()['results']
+        self.assertEqual(rows[0], {'amount': '125.50'})
+        [select] = [query['sql'] for query in queries if 'FROM "projects_subbranch"' in query['sql']]
+        self.assertNotIn('"name"', select.split(' FROM ')[0])
+
+        response = self.get('api_projects', fields='id,owner,secret')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Unknown field(s): owner, secret')
+        self.assertEqual(response.json()['errors'], {'fields': list(api.PROJECT_FIELDS)})
+
+    def test_batch_by_parent(self):
+        bridge_branches = list(self.bridge.branches.order_by('id').values_list('id', flat=True))
+        canal_branch = self.canal.branches.first().pk
+        foreign_branch = self.foreign.branches.get().pk
+
+        self.assertEqual(
+            self.ids(self.get('api_subbranches', branch=f'{bridge_branches[1]},{canal_branch},{foreign_branch}')),
+            sorted(SubBranch.objects.filter(branch__in=[bridge_branches[1], canal_branch]).values_list('id', flat=True)),
+        )
+        self.assertEqual(
+            self.ids(self.get('api_subbranches', project=self.canal.pk)),
+            sorted(SubBranch.objects.filter(branch__project=self.canal).values_list('id', flat=True)),
+        )
+        self.assertEqual(
+            self.ids(self.get('api_branches', project=f'{self.bridge.pk},{self.foreign.pk}')),
+            bridge_branches,
+        )
+        self.assertEqual(
+            self.ids(self.get('api_releases', project=f'{self.canal.pk},{self.bridge.pk}')),
+            sorted(ReleasedHistory.objects.filter(project__user=self.user).values_list('id', flat=True)),
+        )
+        self.assertEqual(self.ids(self.get('api_releases', project=self.foreign.pk)), [])
+
+        # Pages follow on by id across parents
+        response = self.get('api_subbranches', project=f'{self.bridge.pk},{self.canal.pk}', page_size=4)
+        seen = self.ids(response)
+        while response.json()['next']:
+            response = self.client.get(response.json()['next'])
+            seen += self.ids(response)
+        self.assertEqual(seen, sorted(SubBranch.objects.filter(branch__project__user=self.user)
+                                      .values_list('id', flat=True)))
+
+        for value in ('1,x', ','.join(map(str, range(api.MAX_BATCH_IDS + 1)))):
+            with self.subTest(value=value[:10]):
+                self.assertEqual(self.get('api_branches', project=value).status_code, 400)
+
+    def test_conditional_get(self):
+        branch = self.bridge.branches.first()
+        url = reverse('api_subbranches') + f'?project={self.bridge.pk}'
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+
+        # One query for the versions (after the session and the user)
+        with self.assertNumQueries(3):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Another project changing does not matter, this one does
+        ReleasedHistory.objects.create(project=self.canal, amount=Decimal('1'), date=datetime.date(2024, 4, 1))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        SubBranch.objects.create(branch=branch, name='Rebar', amount=Decimal('4'), date=datetime.date(2024, 4, 1))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # The fields are part of the response, and so of the tag
+        self.assertEqual(self.client.get(url + '&fields=id', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        detail = reverse('api_project_detail', args=[self.bridge.pk])
+        etag = self.client.get(detail)['ETag']
+        self.assertEqual(self.client.get(detail, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_archived_project_is_read_only(self):
+        archives.archive_project(self.bridge)
+        branch = self.bridge.branches.first()
+        for name, data in [
+            ('api_branches', {'project_id': self.bridge.pk, 'name': 'Paint'}),
+            ('api_subbranches', {'branch_id': branch.pk, 'name': 'Paint', 'amount': '5', 'date': '2024-04-01'}),
+            ('api_releases', {'project_id': self.bridge.pk, 'amount': '5', 'date': '2024-04-01'}),
+        ]:
+            with self.subTest(name):
+                response = self.client.post(reverse(name), data, content_type='application/json')
+                self.assertEqual(response.status_code, 409)
+                self.assertEqual(response.json(), {'error': 'Project is archived and read-only.'})
+                data['project_id'] = self.canal.pk
+                data['branch_id'] = self.canal.branches.first().pk
+                self.assertEqual(
+                    self.client.post(reverse(name), data, content_type='application/json').status_code, 201,
+                )
+        self.assertEqual(self.bridge.branches.count(), 2)
+        self.assertEqual(self.ids(self.get('api_subbranches', project=self.bridge.pk)), [])
+
+
+# ═══════════════════════════════════════════════════════════
+# DELTA SYNC
+# ═══════════════════════════════════════════════════════════
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.project = seed_project(self.user, branches=2, entries=2, releases=2)
+        self.branch = self.project.branches.order_by('id').first()
+        self.client.force_login(self.user)
+
+    def sync(self, cursor, **params):
+        response = self.client.get(reverse('api_changes'), {'since': cursor, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def head(self):
+        response = self.client.get(reverse('api_changes'))
+        self.assertEqual(response.status_code, 200)
+        document = response.json()
+        self.assertEqual((document['changes'], document['has_more']), ([], False))
+        return document['cursor']
+
+    def test_head_cursor_without_since(self):
+        cursor = self.head()
+        self.assertEqual(cursor, encode_cursor([changefeed.head_cursor(self.user)]))
+        self.assertEqual(self.sync(cursor), {'changes': [], 'cursor': cursor, 'has_more': False})
+
+        # Other users' writes are not part of this user's feed
+        stranger = User.objects.create_user('stranger', 'stranger@example.com', 'correct horse battery')
+        seed_project(stranger)
+        self.assertEqual(self.head(), cursor)
+        self.assertEqual(self.sync(cursor)['changes'], [])
+
+        # A user without any entries starts from zero
+        self.client.force_login(User.objects.create_user('new', 'new@example.com', 'correct horse battery'))
+        self.assertEqual(self.head(), encode_cursor([0]))
+
+        self.assertEqual(self.client.get(reverse('api_changes'), {'since': 'garbage'}).status_code, 400)
+
+    def test_repeated_changes_collapse(self):
+        cursor = self.head()
+        subbranch = self.branch.subbranches.order_by('id').first()
+        for amount in ('10', '20', '30'):
+            subbranch.amount = Decimal(amount)
+            subbranch.save()
+        subbranch.name = 'Cement, final'
+        subbranch.save()
+
+        document = self.sync(cursor)
+        self.assertEqual([(change['kind'], change['id'], change['action']) for change in document['changes']], [
+            (changefeed.KIND_SUBBRANCH, subbranch.pk, changefeed.ACTION_UPSERT),
+            (changefeed.KIND_BRANCH, self.branch.pk, changefeed.ACTION_UPSERT),
+        ])
+        # The objects as they are now
+        self.assertEqual(document['changes'][0]['data']['name'], 'Cement, final')
+        self.assertEqual(document['changes'][0]['data']['amount'], '30.00')
+        self.assertEqual(document['changes'][1]['data']['total_spent'],
+                         str(Branch.objects.get(pk=self.branch.pk).total_spent))
+        self.assertEqual(document['cursor'], encode_cursor([changefeed.head_cursor(self.user)]))
+        self.assertEqual(self.sync(document['cursor'])['changes'], [])
+
+    def test_deletes_are_tombstones(self):
+        cursor = self.head()
+        added = SubBranch.objects.create(branch=self.branch, name='Rebar', amount=Decimal('4'),
+                                         date=datetime.date(2024, 4, 1))
+        added_id = added.pk
+        added.delete()
+        release = self.project.released_history.order_by('id').first()
+        release_id = release.pk
+        release.delete()
+        other = self.project.branches.order_by('id').last()
+        trash.delete_branch(other)
+
+        changes = self.sync(cursor)['changes']
+        tombstones = [change for change in changes if change['action'] == changefeed.ACTION_DELETE]
+        self.assertEqual(tombstones, [
+            # Inserted and deleted since the cursor: only the delete is sent
+            {'kind': changefeed.KIND_SUBBRANCH, 'id': added_id, 'action': changefeed.ACTION_DELETE},
+            {'kind': changefeed.KIND_RELEASE, 'id': release_id, 'action': changefeed.ACTION_DELETE},
+            # The branch stands for its expenses, which are not listed
+            {'kind': changefeed.KIND_BRANCH, 'id': other.pk, 'action': changefeed.ACTION_DELETE},
+        ])
+        self.assertEqual({(change['kind'], change['id']) for change in changes if change not in tombstones},
+                         {(changefeed.KIND_BRANCH, self.branch.pk), (changefeed.KIND_PROJECT, self.project.pk)})
+
+    def test_pages_follow_the_cursor(self):
+        cursor = self.head()
+        for subbranch in self.branch.subbranches.all():
+            subbranch.name += ' (checked)'
+            subbranch.save()
+        ReleasedHistory.objects.create(project=self.project, amount=Decimal('1'), date=datetime.date(2024, 4, 1))
+
+        whole = self.sync(cursor)['changes']
+        seen = []
+        document = {'cursor': cursor, 'has_more': True}
+        while document['has_more']:
+            document = self.sync(document['cursor'], page_size=2)
+            seen += [(change['kind'], change['id']) for change in document['changes']]
+        # An object changed on two pages is sent once on each
+        self.assertEqual(list(dict.fromkeys(seen)), [(change['kind'], change['id']) for change in whole])
+
+
+# ═══════════════════════════════════════════════════════════
+# SEARCH
+# ═══════════════════════════════════════════════════════════
+class SearchTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        # An owner token that "u<owner pk>" is a prefix of
+        self.stranger = User.objects.create_user('stranger', 'stranger@example.com', 'correct horse battery',
+                                                 id=int(f'{self.user.pk}1'))
+        self.project = seed_project(self.user, branches=0, entries=0, releases=0, name='Harbour wall')
+        self.branch = Branch.objects.create(project=self.project, name='Foundations')
+        self.cement = self.add(self.branch, 'Cement bags')
+        self.add(self.branch, 'Béton prêt')
+        self.other = seed_project(self.user, branches=0, entries=0, releases=0, name='Cemetery gates')
+        self.other_branch = Branch.objects.create(project=self.other, name='Ironwork')
+        self.add(self.other_branch, 'Cement')
+        foreign = seed_project(self.stranger, branches=0, entries=0, releases=0, name='Cement works')
+        self.add(Branch.objects.create(project=foreign, name='Cement'), 'Cement bags')
+
+    def add(self, branch, name):
+        return SubBranch.objects.create(branch=branch, name=name, amount=Decimal('10'), date=datetime.date(2024, 3, 1))
+
+    def found(self, text, user=None, **filters):
+        return sorted((entry.kind, entry.name) for entry in search.search(user or self.user, text, **filters))
+
+    def both_backends(self):
+        # The FTS5 index, and the icontains fallback used by other databases
+        yield 'fts5'
+        with mock.patch.object(connection, 'vendor', 'other'):
+            yield 'fallback'
+
+    def test_only_the_users_entries(self):
+        for backend in self.both_backends():
+            with self.subTest(backend):
+                self.assertEqual(self.found('cement'), [
+                    ('subbranch', 'Cement'), ('subbranch', 'Cement bags'),
+                ])
+                self.assertEqual(self.found('cement', user=self.stranger), [
+                    ('branch', 'Cement'), ('project', 'Cement works'), ('subbranch', 'Cement bags'),
+                ])
+
+    def test_words_match_as_prefixes(self):
+        self.assertEqual(self.found('CEM'), [
+            ('project', 'Cemetery gates'), ('subbranch', 'Cement'), ('subbranch', 'Cement bags'),
+        ])
+        # Every word has to match, in any order
+        self.assertEqual(self.found('bag ceme'), [('subbranch', 'Cement bags')])
+        self.assertEqual(self.found('cement wall'), [])
+        # Diacritics are folded
+        self.assertEqual(self.found('beton pret'), [('subbranch', 'Béton prêt')])
+        # FTS5 syntax in the query is only text
+        self.assertEqual(self.found('"cement" OR* NEAR(bags)'), [])
+        self.assertEqual(self.found('cem*'), self.found('cem'))
+        self.assertEqual(self.found('found', kind=changefeed.KIND_BRANCH), [('branch', 'Foundations')])
+        self.assertEqual(self.found('  ... '), [])
+
+    def test_index_follows_renames_and_deletes(self):
+        self.cement.name = 'Sand'
+        self.cement.save()
+        self.assertEqual(self.found('cement'), [('subbranch', 'Cement')])
+        self.assertEqual(self.found('sand'), [('subbranch', 'Sand')])
+        self.cement.delete()
+        self.assertEqual(self.found('sand'), [])
+
+    def test_deleted_and_archived_rows_are_left_out(self):
+        trash.delete_branch(self.other_branch)
+        for backend in self.both_backends():
+            with self.subTest(backend):
+                self.assertEqual(self.found('cem'), [('project', 'Cemetery gates'), ('subbranch', 'Cement bags')])
+        trash.delete_project(self.project)
+        for backend in self.both_backends():
+            with self.subTest(backend):
+                self.assertEqual(self.found('cem'), [('project', 'Cemetery gates')])
+
+        # The entries were kept, so a restore needs no reindexing
+        trash.restore_branch(Branch.all_objects.get(pk=self.other_branch.pk))
+        trash.restore_project(Project.all_objects.get(pk=self.project.pk))
+        self.assertEqual(self.found('cem'), [
+            ('project', 'Cemetery gates'), ('subbranch', 'Cement'), ('subbranch', 'Cement bags'),
+        ])
+
+        # Archived expenses leave the index; the project and branch stay
+        archives.archive_project(self.project)
+        self.assertEqual(self.found('cem'), [('project', 'Cemetery gates'), ('subbranch', 'Cement')])
+        self.assertEqual(self.found('found'), [('branch', 'Foundations')])
+
+
+# ═══════════════════════════════════════════════════════════
+# ANALYTICS
+# ═══════════════════════════════════════════════════════════
+class AnalyticsTests(TestCase):
+    """
+    A budget of 10,000 and, by month (branch A / B / released):
+
+        2024-01   100 /   - / 1000
+        2024-02   200 / 400 /    -
+        2024-03   350 /   - / 2000
+        2024-04     - / 600 /    -
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.project = Project.objects.create(user=self.user, name='Bridge', amount=Decimal('10000'),
+                                              start_date=datetime.date(2024, 1, 1))
+        self.a = Branch.objects.create(project=self.project, name='A')
+        self.b = Branch.objects.create(project=self.project, name='B')
+        for branch, day, amount in [
+            (self.a, (1, 10), '100'), (self.a, (2, 5), '200'), (self.a, (3, 20), '300'), (self.a, (3, 21), '50'),
+            (self.b, (2, 28), '400'), (self.b, (4, 2), '600'),
+        ]:
+            SubBranch.objects.create(branch=branch, name='Entry', amount=Decimal(amount),
+                                     date=datetime.date(2024, *day))
+        for day, amount in [((1, 2), '1000'), ((3, 1), '2000')]:
+            ReleasedHistory.objects.create(project=self.project, amount=Decimal(amount), date=datetime.date(2024, *day))
+
+    def test_monthly_series_carries_earlier_months(self):
+        with self.assertNumQueries(2):
+            series = analytics.monthly_series(self.project, datetime.date(2024, 2, 1), datetime.date(2024, 5, 1))
+        self.assertEqual(
+            [(m['month'].month, m['spent'], m['released'], m['cumulative_spent'], m['cumulative_released'])
+             for m in series],
+            [(2, 600, 0, 700, 1000),
+             (3, 350, 2000, 1050, 3000),
+             (4, 600, 0, 1650, 3000),
+             (5, 0, 0, 1650, 3000)],
+        )
+
+    def test_project_analytics(self):
+        data = analytics.project_analytics(self.project, datetime.date(2024, 2, 1), datetime.date(2024, 4, 1),
+                                           today=datetime.date(2024, 4, 15))
+        # (600 + 350 + 600) / 3, and the 8350 left at that rate
+        self.assertEqual(data['burn_rate'], Decimal('516.67'))
+        self.assertEqual(data['burn_rate_months'], 3)
+        self.assertEqual(data['runway_months'], Decimal('16.2'))
+        self.assertEqual((data['spent_to_date'], data['released_to_date'], data['unspent_budget']),
+                         (1650, 3000, 8350))
+
+        # Bars against the largest month (the 2000 release), running totals
+        # against the budget
+        self.assertEqual([(m['spent_pct'], m['released_pct'], m['cumulative_spent_pct']) for m in data['series']],
+                         [(30.0, 0, 7.0), (17.5, 100.0, 10.5), (30.0, 0, 16.5)])
+        self.assertEqual(data['budget_pct'], 100.0)
+
+        self.assertEqual([(row['branch__name'], row['total'], row['pct']) for row in data['branches']],
+                         [('B', 1000, 100.0), ('A', 550, 55.0)])
+
+        # The 30 days up to today
+        self.assertEqual((data['daily'][0]['day'], data['daily'][-1]['day']),
+                         (datetime.date(2024, 3, 17), datetime.date(2024, 4, 15)))
+        self.assertEqual({day['day'].isoformat(): (day['spent'], day['spent_pct'])
+                          for day in data['daily'] if day['spent']},
+                         {'2024-03-20': (300, 50.0), '2024-03-21': (50, 8.3), '2024-04-02': (600, 100.0)})
+
+    def test_no_runway_without_spending(self):
+        data = analytics.project_analytics(self.project, datetime.date(2024, 6, 1), datetime.date(2024, 8, 1),
+                                           today=datetime.date(2024, 8, 15))
+        self.assertEqual((data['burn_rate'], data['runway_months']), (0, None))
+        self.assertEqual(data['branches'], [])
+
+        # Spending past the budget leaves no runway either
+        SubBranch.objects.create(branch=self.a, name='Overrun', amount=Decimal('9000'), date=datetime.date(2024, 8, 1))
+        data = analytics.project_analytics(self.project, datetime.date(2024, 6, 1), datetime.date(2024, 8, 1),
+                                           today=datetime.date(2024, 8, 15))
+        self.assertEqual((data['burn_rate'], data['unspent_budget'], data['runway_months']),
+                         (3000, -650, None))
+
+    def test_month_range(self):
+        today = datetime.date(2024, 4, 15)
+        self.assertEqual(analytics.month_range(self.project, today=today),
+                         (datetime.date(2024, 1, 1), datetime.date(2024, 4, 1)))
+        self.assertEqual(analytics.month_range(self.project, first=datetime.date(2024, 5, 1),
+                                               last=datetime.date(2024, 3, 1), today=today),
+                         (datetime.date(2024, 3, 1), datetime.date(2024, 5, 1)))
+        first, last = analytics.month_range(self.project, first=datetime.date(2000, 1, 1), today=today)
+        self.assertEqual((first, last), (datetime.date(2014, 5, 1), datetime.date(2024, 4, 1)))
+        self.assertEqual(analytics.parse_month('2024-13'), None)
+
+    def test_deleted_branch_is_left_out(self):
+        trash.delete_branch(self.b)
+        data = analytics.project_analytics(self.project, datetime.date(2024, 2, 1), datetime.date(2024, 4, 1),
+                                           today=datetime.date(2024, 4, 15))
+        self.assertEqual([row['branch__name'] for row in data['branches']], ['A'])
+        self.assertEqual([m['spent'] for m in data['series']], [200, 350, 0])
+        self.assertEqual(data['spent_to_date'], 650)
+
+
+# ═══════════════════════════════════════════════════════════
+# PORTFOLIO
+# ═══════════════════════════════════════════════════════════
+@override_settings(CIVITRACK_CACHE_PORTFOLIO=False)
+class PortfolioTests(TestCase):
+    """
+    Four projects (budget / released / spent, utilisation):
+
+        Alpha   1000 /  500 /  600     60%
+        Beta    2000 / 2000 / 2500    125%
+        Gamma      0 /    0 /    0    none
+        Delta   4000 / 1000 /  200      5%   (and 1000 in a deleted branch)
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.projects = {}
+        for name, amount, released, spent in [
+            ('Alpha', '1000', '500', '600'), ('Beta', '2000', '2000', '2500'),
+            ('Gamma', '0', '0', '0'), ('Delta', '4000', '1000', '200'),
+        ]:
+            project = Project.objects.create(user=self.user, name=name, amount=Decimal(amount),
+                                             start_date=datetime.date(2024, 1, 1))
+            self.projects[name] = project
+            branch = Branch.objects.create(project=project, name='Works')
+            if Decimal(spent):
+                self.spend(branch, spent)
+            if Decimal(released):
+                ReleasedHistory.objects.create(project=project, amount=Decimal(released),
+                                               date=datetime.date(2024, 2, 1))
+        deleted = Branch.objects.create(project=self.projects['Delta'], name='Dropped')
+        self.spend(deleted, '1000')
+        trash.delete_branch(deleted)
+        # Another user's project never shows up
+        seed_project(User.objects.create_user('other', 'other@example.com', 'correct horse battery'))
+
+    def spend(self, branch, amount):
+        SubBranch.objects.create(branch=branch, name='Entry', amount=Decimal(amount), date=datetime.date(2024, 2, 1))
+
+    def names(self, sort=portfolio.DEFAULT_SORT, **filters):
+        return [row['name'] for row in portfolio.get_portfolio(self.user, sort, **filters)[0]]
+
+    def test_columns_and_totals(self):
+        rows, totals = portfolio.get_portfolio(self.user)
+        self.assertEqual(
+            {row['name']: (row['amount'], row['total_released'], row['spent'], row['remaining'], row['unspent'],
+                           row['utilisation']) for row in rows},
+            {'Alpha': (1000, 500, 600, 500, -100, 60.0),
+             'Beta': (2000, 2000, 2500, 0, -500, 125.0),
+             'Gamma': (0, 0, 0, 0, 0, None),
+             'Delta': (4000, 1000, 200, 3000, 800, 5.0)},
+        )
+        self.assertEqual(totals, {'amount': 7000, 'total_released': 3500, 'spent': 3300, 'remaining': 3500,
+                                  'unspent': 200, 'utilisation': 3300 * 100 / 7000, 'count': 4})
+
+    def test_sorting(self):
+        for sort, expected in [
+            ('-utilisation', ['Beta', 'Alpha', 'Delta', 'Gamma']),
+            # No utilisation sorts last both ways
+            ('utilisation', ['Delta', 'Alpha', 'Beta', 'Gamma']),
+            ('-spent', ['Beta', 'Alpha', 'Delta', 'Gamma']),
+            ('-remaining', ['Delta', 'Alpha', 'Beta', 'Gamma']),
+            ('unspent', ['Beta', 'Alpha', 'Gamma', 'Delta']),
+            ('-budget', ['Delta', 'Beta', 'Alpha', 'Gamma']),
+            ('name', ['Alpha', 'Beta', 'Delta', 'Gamma']),
+            # Unknown columns fall back to utilisation
+            ('owner', ['Delta', 'Alpha', 'Beta', 'Gamma']),
+        ]:
+            with self.subTest(sort):
+                self.assertEqual(self.names(sort), expected)
+
+    def test_filters(self):
+        for filters, expected in [
+            ({'q': 'ta'}, ['Beta', 'Delta']),
+            ({'status': 'over_budget'}, ['Beta']),
+            ({'status': 'overspent'}, ['Beta', 'Alpha']),
+            ({'status': 'pending_release'}, ['Alpha', 'Delta']),
+            ({'min_utilisation': 50}, ['Beta', 'Alpha']),
+            ({'min_utilisation': 5, 'max_utilisation': 60}, ['Alpha', 'Delta']),
+            ({'q': 'a', 'status': 'pending_release', 'max_utilisation': 10}, ['Delta']),
+        ]:
+            with self.subTest(**filters):
+                self.assertEqual(self.names(**filters), expected)
+        rows, totals = portfolio.get_portfolio(self.user, status='overspent')
+        self.assertEqual((totals['count'], totals['spent']), (2, 3100))
+
+    @override_settings(CIVITRACK_CACHE_PORTFOLIO=True)
+    def test_cache_follows_writes(self):
+        stamp = portfolio._stamp(self.user)
+        self.assertEqual(self.names(), ['Beta', 'Alpha', 'Delta', 'Gamma'])
+        # Only the stamp is read on a hit, and each filter has its own entry
+        with self.assertNumQueries(1):
+            self.assertEqual(self.names(), ['Beta', 'Alpha', 'Delta', 'Gamma'])
+        self.assertEqual(self.names(status='over_budget'), ['Beta'])
+
+        # An expense bumps the project's content_version
+        self.spend(self.projects['Delta'].branches.get(name='Works'), '3800')
+        self.assertNotEqual(portfolio._stamp(self.user), stamp)
+        self.assertEqual(self.names(), ['Beta', 'Delta', 'Alpha', 'Gamma'])
+        self.assertEqual(self.names(status='over_budget'), ['Beta'])
+
+        # A new project, and a deleted one
+        Project.objects.create(user=self.user, name='Epsilon', amount=Decimal('10'),
+                               start_date=datetime.date(2024, 1, 1))
+        self.assertEqual(self.names('name'), ['Alpha', 'Beta', 'Delta', 'Epsilon', 'Gamma'])
+        trash.delete_project(self.projects['Alpha'])
+        self.assertEqual(self.names('name'), ['Beta', 'Delta', 'Epsilon', 'Gamma'])
+
+
+# ═══════════════════════════════════════════════════════════
+# BATCH ENTRY
+# ═══════════════════════════════════════════════════════════
+@PLAIN_STATIC
+class BatchEntryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.project = seed_project(self.user, branches=1, entries=1, releases=0)
+        self.branch = self.project.branches.get()
+        self.url = reverse('batch_subbranches', args=[self.branch.id])
+        self.client.force_login(self.user)
+
+    def post(self, rows, total=10):
+        data = {
+            'entries-TOTAL_FORMS': str(total),
+            'entries-INITIAL_FORMS': '0',
+            'entries-MIN_NUM_FORMS': '1',
+            'entries-MAX_NUM_FORMS': '200',
+        }
+        for i, row in enumerate(rows):
+            for name, value in zip(('name', 'amount', 'date'), row):
+                data[f'entries-{i}-{name}'] = value
+        return self.client.post(self.url, data)
+
+    def test_blank_rows_are_ignored(self):
+        rows = [('Cement', '10.25', '2024-03-01'), ('', '', ''), ('Sand', '4', '2024-03-02')]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(rows)
+        self.assertRedirects(response, reverse('branch_history', args=[self.branch.id]),
+                             fetch_redirect_response=False)
+        self.assertEqual([str(message) for message in get_messages(response.wsgi_request)], ['Added 2 entries!'])
+        self.assertEqual(
+            list(self.branch.subbranches.order_by('id').values_list('name', 'amount')),
+            [('Entry 0', Decimal('125.50')), ('Cement', Decimal('10.25')), ('Sand', Decimal('4.00'))],
+        )
+
+        # One insert for the rows and one update of the branch total
+        sql = [query['sql'] for query in queries]
+        self.assertEqual(len([s for s in sql if s.startswith('INSERT INTO "projects_subbranch"')]), 1)
+        self.assertEqual(len([s for s in sql if s.startswith('UPDATE "projects_branch"')]), 1)
+        self.assertEqual(Branch.objects.get(pk=self.branch.pk).total_spent, Decimal('139.75'))
+        self.assertEqual(SearchEntry.objects.filter(branch=self.branch, kind=changefeed.KIND_SUBBRANCH).count(), 3)
+
+    def test_invalid_row_inserts_nothing(self):
+        version = Project.objects.get(pk=self.project.pk).content_version
+        response = self.post([('Cement', '10', '2024-03-01'), ('Sand', 'lots', '2024-03-02'), ('', '', '')])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Please correct the highlighted rows!')
+        formset = response.context['formset']
+        self.assertEqual([bool(form.errors) for form in formset][:3], [False, True, False])
+        # The rows come back as typed
+        self.assertContains(response, 'value="Cement"')
+        self.assertEqual(self.branch.subbranches.count(), 1)
+        stored = Project.objects.get(pk=self.project.pk)
+        self.assertEqual((stored.content_version, Branch.objects.get(pk=self.branch.pk).total_spent),
+                         (version, Decimal('125.50')))
+
+    def test_all_blank_is_refused(self):
+        response = self.post([])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['formset'].non_form_errors(), ['Please submit at least 1 form.'])
+        self.assertEqual(self.branch.subbranches.count(), 1)
+
+        response = self.post([('Cement', '1', '2024-03-01')], total=201)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.branch.subbranches.count(), 1)
+
+
+# ═══════════════════════════════════════════════════════════
+# PROJECT SUMMARIES
+# ═══════════════════════════════════════════════════════════
+@PLAIN_STATIC
+class SummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'correct horse battery')
+        self.project = seed_project(self.user, branches=2, entries=2, releases=1)
+        self.branch = self.project.branches.order_by('id').first()
+
+    def load(self):
+        return Project.objects.get(pk=self.project.pk)
+
+    def test_second_load_runs_no_query(self):
+        project = self.load()
+        summary = summaries.get_project_summary(project)
+        self.assertEqual(summary, {
+            'amount': Decimal('100000.00'),
+            'total_released': Decimal('5000.00'),
+            'total_branch_spent': Decimal('502.00'),
+            'remaining': Decimal('95000.00'),
+            'bottom_amount': Decimal('4498.00'),
+            'branch_count': 2,
+            'content_version': project.content_version,
+        })
+        with self.assertNumQueries(0):
+            self.assertEqual(summaries.get_project_summary(project), summary)
+
+    def test_write_invalidates_the_summary(self):
+        stale = self.load()
+        summaries.get_project_summary(stale)
+
+        SubBranch.objects.create(branch=self.branch, name='Rebar', amount=Decimal('98'), date=datetime.date(2024, 4, 1))
+        current = self.load()
+        self.assertGreater(current.content_version, stale.content_version)
+        with self.assertNumQueries(1):
+            summary = summaries.get_project_summary(current)
+        self.assertEqual((summary['total_branch_spent'], summary['bottom_amount']),
+                         (Decimal('600.00'), Decimal('4400.00')))
+        with self.assertNumQueries(0):
+            summaries.get_project_summary(current)
+
+        # A reader that loaded the project before a write and reads the
+        # figures after it: they are cached under the newer version only
+        SubBranch.objects.create(branch=self.branch, name='Ties', amount=Decimal('2'), date=datetime.date(2024, 4, 1))
+        before = self.load()
+        trash.delete_branch(self.project.branches.order_by('id').last())
+        with self.assertNumQueries(1):
+            summary = summaries.get_project_summary(before)
+        self.assertEqual((summary['total_branch_spent'], summary['branch_count']), (Decimal('351.00'), 1))
+        self.assertIsNone(cache.get(summaries.summary_key(self.project.pk, before.content_version)))
+        after = self.load()
+        with self.assertNumQueries(0):
+            self.assertEqual(summaries.get_project_summary(after), summary)
+
+    async def test_async_shares_the_cache(self):
+        project = await Project.objects.aget(pk=self.project.pk)
+        summary = await summaries.aget_project_summary(project)
+        self.assertEqual(await sync_to_async(summaries.get_project_summary)(project), summary)
+        self.assertIsNotNone(await cache.aget(summaries.summary_key(project.pk, project.content_version)))
+
+    def test_project_page_reuses_the_summary(self):
+        self.client.force_login(self.user)
+        url = reverse('project_details', args=[self.project.pk])
+
+        def aggregated(bottom_amount):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertContains(response, f'₹{bottom_amount}')
+            return any('SUM(' in query['sql'] for query in queries)
+
+        self.assertTrue(aggregated(4498))
+        self.assertFalse(aggregated(4498))
+        SubBranch.objects.create(branch=self.branch, name='Rebar', amount=Decimal('1'), date=datetime.date(2024, 4, 1))
+        self.assertTrue(aggregated(4497))
@@ -0,0 +1,190 @@
+"""
+Soft deletion of projects and branches, and the background purge.
+
+Deleting a project or branch with everything below it used to be one
+cascading ``DELETE`` inside the request, as slow as the tree is large. Now
+``delete_project`` and ``delete_branch`` only set ``deleted_at``, a single
+row update. The default managers (``Project.objects``, ``Branch.objects``)
+leave such rows out, and so, through them, do the pages, the API and the
+reports; the joins that reach entries or totals without going through those
+managers filter on ``deleted_at`` themselves.
+
+For ``CIVITRACK_UNDO_WINDOW`` seconds a deletion can be undone with
+``restore_project`` / ``restore_branch``. After that the ``purge_deleted``
+management command removes the rows for good, children first, a bounded
+batch per statement with a pause in between, so the database is never held
+by one huge cascade.
+
+Deletes and restores are logged to the change feed like any other write: a
+tombstone for the deleted object, and on restore an upsert of everything
+below it, since clients drop a deleted parent's children.
+"""
+import datetime
+import shutil
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import changefeed, rollups
+from .models import Branch, ExportJob, Project, ReleasedHistory, SearchEntry, SpendRollup, SubBranch
+
+
+PURGE_BATCH_SIZE = 1000
+
+
+def undo_cutoff(now=None):
+    """Rows deleted before this can no longer be restored, and may be purged."""
+    return (now or timezone.now()) - datetime.timedelta(seconds=settings.CIVITRACK_UNDO_WINDOW)
+
+
+# ═══════════════════════════════════════════════════════════
+# Delete and restore
+# ═══════════════════════════════════════════════════════════
+def delete_project(project):
+    """Hide a project with everything below it. Returns False if it was already deleted."""
+    now = timezone.now()
+    with transaction.atomic():
+        updated = Project.all_objects.filter(pk=project.pk, deleted_at__isnull=True).update(
+            deleted_at=now, content_version=F('content_version') + 1,
+        )
+        if not updated:
+            return False
+        changefeed.record_changes(
+            [(changefeed.KIND_PROJECT, changefeed.ACTION_DELETE, project.pk)],
+            project_id=project.pk, user_id=project.user_id,
+        )
+    project.deleted_at = now
+    return True
+
+
+def delete_branch(branch):
+    """Hide a branch with its entries. Returns False if it was already deleted."""
+    now = timezone.now()
+    with transaction.atomic():
+        if not Branch.all_objects.filter(pk=branch.pk, deleted_at__isnull=True).update(deleted_at=now):
+            return False
+        rollups.hide_branch_spending(branch.project_id, branch.pk)
+        rollups.bump_project_version(branch.project_id)
+        changefeed.record_changes(
+            [(changefeed.KIND_BRANCH, changefeed.ACTION_DELETE, branch.pk)],
+            project_id=branch.project_id,
+        )
+    branch.deleted_at = now
+    return True
+
+
+def _upserts(kind, ids):
+    return [(kind, changefeed.ACTION_UPSERT, pk) for pk in ids.iterator(chunk_size=PURGE_BATCH_SIZE)]
+
+
+def restore_project(project):
+    """Undo ``delete_project``. Returns False once the undo window has passed."""
+    with transaction.atomic():
+        if not Project.all_objects.filter(pk=project.pk, deleted_at__gt=undo_cutoff()).update(
+            deleted_at=None, content_version=F('content_version') + 1,
+        ):
+            return False
+        branches = Branch.objects.filter(project=project).values_list('pk', flat=True)
+        changefeed.record_changes(
+            [(changefeed.KIND_PROJECT, changefeed.ACTION_UPSERT, project.pk)]
+            + _upserts(changefeed.KIND_BRANCH, branches)
+            + _upserts(changefeed.KIND_SUBBRANCH,
+                       SubBranch.objects.active().filter(branch__project=project).values_list('pk', flat=True))
+            + _upserts(changefeed.KIND_RELEASE,
+                       ReleasedHistory.objects.filter(project=project).values_list('pk', flat=True)),
+            project_id=project.pk, user_id=project.user_id,
+        )
+    project.deleted_at = None
+    return True
+
+
+def restore_branch(branch):
+    """
+    Undo ``delete_branch``. Returns False once the undo window has passed, or
+    while the branch's project is itself deleted.
+    """
+    with transaction.atomic():
+        if not Branch.all_objects.filter(
+            pk=branch.pk, deleted_at__gt=undo_cutoff(), project__deleted_at__isnull=True,
+        ).update(deleted_at=None):
+            return False
+        rollups.hide_branch_spending(branch.project_id, branch.pk, hidden=False)
+        rollups.bump_project_version(branch.project_id)
+        changefeed.record_changes(
+            [(changefeed.KIND_BRANCH, changefeed.ACTION_UPSERT, branch.pk)]
+            + _upserts(changefeed.KIND_SUBBRANCH,
+                       SubBranch.objects.filter(branch=branch).values_list('pk', flat=True)),
+            project_id=branch.project_id,
+        )
+    branch.deleted_at = None
+    return True
+
+
+# ═══════════════════════════════════════════════════════════
+# Purge
+# ═══════════════════════════════════════════════════════════
+def _delete_in_batches(queryset, batch_size, pause):
+    # Each batch is its own short statement and transaction; the rows are
+    # already hidden, so nobody sees a half-purged tree
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        queryset.model._base_manager.filter(pk__in=ids).delete()
+        deleted += len(ids)
+        if pause:
+            time.sleep(pause)
+
+
+def _purge_rows(branch_ids, project_id, batch_size, pause):
+    # Everything below the given branches (and, with a project_id, the
+    # project's own rows) except the branches and project themselves
+    deleted = 0
+    querysets = [
+        SubBranch.objects.filter(branch__in=branch_ids),
+        SearchEntry.objects.filter(branch__in=branch_ids),
+        SpendRollup.objects.filter(branch__in=branch_ids),
+    ]
+    if project_id is not None:
+        querysets += [
+            ReleasedHistory.objects.filter(project_id=project_id),
+            SearchEntry.objects.filter(project_id=project_id),
+            SpendRollup.objects.filter(project_id=project_id),
+            ExportJob.objects.filter(project_id=project_id),
+        ]
+    for queryset in querysets:
+        deleted += _delete_in_batches(queryset, batch_size, pause)
+    return deleted
+
+
+def purge_branch(branch, batch_size=PURGE_BATCH_SIZE, pause=0):
+    """Remove a deleted branch and its rows for good; returns the number of rows deleted."""
+    deleted = _purge_rows([branch.pk], None, batch_size, pause)
+    deleted += Branch.all_objects.filter(pk=branch.pk, deleted_at__isnull=False).delete()[0]
+    return deleted
+
+
+def purge_project(project, batch_size=PURGE_BATCH_SIZE, pause=0):
+    """Remove a deleted project with its whole tree for good; returns the number of rows deleted."""
+    from . import archives, exports
+
+    branch_ids = Branch.all_objects.filter(project_id=project.pk).values_list('pk', flat=True)
+    deleted = _purge_rows(branch_ids, project.pk, batch_size, pause)
+    deleted += _delete_in_batches(Branch.all_objects.filter(project_id=project.pk), batch_size, pause)
+    deleted += Project.all_objects.filter(pk=project.pk, deleted_at__isnull=False).delete()[0]
+    shutil.rmtree(exports.artifact_path(f'{exports.EXPORT_DIR}/{project.pk}'), ignore_errors=True)
+    archives.archive_path(project.pk).unlink(missing_ok=True)
+    return deleted
+
+
+def purgeable(model, cutoff=None):
+    """Deleted projects or branches whose undo window has closed (by ``cutoff``)."""
+    queryset = model.all_objects.filter(deleted_at__lt=cutoff or undo_cutoff()).order_by('deleted_at', 'id')
+    if model is Branch:
+        # Those go with their project
+        queryset = queryset.filter(project__deleted_at__isnull=True)
+    return queryset
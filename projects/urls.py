@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     # Authentication
@@ -13,15 +13,25 @@ urlpatterns = [
     # Projects
     path('projects/', views.project_list, name='project_list'),
     path('projects/new/', views.new_project, name='new_project'),
+    path('projects/portfolio/', views.portfolio_view, name='portfolio'),
+    path('search/', views.search_view, name='search'),
     path('projects/<int:project_id>/', views.project_details, name='project_details'),
     path('projects/<int:project_id>/delete/', views.delete_project, name='delete_project'),
+    path('projects/<int:project_id>/restore/', views.restore_project, name='restore_project'),
     path('projects/<int:project_id>/history/', views.released_history, name='released_history'),
+    path('projects/<int:project_id>/analytics/', views.project_analytics, name='project_analytics'),
     path('projects/<int:project_id>/export-pdf/', views.export_project_pdf, name='export_project_pdf'),
+    path('projects/<int:project_id>/export-pdf/jobs/', views.start_export_job, name='start_export_job'),
+    path('export-jobs/<int:job_id>/', views.export_job_status, name='export_job_status'),
+    path('export-jobs/<int:job_id>/download/', views.export_job_download, name='export_job_download'),
     
     # Branches
     path('projects/<int:project_id>/branches/new/', views.new_branch, name='new_branch'),
     path('branches/<int:branch_id>/delete/', views.delete_branch, name='delete_branch'),
+    path('branches/<int:branch_id>/restore/', views.restore_branch, name='restore_branch'),
     path('branches/<int:branch_id>/history/', views.branch_history, name='branch_history'),
+    path('branches/<int:branch_id>/batch/', views.batch_subbranches, name='batch_subbranches'),
+    path('branches/<int:branch_id>/import/', views.import_subbranches, name='import_subbranches'),
     
     # Released History
     path('released/<int:history_id>/edit/', views.edit_released_history, name='edit_released_history'),
@@ -30,4 +40,16 @@ urlpatterns = [
     # Sub-Branches
     path('subbranches/<int:subbranch_id>/edit/', views.edit_subbranch, name='edit_subbranch'),
     path('subbranches/<int:subbranch_id>/delete/', views.delete_subbranch, name='delete_subbranch'),
+    
+    # Staff
+    path('stats/requests/', views.request_stats, name='request_stats'),
+    
+    # JSON API
+    path('api/v1/session/', api.session, name='api_session'),
+    path('api/v1/projects/', api.projects, name='api_projects'),
+    path('api/v1/projects/<int:project_id>/', api.project_detail, name='api_project_detail'),
+    path('api/v1/branches/', api.branches, name='api_branches'),
+    path('api/v1/subbranches/', api.subbranches, name='api_subbranches'),
+    path('api/v1/releases/', api.releases, name='api_releases'),
+    path('api/v1/changes/', api.changes, name='api_changes'),
 ]
@@ -1,19 +1,65 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import os
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.models import User
+from django.contrib.auth.views import redirect_to_login
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import JsonResponse, HttpResponse, FileResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import content_disposition_header
 from django.views.decorators.http import require_POST
-from datetime import datetime
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-from reportlab.lib import colors
-from .models import Project, Branch, SubBranch, ReleasedHistory
+from .models import Project, Branch, SubBranch, ReleasedHistory, ExportJob
 from .forms import (UserRegisterForm, UserLoginForm, ProjectForm, 
-                    BranchForm, SubBranchForm, ReleasedHistoryForm)
+                    BranchForm, SubBranchForm, SubBranchBatchFormSet, SubBranchImportForm,
+                    ReleasedHistoryForm, PortfolioFilterForm, SearchForm)
+from . import analytics, archives, exports, importers, middleware, portfolio, reports, search, trash
+from .conditional import project_etag
+from .pagination import apaginate, page_size_from, paginate_rows
+from .snapshots import aload_project_snapshot, load_project_snapshot
+from .summaries import aget_project_summary
+
+
+# Keyset orderings; each matches a composite index (see models.py)
+PROJECT_ORDERING = ('created_at', 'id')
+HISTORY_ORDERING = ('-date', '-id')
+
+
+# ═══════════════════════════════════════════════════════════
+# ASYNC VIEW HELPERS
+# ═══════════════════════════════════════════════════════════
+# The read-heavy pages below are async views: under ASGI (civitrack/asgi.py)
+# they wait for the database without holding a worker thread. Their POST
+# handling stays synchronous and runs through sync_to_async, as does template
+# rendering, which may still touch the session and the lazy request.user.
+def async_login_required(view):
+    # login_required only wraps sync views in Django 5.0
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+arender = sync_to_async(render)
+
+
+def _read_only(request, project):
+    # Archived projects (projects.archives) cannot be changed; the caller
+    # redirects back when this returns True
+    if project.archived_at is None:
+        return False
+    messages.error(request, 'This project is archived and read-only.')
+    return True
 
 
 # ═══════════════════════════════════════════════════════════
@@ -29,16 +75,13 @@ def login_view(request):
             email = form.cleaned_data['email']
             password = form.cleaned_data['password']
             
-            try:
-                user = User.objects.get(email=email)
-                user_auth = authenticate(request, username=user.username, password=password)
-                if user_auth is not None:
-                    login(request, user_auth)
-                    return redirect('welcome')
-                else:
-                    messages.error(request, 'Invalid email or password!')
-            except User.DoesNotExist:
-                messages.error(request, 'User not found!')
+            # Resolved by projects.backends.EmailBackend in one indexed query
+            user = authenticate(request, email=email, password=password)
+            if user is not None:
+                login(request, user)
+                return redirect('welcome')
+            else:
+                messages.error(request, 'Invalid email or password!')
     else:
         form = UserLoginForm()
     
@@ -79,10 +122,67 @@ def welcome_view(request):
 # ═══════════════════════════════════════════════════════════
 # PAGE 4 — PROJECT LIST
 # ═══════════════════════════════════════════════════════════
+@async_login_required
+async def project_list(request):
+    user = await request.auser()
+    page = await apaginate(
+        user.projects.all(),
+        PROJECT_ORDERING,
+        cursor=request.GET.get('after'),
+        page_size=page_size_from(request),
+    )
+    context = {
+        'projects': page.items,
+        'page': page,
+        'async_exports': settings.ASYNC_PDF_EXPORTS,
+    }
+    return await arender(request, 'project_list.html', context)
+
+
+# ═══════════════════════════════════════════════════════════
+# PORTFOLIO
+# ═══════════════════════════════════════════════════════════
 @login_required
-def project_list(request):
-    projects = request.user.projects.all()
-    return render(request, 'project_list.html', {'projects': projects})
+def portfolio_view(request):
+    filter_form = PortfolioFilterForm(request.GET or None)
+    rows, totals = portfolio.get_portfolio(request.user, **filter_form.portfolio_options())
+    
+    context = {
+        'filter_form': filter_form,
+        'rows': rows,
+        'totals': totals,
+    }
+    return render(request, 'portfolio.html', context)
+
+
+# ═══════════════════════════════════════════════════════════
+# SEARCH
+# ═══════════════════════════════════════════════════════════
+@login_required
+def search_view(request):
+    form = SearchForm(request.GET or None)
+    results = None
+    if form.is_valid() and form.cleaned_data['q']:
+        try:
+            page = int(request.GET.get('page', 1))
+        except ValueError:
+            page = 1
+        results = search.search(request.user, form.cleaned_data['q'], page=page,
+                                page_size=page_size_from(request),
+                                kind=form.cleaned_data['kind'],
+                                min_amount=form.cleaned_data['min_amount'],
+                                max_amount=form.cleaned_data['max_amount'],
+                                date_from=form.cleaned_data['date_from'],
+                                date_to=form.cleaned_data['date_to'])
+    
+    params = request.GET.copy()
+    params.pop('page', None)
+    context = {
+        'form': form,
+        'results': results,
+        'query_string': params.urlencode(),
+    }
+    return render(request, 'search.html', context)
 
 
 # ═══════════════════════════════════════════════════════════
@@ -107,59 +207,86 @@ def new_project(request):
 # ═══════════════════════════════════════════════════════════
 # PAGE 6 — PROJECT DETAILS
 # ═══════════════════════════════════════════════════════════
-@login_required
-def project_details(request, project_id):
-    project = get_object_or_404(Project, id=project_id, user=request.user)
-    
+@async_login_required
+@project_etag
+async def project_details(request, project_id):
     if request.method == 'POST':
-        if 'action' in request.POST:
-            if request.POST['action'] == 'update_amount':
-                try:
-                    new_amount = float(request.POST.get('amount', 0))
-                    project.amount = new_amount
-                    project.save()
-                    messages.success(request, 'Project amount updated!')
-                except:
-                    messages.error(request, 'Invalid amount!')
-            
-            elif request.POST['action'] == 'release_amount':
-                form = ReleasedHistoryForm(request.POST)
-                if form.is_valid():
-                    release = form.save(commit=False)
-                    release.project = project
-                    release.save()
-                    messages.success(request, 'Amount released successfully!')
-                else:
-                    messages.error(request, 'Please fill all fields!')
-        
-        return redirect('project_details', project_id=project_id)
+        return await sync_to_async(_project_details_post)(request, project_id)
     
-    form = ReleasedHistoryForm()
-    branches = project.branches.all()
-    total_branch_spent = sum(b.total_spent for b in branches)
-    remaining = project.amount - project.total_released
-    bottom_amount = project.total_released - total_branch_spent
+    user = await request.auser()
+    project = await aload_project_snapshot(user, project_id, branches=True)
+    summary = await aget_project_summary(project)
     
     context = {
         'project': project,
-        'form': form,
-        'branches': branches,
-        'total_branch_spent': total_branch_spent,
-        'remaining': remaining,
-        'bottom_amount': bottom_amount,
+        'form': ReleasedHistoryForm(),
+        # Prefetched by the snapshot
+        'branches': project.branches.all(),
+        'total_branch_spent': summary['total_branch_spent'],
+        'remaining': summary['remaining'],
+        'bottom_amount': summary['bottom_amount'],
     }
-    return render(request, 'project_details.html', context)
+    return await arender(request, 'project_details.html', context)
+
+
+def _project_details_post(request, project_id):
+    project = load_project_snapshot(request.user, project_id)
+    if _read_only(request, project):
+        return redirect('project_details', project_id=project_id)
+    
+    if 'action' in request.POST:
+        if request.POST['action'] == 'update_amount':
+            try:
+                new_amount = float(request.POST.get('amount', 0))
+                project.amount = new_amount
+                project.save(update_fields=['amount'])
+                messages.success(request, 'Project amount updated!')
+            except:
+                messages.error(request, 'Invalid amount!')
+        
+        elif request.POST['action'] == 'release_amount':
+            form = ReleasedHistoryForm(request.POST)
+            if form.is_valid():
+                release = form.save(commit=False)
+                release.project = project
+                release.save()
+                messages.success(request, 'Amount released successfully!')
+            else:
+                messages.error(request, 'Please fill all fields!')
+    
+    return redirect('project_details', project_id=project_id)
 
 
 # ═══════════════════════════════════════════════════════════
 # DELETE PROJECT
 # ═══════════════════════════════════════════════════════════
+def _undo_message(request, text, restore_url):
+    # A flash message with its own POST form (and CSRF token) to restore
+    return render_to_string('undo_message.html', {'text': text, 'action': restore_url}, request)
+
+
 @login_required
 @require_POST
 def delete_project(request, project_id):
     project = get_object_or_404(Project, id=project_id, user=request.user)
-    project.delete()
-    messages.success(request, 'Project deleted successfully!')
+    
+    # Only hidden for now; purge_deleted removes the rows later
+    trash.delete_project(project)
+    
+    messages.success(request, _undo_message(
+        request, 'Project deleted successfully!', reverse('restore_project', args=[project.id]),
+    ))
+    return redirect('project_list')
+
+
+@login_required
+@require_POST
+def restore_project(request, project_id):
+    project = get_object_or_404(Project.all_objects, id=project_id, user=request.user, deleted_at__isnull=False)
+    if trash.restore_project(project):
+        messages.success(request, 'Project restored!')
+        return redirect('project_details', project_id=project.id)
+    messages.error(request, 'This project can no longer be restored.')
     return redirect('project_list')
 
 
@@ -167,8 +294,11 @@ def delete_project(request, project_id):
 # PAGE 7 — NEW BRANCH
 # ═══════════════════════════════════════════════════════════
 @login_required
+@project_etag
 def new_branch(request, project_id):
     project = get_object_or_404(Project, id=project_id, user=request.user)
+    if _read_only(request, project):
+        return redirect('project_details', project_id=project_id)
     
     if request.method == 'POST':
         form = BranchForm(request.POST)
@@ -190,74 +320,176 @@ def new_branch(request, project_id):
 @login_required
 @require_POST
 def delete_branch(request, branch_id):
-    branch = get_object_or_404(Branch, id=branch_id, project__user=request.user)
-    project = branch.project
-    project_id = project.id
-    
-    # Delete the branch (this will trigger SubBranch deletion via CASCADE)
-    branch.delete()
+    branch = get_object_or_404(Branch.objects.select_related('project'), id=branch_id, project__user=request.user)
+    project_id = branch.project_id
+    if _read_only(request, branch.project):
+        return redirect('project_details', project_id=project_id)
     
-    # Recalculate project totals
-    project.total_released = sum(rh.amount for rh in project.released_history.all())
-    project.save()
+    # Hide the branch with its entries; purge_deleted removes them later.
+    # Releases belong to the project, so total_released is unaffected.
+    trash.delete_branch(branch)
     
-    messages.success(request, 'Branch and all entries deleted successfully!')
+    messages.success(request, _undo_message(
+        request, 'Branch and all entries deleted successfully!', reverse('restore_branch', args=[branch.id]),
+    ))
     return redirect('project_details', project_id=project_id)
 
 
+@login_required
+@require_POST
+def restore_branch(request, branch_id):
+    branch = get_object_or_404(Branch.all_objects, id=branch_id, project__user=request.user, deleted_at__isnull=False)
+    if trash.restore_branch(branch):
+        messages.success(request, 'Branch restored!')
+        return redirect('branch_history', branch_id=branch.id)
+    messages.error(request, 'This branch can no longer be restored.')
+    return redirect('project_details', project_id=branch.project_id)
+
+
 # ═══════════════════════════════════════════════════════════
 # PAGE 8 — BRANCH HISTORY (Sub-Branches)
 # ═══════════════════════════════════════════════════════════
-@login_required
-def branch_history(request, branch_id):
-    branch = get_object_or_404(Branch, id=branch_id, project__user=request.user)
-    project = branch.project
-    
+@async_login_required
+@project_etag
+async def branch_history(request, branch_id):
     if request.method == 'POST':
-        if 'action' in request.POST:
-            if request.POST['action'] == 'add':
-                form = SubBranchForm(request.POST)
-                if form.is_valid():
-                    subbranch = form.save(commit=False)
-                    subbranch.branch = branch
-                    subbranch.save()
-                    messages.success(request, 'Sub-branch added successfully!')
-                else:
-                    messages.error(request, 'Please fill all fields!')
-            
-            elif request.POST['action'] == 'update_name':
-                try:
-                    new_name = request.POST.get('name', '')
-                    if new_name:
-                        branch.name = new_name
-                        branch.save()
-                        messages.success(request, 'Branch name updated!')
-                    else:
-                        messages.error(request, 'Branch name cannot be empty!')
-                except:
-                    messages.error(request, 'Error updating branch name!')
+        return await sync_to_async(_branch_history_post)(request, branch_id)
+    
+    user = await request.auser()
+    branch = await aget_object_or_404(Branch.objects.select_related('project'), id=branch_id, project__user=user)
+    if branch.project.archived_at:
+        page = await sync_to_async(paginate_rows)(
+            archives.branch_subbranches(branch),
+            SubBranch,
+            HISTORY_ORDERING,
+            cursor=request.GET.get('after'),
+            page_size=page_size_from(request),
+        )
+    else:
+        page = await apaginate(
+            branch.subbranches.all(),
+            HISTORY_ORDERING,
+            cursor=request.GET.get('after'),
+            page_size=page_size_from(request),
+        )
+    
+    context = {
+        'branch': branch,
+        'project': branch.project,
+        'form': SubBranchForm(),
+        'import_form': SubBranchImportForm(),
+        'subbranches': page.items,
+        'page': page,
+    }
+    return await arender(request, 'branch_history.html', context)
+
+
+def _branch_history_post(request, branch_id):
+    branch = get_object_or_404(Branch.objects.select_related('project'), id=branch_id, project__user=request.user)
+    if _read_only(request, branch.project):
+        return redirect('branch_history', branch_id=branch_id)
+    
+    if 'action' in request.POST:
+        if request.POST['action'] == 'add':
+            form = SubBranchForm(request.POST)
+            if form.is_valid():
+                subbranch = form.save(commit=False)
+                subbranch.branch = branch
+                subbranch.save()
+                messages.success(request, 'Sub-branch added successfully!')
+            else:
+                messages.error(request, 'Please fill all fields!')
         
+        elif request.POST['action'] == 'update_name':
+            try:
+                new_name = request.POST.get('name', '')
+                if new_name:
+                    branch.name = new_name
+                    branch.save(update_fields=['name'])
+                    messages.success(request, 'Branch name updated!')
+                else:
+                    messages.error(request, 'Branch name cannot be empty!')
+            except:
+                messages.error(request, 'Error updating branch name!')
+    
+    return redirect('branch_history', branch_id=branch_id)
+
+
+# ═══════════════════════════════════════════════════════════
+# BATCH ENTRY (many sub-branches in one submit)
+# ═══════════════════════════════════════════════════════════
+@login_required
+@project_etag
+def batch_subbranches(request, branch_id):
+    branch = get_object_or_404(Branch.objects.select_related('project'), id=branch_id, project__user=request.user)
+    if _read_only(request, branch.project):
         return redirect('branch_history', branch_id=branch_id)
     
-    form = SubBranchForm()
-    subbranches = branch.subbranches.all()
+    if request.method == 'POST':
+        formset = SubBranchBatchFormSet(request.POST, prefix='entries')
+        if formset.is_valid():
+            entries = [form.save(commit=False) for form in formset if form.has_changed()]
+            with transaction.atomic():
+                created = importers.bulk_insert_subbranches(branch, entries)
+            messages.success(request, f'Added {created} entries!')
+            return redirect('branch_history', branch_id=branch_id)
+        messages.error(request, 'Please correct the highlighted rows!')
+    else:
+        formset = SubBranchBatchFormSet(prefix='entries')
     
     context = {
         'branch': branch,
-        'project': project,
-        'form': form,
-        'subbranches': subbranches,
+        'project': branch.project,
+        'formset': formset,
     }
-    return render(request, 'branch_history.html', context)
+    return render(request, 'batch_subbranches.html', context)
+
+
+# ═══════════════════════════════════════════════════════════
+# IMPORT SUB-BRANCHES (CSV)
+# ═══════════════════════════════════════════════════════════
+# Number of row errors shown as messages after an import
+IMPORT_ERRORS_SHOWN = 10
+
+
+@login_required
+@require_POST
+def import_subbranches(request, branch_id):
+    branch = get_object_or_404(Branch.objects.select_related('project'), id=branch_id, project__user=request.user)
+    if _read_only(request, branch.project):
+        return redirect('branch_history', branch_id=branch_id)
+    form = SubBranchImportForm(request.POST, request.FILES)
+    
+    if not form.is_valid():
+        messages.error(request, 'Please choose a CSV file to import!')
+        return redirect('branch_history', branch_id=branch_id)
+    
+    try:
+        result = importers.import_subbranches(branch, form.cleaned_data['file'])
+    except importers.ImportFormatError as exc:
+        messages.error(request, f'Import failed: {exc}')
+        return redirect('branch_history', branch_id=branch_id)
+    
+    messages.success(request, f'Imported {result.created} entries!')
+    for line, error in result.errors[:IMPORT_ERRORS_SHOWN]:
+        messages.error(request, f'Line {line}: {error}')
+    if result.error_count > IMPORT_ERRORS_SHOWN:
+        messages.error(request, f'...and {result.error_count - IMPORT_ERRORS_SHOWN} more rows skipped.')
+    
+    return redirect('branch_history', branch_id=branch_id)
 
 
 # ═══════════════════════════════════════════════════════════
 # EDIT SUB-BRANCH
 # ═══════════════════════════════════════════════════════════
 @login_required
+@project_etag
 def edit_subbranch(request, subbranch_id):
-    subbranch = get_object_or_404(SubBranch, id=subbranch_id, branch__project__user=request.user)
+    subbranch = get_object_or_404(SubBranch.objects.active().select_related('branch__project'),
+                                  id=subbranch_id, branch__project__user=request.user)
     branch = subbranch.branch
+    if _read_only(request, branch.project):
+        return redirect('branch_history', branch_id=branch.id)
     
     if request.method == 'POST':
         form = SubBranchForm(request.POST, instance=subbranch)
@@ -277,16 +509,16 @@ def edit_subbranch(request, subbranch_id):
 @login_required
 @require_POST
 def delete_subbranch(request, subbranch_id):
-    subbranch = get_object_or_404(SubBranch, id=subbranch_id, branch__project__user=request.user)
+    subbranch = get_object_or_404(SubBranch.objects.active().select_related('branch__project'),
+                                  id=subbranch_id, branch__project__user=request.user)
     branch = subbranch.branch
     branch_id = branch.id
+    if _read_only(request, branch.project):
+        return redirect('branch_history', branch_id=branch_id)
     
-    # Delete the subbranch
+    # Delete the subbranch (its amount is taken off the branch total)
     subbranch.delete()
     
-    # Recalculate branch total
-    branch.recalculate_total_spent()
-    
     messages.success(request, 'Entry deleted successfully and amount added back!')
     return redirect('branch_history', branch_id=branch_id)
 
@@ -295,9 +527,13 @@ def delete_subbranch(request, subbranch_id):
 # EDIT RELEASED HISTORY
 # ═══════════════════════════════════════════════════════════
 @login_required
+@project_etag
 def edit_released_history(request, history_id):
-    history = get_object_or_404(ReleasedHistory, id=history_id, project__user=request.user)
+    history = get_object_or_404(ReleasedHistory.objects.active().select_related('project'),
+                                id=history_id, project__user=request.user)
     project = history.project
+    if _read_only(request, project):
+        return redirect('released_history', project_id=project.id)
     
     if request.method == 'POST':
         form = ReleasedHistoryForm(request.POST, instance=history)
@@ -317,17 +553,15 @@ def edit_released_history(request, history_id):
 @login_required
 @require_POST
 def delete_released_history(request, history_id):
-    history = get_object_or_404(ReleasedHistory, id=history_id, project__user=request.user)
-    project = history.project
-    project_id = project.id
+    history = get_object_or_404(ReleasedHistory.objects.active().select_related('project'),
+                                id=history_id, project__user=request.user)
+    project_id = history.project_id
+    if _read_only(request, history.project):
+        return redirect('released_history', project_id=project_id)
     
-    # Delete the released history
+    # Delete the released history (its amount is taken off total_released)
     history.delete()
     
-    # Recalculate project total_released
-    project.total_released = sum(rh.amount for rh in project.released_history.all())
-    project.save()
-    
     messages.success(request, 'Released entry deleted successfully and amount added back!')
     return redirect('released_history', project_id=project_id)
 
@@ -335,167 +569,168 @@ def delete_released_history(request, history_id):
 # ═══════════════════════════════════════════════════════════
 # RELEASED HISTORY
 # ═══════════════════════════════════════════════════════════
-@login_required
-def released_history(request, project_id):
-    project = get_object_or_404(Project, id=project_id, user=request.user)
-    history = project.released_history.all()
+@async_login_required
+@project_etag
+async def released_history(request, project_id):
+    user = await request.auser()
+    project = await aload_project_snapshot(user, project_id)
+    if project.archived_at:
+        page = await sync_to_async(paginate_rows)(
+            archives.releases(project),
+            ReleasedHistory,
+            HISTORY_ORDERING,
+            cursor=request.GET.get('after'),
+            page_size=page_size_from(request),
+        )
+    else:
+        page = await apaginate(
+            project.released_history.all(),
+            HISTORY_ORDERING,
+            cursor=request.GET.get('after'),
+            page_size=page_size_from(request),
+        )
     
     context = {
         'project': project,
-        'history': history,
+        'history': page.items,
+        'page': page,
     }
-    return render(request, 'released_history.html', context)
+    return await arender(request, 'released_history.html', context)
 
 
 # ═══════════════════════════════════════════════════════════
-# EXPORT PROJECT TO PDF
+# ANALYTICS
 # ═══════════════════════════════════════════════════════════
 @login_required
-def export_project_pdf(request, project_id):
-    project = get_object_or_404(Project, id=project_id, user=request.user)
-    
-    # Create PDF response
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="CiviTrack_{project.name}_{datetime.now().strftime("%Y%m%d")}.pdf"'
-    
-    # Create PDF document
-    doc = SimpleDocTemplate(response, pagesize=A4)
-    story = []
-    styles = getSampleStyleSheet()
-    
-    # Custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        textColor=colors.HexColor('#1E40AF'),
-        spaceAfter=12,
-        fontName='Helvetica-Bold'
+@project_etag
+def project_analytics(request, project_id):
+    project = load_project_snapshot(request.user, project_id)
+    first, last = analytics.month_range(
+        project,
+        first=analytics.parse_month(request.GET.get('from')),
+        last=analytics.parse_month(request.GET.get('to')),
     )
     
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=12,
-        textColor=colors.HexColor('#1E3A8A'),
-        spaceAfter=8,
-        spaceBefore=8,
-        fontName='Helvetica-Bold'
+    context = {
+        'project': project,
+        'first_month': first,
+        'last_month': last,
+        **analytics.project_analytics(project, first, last),
+    }
+    return render(request, 'project_analytics.html', context)
+
+
+# ═══════════════════════════════════════════════════════════
+# EXPORT PROJECT TO PDF
+# ═══════════════════════════════════════════════════════════
+def _pdf_response(project, name):
+    return FileResponse(
+        open(exports.artifact_path(name), 'rb'),
+        as_attachment=True,
+        filename=reports.export_filename(project),
+        content_type='application/pdf',
     )
+
+
+# Bytes read from disk per step when streaming a report under ASGI
+PDF_STREAM_BLOCK_SIZE = 64 * 1024
+
+
+async def _apdf_response(project, name):
+    # Under ASGI Django reads a FileResponse's file to the end in a worker
+    # thread before sending any of it, so the report is streamed from an
+    # async generator instead, one block per sync_to_async read. The WSGI
+    # server is still handed a FileResponse (wsgi.file_wrapper).
+    path = exports.artifact_path(name)
     
-    # Project Header
-    story.append(Paragraph(f"CiviTrack - {project.name}", title_style))
-    story.append(Spacer(1, 0.2 * inch))
-    
-    # Summary Section
-    story.append(Paragraph("Project Summary", heading_style))
-    
-    total_spent = sum(b.total_spent for b in project.branches.all())
-    remaining = project.amount - project.total_released
-    
-    summary_data = [
-        ['Total Budget', f"Rs. {project.amount:,.2f}"],
-        ['Total Released', f"Rs. {project.total_released:,.2f}"],
-        ['Total Spent', f"Rs. {total_spent:,.2f}"],
-        ['Remaining Balance', f"Rs. {remaining:,.2f}"],
-        ['Start Date', str(project.start_date)],
-    ]
-    
-    summary_table = Table(summary_data, colWidths=[3*inch, 1.5*inch])
-    summary_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#E0E7FF')),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-    ]))
-    
-    story.append(summary_table)
-    story.append(Spacer(1, 0.3 * inch))
-    
-    # Branches & Expenses Section
-    story.append(Paragraph("Branches & Expenses", heading_style))
-    
-    branches = project.branches.all()
-    if branches:
-        for branch in branches:
-            story.append(Paragraph(f"<b>{branch.name}</b> | Total Spent: Rs. {branch.total_spent:,.2f}", styles['Normal']))
-            
-            # Sub-branches table
-            subbranches_data = [['Expense Name', 'Amount', 'Date']]
-            for subbranch in branch.subbranches.all():
-                subbranches_data.append([
-                    subbranch.name,
-                    f"Rs. {subbranch.amount:,.2f}",
-                    str(subbranch.date)
-                ])
-            
-            if len(subbranches_data) > 1:
-                sb_table = Table(subbranches_data, colWidths=[2.5*inch, 1.2*inch, 1.3*inch])
-                sb_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#DDD6FE')),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-                    ('ALIGN', (2, 0), (2, -1), 'CENTER'),
-                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                    ('FONTSIZE', (0, 0), (-1, -1), 9),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-                    ('TOPPADDING', (0, 0), (-1, -1), 6),
-                    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#F8FAFC')]),
-                ]))
-                story.append(sb_table)
-            else:
-                story.append(Paragraph("<i>No expenses recorded</i>", styles['Normal']))
-            
-            story.append(Spacer(1, 0.15 * inch))
-        
-        story.append(Spacer(1, 0.2 * inch))
-    
-    # Released History Section
-    story.append(Paragraph("Fund Release History", heading_style))
-    
-    released = project.released_history.all()
-    if released:
-        release_data = [['Amount', 'Date']]
-        for release in released:
-            release_data.append([
-                f"Rs. {release.amount:,.2f}",
-                str(release.date)
-            ])
-        
-        release_table = Table(release_data, colWidths=[1.5*inch, 1.5*inch])
-        release_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#D1FAE5')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ('TOPPADDING', (0, 0), (-1, -1), 8),
-            ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#F0FDF4')]),
-        ]))
-        story.append(release_table)
-    else:
-        story.append(Paragraph("<i>No fund releases recorded</i>", styles['Normal']))
-    
-    story.append(Spacer(1, 0.3 * inch))
-    
-    # Footer
-    footer_text = f"<i>Export Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | Exported by: {request.user.email}</i>"
-    story.append(Paragraph(footer_text, styles['Normal']))
+    async def blocks():
+        pdf = await sync_to_async(open)(path, 'rb')
+        try:
+            while block := await sync_to_async(pdf.read)(PDF_STREAM_BLOCK_SIZE):
+                yield block
+        finally:
+            await sync_to_async(pdf.close)()
     
-    # Build PDF
-    doc.build(story)
+    response = StreamingHttpResponse(blocks(), content_type='application/pdf')
+    response['Content-Length'] = str(await sync_to_async(os.path.getsize)(path))
+    response['Content-Disposition'] = content_disposition_header(True, reports.export_filename(project))
     return response
 
 
+@async_login_required
+@project_etag
+async def export_project_pdf(request, project_id):
+    user = await request.auser()
+    project = await aload_project_snapshot(user, project_id, branches=True)
+    
+    # Served straight from the cache while the project is unchanged; a render
+    # (reportlab) runs in a worker thread, off the event loop
+    name = await sync_to_async(exports.get_or_render_export)(project)
+    if isinstance(request, ASGIRequest):
+        return await _apdf_response(project, name)
+    return _pdf_response(project, name)
+
+
+def _export_job_payload(job):
+    payload = {
+        'id': job.id,
+        'project_id': job.project_id,
+        'status': job.status,
+        'content_version': job.content_version,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'status_url': reverse('export_job_status', args=[job.id]),
+    }
+    if job.status == ExportJob.STATUS_DONE:
+        payload['download_url'] = reverse('export_job_download', args=[job.id])
+    if job.status == ExportJob.STATUS_FAILED:
+        payload['error'] = job.error
+    return payload
+
+
+@login_required
+@require_POST
+def start_export_job(request, project_id):
+    project = get_object_or_404(Project, id=project_id, user=request.user)
+    job = exports.enqueue_export(project, request.user)
+    return JsonResponse(_export_job_payload(job), status=202)
+
+
+@login_required
+def export_job_status(request, job_id):
+    job = get_object_or_404(ExportJob, id=job_id, user=request.user)
+    return JsonResponse(_export_job_payload(job))
+
+
+@login_required
+def export_job_download(request, job_id):
+    job = get_object_or_404(ExportJob.objects.select_related('project'), id=job_id, user=request.user)
+    if job.status != ExportJob.STATUS_DONE:
+        return JsonResponse({'error': 'Export is not finished yet.', 'status': job.status}, status=409)
+    if not exports.artifact_path(job.file).exists():
+        # The project changed after this export and the old file was dropped
+        return JsonResponse({'error': 'Export is out of date, please start a new one.'}, status=410)
+    return _pdf_response(job.project, job.file)
+
+
+# ═══════════════════════════════════════════════════════════
+# REQUEST STATS (staff)
+# ═══════════════════════════════════════════════════════════
+@staff_member_required
+def request_stats(request):
+    if request.method == 'POST':
+        middleware.store.clear()
+        messages.success(request, 'Request samples cleared.')
+        return redirect('request_stats')
+    
+    context = {
+        'enabled': settings.CIVITRACK_REQUEST_METRICS,
+        'rows': middleware.store.summary(),
+        'samples_per_view': middleware.SAMPLES_PER_VIEW,
+    }
+    return render(request, 'request_stats.html', context)
+
+
 # ═══════════════════════════════════════════════════════════
 # LOGOUT
 # ═══════════════════════════════════════════════════════════